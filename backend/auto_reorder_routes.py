@@ -4,13 +4,14 @@ Automatic reordering based on stock levels and sales patterns
 """
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from offload import OffloadRoute
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_, text
 from typing import List, Optional
 from datetime import datetime, timedelta
 import uuid
 
-router = APIRouter(prefix="/api/auto-reorder", tags=["Auto Reorder"])
+router = APIRouter(prefix="/api/auto-reorder", tags=["Auto Reorder"], route_class=OffloadRoute)
 
 # Database dependency
 def get_db():
@@ -3,6 +3,7 @@ Database Backup Management API Routes
 """
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from offload import OffloadRoute
 from sqlalchemy.orm import Session
 from sqlalchemy import func, text
 from typing import List, Optional
@@ -11,7 +12,7 @@ import uuid
 import os
 import subprocess
 
-router = APIRouter(prefix="/api/backup", tags=["Backup Management"])
+router = APIRouter(prefix="/api/backup", tags=["Backup Management"], route_class=OffloadRoute)
 
 # Database dependency
 def get_db():
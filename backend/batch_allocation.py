@@ -0,0 +1,158 @@
+"""
+FEFO Batch Allocation
+Split a sale quantity across a product's batches, first-expiry-first-out
+
+On Postgres a single statement locks the product's sellable batches with
+FOR UPDATE SKIP LOCKED, walks them in expiry order with a running total,
+decrements each batch it draws from and (optionally) products.stock_quantity,
+and returns the per-batch allocation. Batches another till is holding are
+skipped rather than waited on; if that leaves the sale short, the allocation
+is retried once waiting for the locks, so stock that is really there is
+never reported missing.
+
+Expired batches (and those expiring within FEFO_MIN_DAYS_TO_EXPIRY days) are
+never allocated; a batch expiring today is still sellable by default.
+SELLABLE_EXPIRY / sellable_cutoff() are the one definition of "unexpired"
+shared with scan_index, product_search and sale_ingest. Nothing is clamped: a quantity that cannot be covered raises
+409 and the caller's transaction rolls back.
+"""
+
+import os
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+FEFO_MIN_DAYS_TO_EXPIRY = int(os.getenv("FEFO_MIN_DAYS_TO_EXPIRY", "0"))
+
+# Bind :cutoff to sellable_cutoff()
+SELLABLE_EXPIRY = "expiry_date >= :cutoff"
+
+_ALLOCATE_SQL = f"""
+    WITH locked AS (
+        SELECT id, batch_number, expiry_date, quantity_remaining
+        FROM medicine_batches
+        WHERE product_id = :pid AND is_active AND quantity_remaining > 0 AND {SELLABLE_EXPIRY}
+        ORDER BY expiry_date, id
+        FOR UPDATE {{lock_mode}}
+    ), ranked AS (
+        SELECT id, batch_number, expiry_date, quantity_remaining,
+               SUM(quantity_remaining) OVER (ORDER BY expiry_date, id) AS running
+        FROM locked
+    ), alloc AS (
+        SELECT id, LEAST(quantity_remaining, :qty - (running - quantity_remaining)) AS take
+        FROM ranked
+        WHERE running - quantity_remaining < :qty
+          AND (SELECT SUM(quantity_remaining) FROM locked) >= :qty
+    ), upd AS (
+        UPDATE medicine_batches b
+        SET quantity_remaining = b.quantity_remaining - a.take,
+            quantity_sold = COALESCE(b.quantity_sold, 0) + a.take,
+            updated_at = now()
+        FROM alloc a
+        WHERE b.id = a.id
+        RETURNING b.id, b.batch_number, b.expiry_date, a.take
+    ), prod AS (
+        UPDATE products
+        SET stock_quantity = stock_quantity - :qty, updated_at = now()
+        WHERE :update_product AND id = :pid AND stock_quantity >= :qty AND EXISTS (SELECT 1 FROM upd)
+        RETURNING stock_quantity
+    )
+    SELECT CAST(upd.id AS TEXT) AS batch_id, upd.batch_number, upd.expiry_date, upd.take AS quantity,
+           (SELECT stock_quantity FROM prod) AS stock_after
+    FROM upd
+    ORDER BY upd.expiry_date, upd.id
+"""
+
+_SELLABLE_SQL = f"""
+    SELECT CAST(id AS TEXT) AS batch_id, batch_number, expiry_date, quantity_remaining
+    FROM medicine_batches
+    WHERE product_id = :pid AND is_active AND quantity_remaining > 0 AND {SELLABLE_EXPIRY}
+    ORDER BY expiry_date, id
+"""
+
+
+def sellable_cutoff() -> date:
+    """Earliest expiry date that may still be sold today"""
+    return date.today() + timedelta(days=FEFO_MIN_DAYS_TO_EXPIRY)
+
+
+def _has_batches(db, product_id: str) -> bool:
+    return db.execute(
+        text("SELECT 1 FROM medicine_batches WHERE product_id = :pid LIMIT 1"), {"pid": product_id}
+    ).first() is not None
+
+
+def _allocate_postgres(db, product_id: str, quantity, update_product: bool) -> List[Dict]:
+    params = {"pid": product_id, "qty": quantity, "cutoff": sellable_cutoff(), "update_product": update_product}
+    for lock_mode in ("SKIP LOCKED", ""):
+        rows = db.execute(text(_ALLOCATE_SQL.format(lock_mode=lock_mode)), params).mappings().all()
+        if rows:
+            if update_product and rows[0]["stock_after"] is None:
+                raise HTTPException(status_code=409, detail="Insufficient stock quantity")
+            return [dict(r) for r in rows]
+    return []
+
+
+def _allocate_generic(db, product_id: str, quantity, update_product: bool) -> List[Dict]:
+    """Same allocation without row locks (SQLite serialises writers anyway)"""
+    batches = db.execute(text(_SELLABLE_SQL), {"pid": product_id, "cutoff": sellable_cutoff()}).mappings().all()
+    if sum(b["quantity_remaining"] for b in batches) < quantity:
+        return []
+    allocation, remaining = [], quantity
+    for batch in batches:
+        if remaining <= 0:
+            break
+        take = min(batch["quantity_remaining"], remaining)
+        updated = db.execute(text("""
+            UPDATE medicine_batches
+            SET quantity_remaining = quantity_remaining - :take,
+                quantity_sold = COALESCE(quantity_sold, 0) + :take,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = :bid AND quantity_remaining >= :take
+        """), {"take": take, "bid": batch["batch_id"]})
+        if updated.rowcount != 1:
+            raise HTTPException(status_code=409, detail="Batch stock changed during allocation; please retry")
+        allocation.append({**batch, "quantity": take, "stock_after": None})
+        remaining -= take
+    if update_product:
+        row = db.execute(text("""
+            UPDATE products SET stock_quantity = stock_quantity - :qty, updated_at = CURRENT_TIMESTAMP
+            WHERE id = :pid AND stock_quantity >= :qty
+            RETURNING stock_quantity
+        """), {"qty": quantity, "pid": product_id}).first()
+        if row is None:
+            raise HTTPException(status_code=409, detail="Insufficient stock quantity")
+        for entry in allocation:
+            entry["stock_after"] = row[0]
+    for entry in allocation:
+        entry.pop("quantity_remaining", None)
+    return allocation
+
+
+def allocate_fefo(db, product_id: str, quantity, update_product: bool = True) -> Optional[List[Dict]]:
+    """
+    Draw `quantity` of `product_id` from its batches in expiry order.
+
+    Returns [{batch_id, batch_number, expiry_date, quantity, stock_after}], or
+    None when the product has no batches at all (not batch-tracked; the caller
+    handles stock itself). Runs inside the caller's transaction; commit is the
+    caller's job.
+    """
+    if quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+    product_id = str(product_id)
+    if db.get_bind().dialect.name == "postgresql":
+        allocation = _allocate_postgres(db, product_id, quantity, update_product)
+    else:
+        allocation = _allocate_generic(db, product_id, quantity, update_product)
+    if allocation:
+        for entry in allocation:
+            # quantity_remaining is NUMERIC; sale lines are whole units
+            qty = entry["quantity"]
+            entry["quantity"] = int(qty) if qty == int(qty) else float(qty)
+        return allocation
+    if not _has_batches(db, product_id):
+        return None
+    raise HTTPException(status_code=409, detail="Insufficient unexpired batch stock")
@@ -0,0 +1,119 @@
+"""
+Auth Dependency Benchmark
+Counts SQL statements per authenticated request for the legacy dependency
+chain versus the shared request-scoped AuthContext.
+
+Usage (from backend/):
+    ROLE_CACHE_MODE=local python benchmarks/auth_queries.py [--user-id UUID] [--iterations N]
+
+Runs against the configured DATABASE_URL. On SQLite the tables are created
+and a throwaway profile is inserted; elsewhere pass an existing --user-id.
+"""
+
+import argparse
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import event
+from starlette.requests import Request
+
+import main
+from rbac import Permission, RBACHelper
+from role_cache import role_cache
+
+
+class QueryCounter:
+    """Counts statements sent to the engine while active"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def measure(self, fn) -> int:
+        start = self.count
+        fn()
+        return self.count - start
+
+
+def legacy_request(db, token: str):
+    """require_permission + get_current_user as they were before AuthContext"""
+    # require_permission: decode, then uncached role resolution
+    payload = main.jwt.decode(token, main.SECRET_KEY, algorithms=[main.ALGORITHM])
+    roles = main._resolve_roles_for_user(db, payload["sub"])
+    RBACHelper.has_permission(roles, Permission.VIEW_SALES)
+    # get_current_user: second decode and second profile load
+    payload = main.jwt.decode(token, main.SECRET_KEY, algorithms=[main.ALGORITHM])
+    db.query(main.Profile).filter(main.Profile.id == payload["sub"]).first()
+    db.expire_all()
+
+
+def auth_context_request(db, token: str):
+    request = Request({"type": "http", "headers": []})
+    ctx = main._resolve_auth_context(request, token, db)
+    ctx.has_permission(Permission.VIEW_SALES)
+    # A second dependency in the same request reuses the context
+    main._resolve_auth_context(request, token, db).profile
+    db.expire_all()
+
+
+def run(user_id: str, iterations: int):
+    counter = QueryCounter(main.engine)
+    token = main.create_access_token({"sub": user_id})
+    db = main.SessionLocal()
+    try:
+        results = {}
+        for label, fn, warm in (
+            ("legacy (decode x2, profile x2)", legacy_request, False),
+            ("auth context, cold role cache", auth_context_request, False),
+            ("auth context, warm role cache", auth_context_request, True),
+        ):
+            queries = 0
+            start = time.perf_counter()
+            for _ in range(iterations):
+                if not warm:
+                    role_cache.invalidate(user_id)
+                queries += counter.measure(lambda: fn(db, token))
+            elapsed = time.perf_counter() - start
+            results[label] = (queries / iterations, elapsed / iterations * 1000)
+
+        print(f"{'path':<34} {'queries/req':>12} {'ms/req':>10}")
+        for label, (queries, ms) in results.items():
+            print(f"{label:<34} {queries:>12.2f} {ms:>10.3f}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", help="Existing profile id (required outside SQLite)")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    created = None
+    user_id = args.user_id
+    if not user_id:
+        if "sqlite" not in main.DATABASE_URL:
+            parser.error("--user-id is required when DATABASE_URL is not SQLite")
+        main.Base.metadata.create_all(bind=main.engine)
+        user_id = str(uuid.uuid4())
+        db = main.SessionLocal()
+        db.add(main.Profile(id=user_id, full_name="Bench User", email=f"{user_id}@bench.local", role="cashier"))
+        db.commit()
+        db.close()
+        created = user_id
+
+    try:
+        run(user_id, args.iterations)
+    finally:
+        if created:
+            db = main.SessionLocal()
+            db.query(main.Profile).filter(main.Profile.id == created).delete()
+            db.commit()
+            db.close()
@@ -0,0 +1,201 @@
+"""
+POS Checkout
+Compares the old per-line sale flow (POST /api/sales, then one
+/api/sales/items and one payment call per line, each with its own lookups
+and commit) with checkout.checkout() for 1-, 10- and 50-line carts.
+
+Runs against session-private temp tables on DATABASE_URL (Postgres) or an
+in-memory SQLite database; nothing touches the real tables.
+
+Usage (from backend/):
+    python benchmarks/checkout.py [--carts 1,10,50] [--rounds 50]
+    python benchmarks/checkout.py --sqlite
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+from checkout import checkout
+
+# Only the columns the two flows touch; temp tables shadow the real ones for this connection
+SCHEMA = [
+    """CREATE TEMP TABLE products (
+        id TEXT PRIMARY KEY, name TEXT NOT NULL, stock_quantity INTEGER, generic_name TEXT,
+        is_prescription_required BOOLEAN DEFAULT FALSE, updated_at TIMESTAMP)""",
+    """CREATE TEMP TABLE medicine_batches (
+        id TEXT PRIMARY KEY, product_id TEXT NOT NULL, batch_number TEXT, quantity_remaining NUMERIC,
+        quantity_sold NUMERIC DEFAULT 0, updated_at TIMESTAMP)""",
+    """CREATE TEMP TABLE customers (
+        id TEXT PRIMARY KEY, name TEXT, phone TEXT, loyalty_points INTEGER DEFAULT 0,
+        loyalty_tier TEXT, updated_at TIMESTAMP)""",
+    """CREATE TEMP TABLE sales (
+        id TEXT PRIMARY KEY, customer_name TEXT, customer_phone TEXT, customer_email TEXT,
+        total_amount NUMERIC, discount NUMERIC, tax NUMERIC, net_amount NUMERIC, payment_method TEXT,
+        payment_status TEXT, notes TEXT, idempotency_key TEXT UNIQUE, created_by TEXT, created_at TIMESTAMP,
+        updated_at TIMESTAMP)""",
+    """CREATE TEMP TABLE sales_items (
+        id TEXT PRIMARY KEY, sale_id TEXT, product_id TEXT, quantity INTEGER, unit_price NUMERIC,
+        total_price NUMERIC, batch_number TEXT, expiry_date DATE, vat_percentage NUMERIC, created_at TIMESTAMP)""",
+    """CREATE TEMP TABLE sale_payments (
+        id TEXT PRIMARY KEY, sale_id TEXT, amount NUMERIC, method TEXT, status TEXT, created_by TEXT,
+        created_at TIMESTAMP, cleared_at TIMESTAMP)""",
+    """CREATE TEMP TABLE loyalty_transactions (
+        id TEXT PRIMARY KEY, customer_id TEXT, sale_id TEXT, transaction_type TEXT, points INTEGER,
+        balance_after INTEGER, notes TEXT)""",
+    """CREATE TEMP TABLE patient_medication_history (
+        id TEXT PRIMARY KEY, customer_id TEXT, product_id TEXT, sale_id TEXT, product_name TEXT,
+        generic_name TEXT, quantity INTEGER, unit_price NUMERIC, dispensed_at TIMESTAMP,
+        next_refill_date TIMESTAMP)""",
+    """CREATE TEMP TABLE domain_events (
+        id BIGSERIAL PRIMARY KEY, event_type TEXT, aggregate_id TEXT, payload TEXT, status TEXT,
+        attempts INTEGER, available_at TIMESTAMP, last_error TEXT, created_at TIMESTAMP, processed_at TIMESTAMP)""",
+]
+
+
+def seed(session, n_products, rng):
+    for ddl in SCHEMA:
+        if session.get_bind().dialect.name != "postgresql":
+            ddl = ddl.replace("TEMP ", "").replace("BIGSERIAL", "INTEGER")
+        session.execute(text(ddl))
+    products, batches = [], []
+    for i in range(n_products):
+        pid = str(uuid.uuid4())
+        products.append({"id": pid, "name": f"Product {i}", "generic": f"generic-{i % 50}" if i % 3 else None})
+        batches.append({"id": str(uuid.uuid4()), "pid": pid, "bn": f"B{i}"})
+    session.execute(text(
+        "INSERT INTO products (id, name, stock_quantity, generic_name) VALUES (:id, :name, 1000000, :generic)"
+    ), products)
+    session.execute(text(
+        "INSERT INTO medicine_batches (id, product_id, batch_number, quantity_remaining) VALUES (:id, :pid, :bn, 1000000)"
+    ), batches)
+    session.execute(text(
+        "INSERT INTO customers (id, name, phone, loyalty_points) VALUES ('c1', 'Regular', '01700000000', 1000000)"
+    ))
+    session.commit()
+    return products
+
+
+def make_cart(products, lines, rng):
+    picked = rng.sample(range(len(products)), lines)
+    items = [SimpleNamespace(
+        product_id=products[i]["id"], quantity=rng.randint(1, 3), unit_price=round(rng.uniform(5, 200), 2),
+        batch_no=f"B{i}", expiry_date=date.today() + timedelta(days=365), gst_percent=0.0,
+    ) for i in picked]
+    total = sum(it.quantity * it.unit_price for it in items)
+    return SimpleNamespace(
+        customer_name="Regular", customer_phone="01700000000", customer_email=None, customer_id="c1",
+        items=items, payments=[SimpleNamespace(amount=round(total / 2, 2), method="cash"),
+                               SimpleNamespace(amount=round(total, 2), method="bkash")],
+        payment_method="cash", discount=0.0, tax=0.0, coupon_code=None, loyalty_redeem=5,
+        earn_loyalty=True, notes=None,
+    )
+
+
+def legacy_checkout(session, cart):
+    """The old flow: sale, then per line lookup + item + stock + batch + commit, then payments and loyalty"""
+    now = datetime.utcnow()
+    sale_id = str(uuid.uuid4())
+    total = round(sum(it.quantity * it.unit_price for it in cart.items), 2)
+    session.execute(text("""
+        INSERT INTO sales (id, customer_name, customer_phone, total_amount, discount, tax, net_amount,
+                           payment_method, payment_status, created_at)
+        VALUES (:id, :name, :phone, :total, 0, 0, :total, 'cash', 'completed', :now)
+    """), {"id": sale_id, "name": cart.customer_name, "phone": cart.customer_phone, "total": total, "now": now})
+    session.commit()
+    for it in cart.items:
+        session.execute(text("""
+            INSERT INTO sales_items (id, sale_id, product_id, quantity, unit_price, total_price, batch_number, created_at)
+            VALUES (:id, :sid, :pid, :q, :p, :t, :bn, :now)
+        """), {"id": str(uuid.uuid4()), "sid": sale_id, "pid": it.product_id, "q": it.quantity,
+               "p": it.unit_price, "t": it.quantity * it.unit_price, "bn": it.batch_no, "now": now})
+        product = session.execute(text(
+            "SELECT id, name, stock_quantity, generic_name FROM products WHERE id = :pid"
+        ), {"pid": it.product_id}).first()
+        session.execute(text("UPDATE products SET stock_quantity = :s WHERE id = :pid"),
+                        {"s": product[2] - it.quantity, "pid": it.product_id})
+        if product[3]:
+            session.execute(text("SELECT id FROM sales WHERE id = :sid"), {"sid": sale_id}).first()
+            customer = session.execute(text(
+                "SELECT id FROM customers WHERE name = :n OR phone = :p LIMIT 1"
+            ), {"n": cart.customer_name, "p": cart.customer_phone}).first()
+            session.execute(text("""
+                INSERT INTO patient_medication_history (id, customer_id, product_id, sale_id, product_name, quantity, unit_price, dispensed_at)
+                VALUES (:id, :cid, :pid, :sid, :name, :q, :p, :now)
+            """), {"id": str(uuid.uuid4()), "cid": customer[0], "pid": it.product_id, "sid": sale_id,
+                   "name": product[1], "q": it.quantity, "p": it.unit_price, "now": now})
+            session.commit()
+        session.execute(text("""
+            UPDATE medicine_batches SET quantity_remaining = quantity_remaining - :q,
+                   quantity_sold = COALESCE(quantity_sold, 0) + :q
+            WHERE product_id = :pid AND batch_number = :bn
+        """), {"q": it.quantity, "pid": it.product_id, "bn": it.batch_no})
+        session.commit()
+    for p in cart.payments:
+        session.execute(text("""
+            INSERT INTO sale_payments (id, sale_id, amount, method, status, created_at)
+            VALUES (:id, :sid, :a, :m, 'cleared', :now)
+        """), {"id": str(uuid.uuid4()), "sid": sale_id, "a": p.amount, "m": p.method, "now": now})
+        session.commit()
+    points = session.execute(text("SELECT loyalty_points FROM customers WHERE id = 'c1'")).scalar()
+    session.execute(text("UPDATE customers SET loyalty_points = :p WHERE id = 'c1'"),
+                    {"p": points + int(total // 10) - cart.loyalty_redeem})
+    session.commit()
+
+
+def timed(fn, session, carts):
+    timings = []
+    for cart in carts:
+        start = time.perf_counter()
+        fn(session, cart)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    if args.sqlite:
+        url = "sqlite://"
+    else:
+        url = (os.getenv("DATABASE_URL") or "").strip()
+        if not url or "sqlite" in url:
+            sys.exit("DATABASE_URL must point at Postgres (or pass --sqlite)")
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        # One connection for the whole run so the temp tables stay visible across commits
+        session = Session(bind=conn)
+        products = seed(session, max(args.products, 60), rng)
+        print(f"{'lines':>6} {'legacy p50':>11} {'p95':>8} {'checkout p50':>13} {'p95':>8} {'speedup':>8}")
+        for lines in (int(x) for x in args.carts.split(",")):
+            carts = [make_cart(products, lines, rng) for _ in range(args.rounds)]
+            legacy_p50, legacy_p95 = timed(legacy_checkout, session, carts)
+            new_p50, new_p95 = timed(lambda s, c: checkout(s, c, None), session, carts)
+            print(f"{lines:>6} {legacy_p50:>9.1f}ms {legacy_p95:>6.1f}ms {new_p50:>11.1f}ms {new_p95:>6.1f}ms "
+                  f"{legacy_p50 / new_p50:>7.1f}x")
+        session.close()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carts", default="1,10,50", help="Comma-separated cart sizes (lines per sale)")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sqlite", action="store_true", help="Use an in-memory SQLite database")
+    main(parser.parse_args())
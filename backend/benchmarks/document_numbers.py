@@ -0,0 +1,177 @@
+"""
+Document Numbers
+Concurrent chalan creation, comparing the old COUNT(*)-per-month numbering
+with document_numbers.chalan_number's counter row.
+
+Each thread creates chalans (take a number, insert the elc_receive_master
+row, commit). Reports throughput and how many numbers were handed out twice.
+--existing pre-loads that many chalans into the month, to show the COUNT
+growing with the table while the counter stays flat. Postgres runs in a
+throwaway schema on DATABASE_URL; --sqlite uses a temporary database file.
+
+Usage (from backend/):
+    python benchmarks/document_numbers.py [--threads 16] [--chalans 100] [--existing 50000]
+    python benchmarks/document_numbers.py --sqlite --threads 4
+
+Exits with status 1 if the counter path issues a duplicate number.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+from document_numbers import DOCUMENT_COUNTERS_DDL, chalan_number
+
+
+def legacy_number(session, now):
+    if session.get_bind().dialect.name == "postgresql":
+        count = session.execute(text("""
+            SELECT COUNT(*) FROM elc_receive_master
+            WHERE receive_type = 'OP' AND extract(month FROM chalan_date) = :m AND extract(year FROM chalan_date) = :y
+        """), {"m": now.month, "y": now.year}).scalar()
+    else:
+        count = session.execute(text("""
+            SELECT COUNT(*) FROM elc_receive_master
+            WHERE receive_type = 'OP' AND CAST(strftime('%m', chalan_date) AS INTEGER) = :m
+              AND CAST(strftime('%Y', chalan_date) AS INTEGER) = :y
+        """), {"m": now.month, "y": now.year}).scalar()
+    return f"OP{count + 1:06d}{now.month:02d}{now.year}"
+
+
+def counter_number(session, now):
+    return chalan_number(session, "OP", now)
+
+
+def create_chalan(session, number_fn, now):
+    number = number_fn(session, now)
+    session.execute(text("""
+        INSERT INTO elc_receive_master (id, chalan_no, chalan_date, receive_type)
+        VALUES (:id, :no, :at, 'OP')
+    """), {"id": str(uuid.uuid4()), "no": number, "at": now})
+    session.commit()
+
+
+def run(Session, number_fn, threads, per_thread, existing):
+    now = datetime.now()
+    with Session() as s:
+        s.execute(text("DELETE FROM elc_receive_master"))
+        s.execute(text("DELETE FROM document_counters"))
+        if existing:
+            s.execute(text("""
+                INSERT INTO elc_receive_master (id, chalan_no, chalan_date, receive_type)
+                VALUES (:id, :no, :at, 'OP')
+            """), [{"id": str(uuid.uuid4()), "no": f"OP{i + 1:06d}{now.month:02d}{now.year}", "at": now}
+                   for i in range(existing)])
+        s.commit()
+    errors = [0] * threads
+    barrier = threading.Barrier(threads)
+
+    def worker(i):
+        session = Session()
+        barrier.wait()
+        for _ in range(per_thread):
+            try:
+                create_chalan(session, number_fn, now)
+            except OperationalError:
+                # SQLite: "database is locked" when two writers collide
+                session.rollback()
+                errors[i] += 1
+        session.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    with Session() as s:
+        total, distinct = s.execute(text(
+            "SELECT COUNT(*), COUNT(DISTINCT chalan_no) FROM elc_receive_master"
+        )).first()
+    return {
+        "created": total - existing,
+        "duplicates": total - distinct,
+        "errors": sum(errors),
+        "ops_per_s": (threads * per_thread) / elapsed,
+    }
+
+
+def main(args):
+    schema = None
+    tmpdir = None
+    if args.sqlite:
+        tmpdir = tempfile.mkdtemp()
+        engine = create_engine(f"sqlite:///{tmpdir}/numbers.db", connect_args={"timeout": 30})
+    else:
+        url = (os.getenv("DATABASE_URL") or "").strip()
+        if not url or "sqlite" in url:
+            sys.exit("DATABASE_URL must point at Postgres (or pass --sqlite)")
+        schema = f"bench_numbers_{uuid.uuid4().hex[:8]}"
+        engine = create_engine(url, pool_size=args.threads + 2, max_overflow=0)
+
+        @event.listens_for(engine, "connect")
+        def _search_path(dbapi_conn, _record):
+            # Unqualified table names resolve to the scratch schema, never the real tables
+            cur = dbapi_conn.cursor()
+            cur.execute(f"SET search_path TO {schema}")
+            cur.close()
+            dbapi_conn.commit()
+
+    with engine.begin() as conn:
+        if schema:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+        conn.execute(text(
+            "CREATE TABLE elc_receive_master (id TEXT PRIMARY KEY, chalan_no TEXT, chalan_date TIMESTAMP, receive_type TEXT)"
+        ))
+        conn.execute(text("CREATE INDEX idx_bench_receive_type ON elc_receive_master (receive_type, chalan_date)"))
+        conn.execute(text(DOCUMENT_COUNTERS_DDL))
+    Session = sessionmaker(bind=engine)
+
+    failed = False
+    try:
+        print(f"{args.threads} threads x {args.chalans} chalans, {args.existing} existing this month")
+        print(f"{'path':<10} {'ops/s':>9} {'created':>8} {'dupes':>6} {'errors':>7}")
+        for name, fn in (("count", legacy_number), ("counter", counter_number)):
+            r = run(Session, fn, args.threads, args.chalans, args.existing)
+            print(f"{name:<10} {r['ops_per_s']:>9.0f} {r['created']:>8} {r['duplicates']:>6} {r['errors']:>7}")
+            if fn is counter_number and r["duplicates"]:
+                failed = True
+    finally:
+        with engine.begin() as conn:
+            if schema:
+                conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        engine.dispose()
+        if tmpdir:
+            for f in Path(tmpdir).iterdir():
+                f.unlink()
+            os.rmdir(tmpdir)
+
+    if failed:
+        print("FAIL: the counter issued a duplicate chalan number")
+        sys.exit(1)
+    print("OK: no duplicate numbers from the counter")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--chalans", type=int, default=100, help="Chalans created per thread")
+    parser.add_argument("--existing", type=int, default=50000, help="Chalans already issued this month")
+    parser.add_argument("--sqlite", action="store_true", help="Use a temporary SQLite database file")
+    main(parser.parse_args())
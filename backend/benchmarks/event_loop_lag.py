@@ -0,0 +1,78 @@
+"""
+Event Loop Lag Load Test
+Mixes slow report requests with fast POS-style requests against a running
+server and reports fast-request latency next to the server's event loop lag.
+
+Usage (server already running):
+    python benchmarks/event_loop_lag.py --base-url http://localhost:8000 --token JWT \
+        [--slow-path /api/reports/stock/export] [--fast-path /api/health] [--seconds 20]
+
+Run once with OFFLOAD_BLOCKING_ROUTES=false and once with the default to compare.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def hammer(session, url, headers, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            resp = session.get(url, headers=headers, timeout=60)
+            if resp.status_code >= 500:
+                errors.append(resp.status_code)
+        except requests.RequestException as exc:
+            errors.append(str(exc))
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def main(args):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    deadline = time.monotonic() + args.seconds
+    slow_latencies, fast_latencies, errors = [], [], []
+    local = threading.local()
+
+    def worker(path, latencies):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        hammer(local.session, f"{args.base_url}{path}", headers, deadline, latencies, errors)
+
+    with ThreadPoolExecutor(max_workers=args.slow_clients + args.fast_clients) as pool:
+        for _ in range(args.slow_clients):
+            pool.submit(worker, args.slow_path, slow_latencies)
+        for _ in range(args.fast_clients):
+            pool.submit(worker, args.fast_path, fast_latencies)
+
+    lag = requests.get(f"{args.base_url}/api/system/event-loop", timeout=10).json()
+
+    print(f"slow requests: {len(slow_latencies)}  p50 {percentile(slow_latencies, 0.5):.1f} ms")
+    print(f"fast requests: {len(fast_latencies)}  p50 {percentile(fast_latencies, 0.5):.1f} ms  "
+          f"p99 {percentile(fast_latencies, 0.99):.1f} ms  "
+          f"mean {statistics.mean(fast_latencies) if fast_latencies else 0:.1f} ms")
+    print(f"errors: {len(errors)}")
+    print(f"event loop lag: {lag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--slow-path", default="/api/reports/stock/export")
+    parser.add_argument("--fast-path", default="/api/health")
+    parser.add_argument("--slow-clients", type=int, default=8)
+    parser.add_argument("--fast-clients", type=int, default=8)
+    parser.add_argument("--seconds", type=int, default=20)
+    main(parser.parse_args())
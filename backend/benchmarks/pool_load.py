@@ -0,0 +1,77 @@
+"""
+Connection Pool Load Test
+Runs short transactions from concurrent threads against DATABASE_URL under
+each pool mode and compares throughput, latency and physical connects.
+
+Usage (from backend/):
+    python benchmarks/pool_load.py [--threads 20] [--seconds 10] [--modes null,queue,pgbouncer]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+from db_pool import create_pooled_engine, pool_stats
+
+
+def worker(engine, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception as exc:
+            errors.append(str(exc))
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def run_mode(url, mode, threads, seconds):
+    engine = create_pooled_engine(url, mode=mode, label=f"bench-{mode}")
+    latencies, errors = [], []
+    deadline = time.monotonic() + seconds
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in range(threads):
+            pool.submit(worker, engine, deadline, latencies, errors)
+    stats = pool_stats(engine)
+    engine.dispose()
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+    return {
+        "mode": mode,
+        "tx_per_s": len(latencies) / seconds,
+        "p50_ms": pct(0.50),
+        "p99_ms": pct(0.99),
+        "connects": stats.get("connects", 0),
+        "wait_max_ms": stats.get("wait_max_ms", 0.0),
+        "errors": len(errors),
+    }
+
+
+def main(args):
+    url = (os.getenv("DATABASE_URL") or "").strip()
+    if not url or "sqlite" in url:
+        sys.exit("DATABASE_URL must point at Postgres for this benchmark")
+    print(f"{'mode':<10} {'tx/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'connects':>9} {'max wait':>9} {'errors':>7}")
+    for mode in args.modes.split(","):
+        r = run_mode(url, mode.strip(), args.threads, args.seconds)
+        print(f"{r['mode']:<10} {r['tx_per_s']:>8.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+              f"{r['connects']:>9} {r['wait_max_ms']:>9.2f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--modes", default="null,queue,pgbouncer")
+    main(parser.parse_args())
@@ -0,0 +1,180 @@
+"""
+Product Search Latency
+Seeds a synthetic catalogue into session-private temp tables (Postgres) or an
+in-memory SQLite database, replays typeahead queries through
+product_search.search_products and checks p95 against a latency budget.
+
+Usage (from backend/):
+    python benchmarks/product_search.py [--products 100000] [--queries 2000] [--budget-ms 30]
+    python benchmarks/product_search.py --sqlite --products 20000
+
+Exits with status 1 when p95 exceeds --budget-ms.
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+from product_search import SEARCH_INDEX_DDL, search_products
+
+GENERICS = [
+    "paracetamol", "amoxicillin", "omeprazole", "metformin", "atorvastatin", "azithromycin",
+    "cetirizine", "losartan", "amlodipine", "esomeprazole", "ciprofloxacin", "montelukast",
+    "ibuprofen", "diclofenac", "pantoprazole", "levofloxacin", "fexofenadine", "ranitidine",
+    "salbutamol", "gliclazide", "rosuvastatin", "clopidogrel", "doxycycline", "cefixime",
+]
+FORMS = ["tab", "cap", "syrup", "susp", "inj", "cream", "drops"]
+STRENGTHS = ["5mg", "10mg", "20mg", "40mg", "250mg", "500mg", "625mg", "1g", "100ml"]
+
+# Columns the search reads; temp tables shadow the real ones for this connection only
+TEMP_SCHEMA = [
+    """CREATE TEMP TABLE products (
+        id TEXT PRIMARY KEY, name TEXT NOT NULL, generic_name TEXT, brand_name TEXT,
+        sku TEXT, barcode TEXT, stock_quantity INTEGER, selling_price NUMERIC,
+        unit_price NUMERIC, is_prescription_required BOOLEAN DEFAULT FALSE)""",
+    """CREATE TEMP TABLE medicine_batches (
+        id TEXT PRIMARY KEY, product_id TEXT NOT NULL, expiry_date DATE NOT NULL,
+        quantity_remaining NUMERIC NOT NULL, selling_price NUMERIC, mrp NUMERIC,
+        is_active BOOLEAN DEFAULT TRUE)""",
+]
+
+
+def brand(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 8))).capitalize()
+
+
+def synthetic_catalogue(n, rng):
+    products, batches = [], []
+    for i in range(n):
+        generic = rng.choice(GENERICS)
+        b = brand(rng)
+        pid = str(uuid.uuid4())
+        products.append({
+            "id": pid,
+            "name": f"{b} {rng.choice(STRENGTHS)} {rng.choice(FORMS)}",
+            "generic_name": generic,
+            "brand_name": b,
+            "sku": f"SKU-{i:07d}",
+            "barcode": f"{890000000000 + i}",
+            "stock_quantity": rng.randint(0, 500),
+            "price": round(rng.uniform(1, 500), 2),
+        })
+        for _ in range(rng.randint(0, 3)):
+            batches.append({
+                "id": str(uuid.uuid4()),
+                "product_id": pid,
+                "expiry_date": date.today() + timedelta(days=rng.randint(-60, 900)),
+                "qty": rng.randint(0, 200),
+                "price": round(rng.uniform(1, 500), 2),
+            })
+    return products, batches
+
+
+def seed(conn, products, batches, postgres):
+    if postgres:
+        for ddl in TEMP_SCHEMA:
+            conn.execute(text(ddl))
+        for ddl in SEARCH_INDEX_DDL:
+            conn.execute(text(ddl))
+    else:
+        for ddl in TEMP_SCHEMA:
+            conn.execute(text(ddl.replace("TEMP ", "")))
+    conn.execute(text(
+        "INSERT INTO products (id, name, generic_name, brand_name, sku, barcode, stock_quantity, selling_price, unit_price) "
+        "VALUES (:id, :name, :generic_name, :brand_name, :sku, :barcode, :stock_quantity, :price, :price)"
+    ), products)
+    if batches:
+        conn.execute(text(
+            "INSERT INTO medicine_batches (id, product_id, expiry_date, quantity_remaining, selling_price, mrp) "
+            "VALUES (:id, :product_id, :expiry_date, :qty, :price, :price)"
+        ), batches)
+    if postgres:
+        conn.execute(text("ANALYZE products"))
+        conn.execute(text("ANALYZE medicine_batches"))
+
+
+def typeahead_queries(products, count, rng):
+    queries = []
+    for _ in range(count):
+        p = rng.choice(products)
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(p["brand_name"][: rng.randint(2, 6)])
+        elif kind < 0.7:
+            queries.append(p["generic_name"][: rng.randint(3, 8)])
+        elif kind < 0.8:
+            queries.append(p["barcode"])
+        elif kind < 0.9:
+            queries.append(p["sku"][: rng.randint(6, 11)])
+        else:
+            # one-character typo in the brand
+            name = p["brand_name"].lower()
+            i = rng.randrange(len(name))
+            queries.append(name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:])
+    return queries
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    if args.sqlite:
+        url = "sqlite://"
+    else:
+        url = (os.getenv("DATABASE_URL") or "").strip()
+        if not url or "sqlite" in url:
+            sys.exit("DATABASE_URL must point at Postgres (or pass --sqlite)")
+    engine = create_engine(url)
+    postgres = engine.dialect.name == "postgresql"
+
+    print(f"Seeding {args.products} products ({'temp tables' if postgres else 'in-memory SQLite'})...")
+    products, batches = synthetic_catalogue(args.products, rng)
+    queries = typeahead_queries(products, args.queries, rng)
+
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            seed(conn, products, batches, postgres)
+            for q in queries[: min(50, len(queries))]:
+                search_products(conn, q)  # warm caches
+
+            timings, hits = [], 0
+            for q in queries:
+                start = time.perf_counter()
+                hits += bool(search_products(conn, q, args.limit))
+                timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            trans.rollback()
+    engine.dispose()
+
+    timings.sort()
+    pct = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))]
+    p95 = pct(0.95)
+    print(f"queries {len(timings)}  hit rate {hits / len(timings):.1%}")
+    print(f"p50 {pct(0.50):.2f} ms  p95 {p95:.2f} ms  p99 {pct(0.99):.2f} ms  max {timings[-1]:.2f} ms")
+    if p95 > args.budget_ms:
+        print(f"FAIL: p95 {p95:.2f} ms exceeds budget {args.budget_ms} ms")
+        sys.exit(1)
+    print(f"OK: p95 within {args.budget_ms} ms budget")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sqlite", action="store_true", help="Use an in-memory SQLite database (fallback path)")
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+"""
+RBAC Check Microbenchmark
+Compares the set-rebuilding permission checks with the compiled bitmask model.
+
+Usage (from backend/):
+    python benchmarks/rbac_checks.py [--number N]
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rbac import Permission, ROLE_PERMISSIONS, RBACHelper
+
+
+def set_permissions(user_roles):
+    """Previous implementation: rebuild the permission set on every check"""
+    permissions = set()
+    for role in user_roles:
+        if role in ROLE_PERMISSIONS:
+            permissions.update(ROLE_PERMISSIONS[role])
+    return permissions
+
+
+def set_has_permission(user_roles, required_permission):
+    return required_permission in set_permissions(user_roles)
+
+
+def set_has_all_permissions(user_roles, required_permissions):
+    user_permissions = set_permissions(user_roles)
+    return all(perm in user_permissions for perm in required_permissions)
+
+
+def set_payload(user_roles):
+    return {"roles": user_roles, "permissions": [p.value for p in set_permissions(user_roles)]}
+
+
+CASES = [
+    ("has_permission, cashier",
+     lambda: set_has_permission(["cashier"], Permission.CREATE_SALE),
+     lambda: RBACHelper.has_permission(["cashier"], Permission.CREATE_SALE)),
+    ("has_permission, super_admin",
+     lambda: set_has_permission(["super_admin"], Permission.MANAGE_ROLES),
+     lambda: RBACHelper.has_permission(["super_admin"], Permission.MANAGE_ROLES)),
+    ("has_all_permissions, 2 roles",
+     lambda: set_has_all_permissions(["cashier", "accountant"], [Permission.VIEW_SALES, Permission.EXPORT_DATA]),
+     lambda: RBACHelper.has_all_permissions(["cashier", "accountant"], [Permission.VIEW_SALES, Permission.EXPORT_DATA])),
+    ("permissions payload, pharmacist",
+     lambda: set_payload(["pharmacist"]),
+     lambda: RBACHelper.get_permissions_payload(["pharmacist"])),
+]
+
+
+def main(number: int):
+    print(f"{'case':<34} {'set ns/op':>10} {'mask ns/op':>11} {'speedup':>8}")
+    for label, legacy, compiled in CASES:
+        assert bool(legacy()) == bool(compiled())
+        legacy_ns = min(timeit.repeat(legacy, number=number, repeat=5)) / number * 1e9
+        compiled_ns = min(timeit.repeat(compiled, number=number, repeat=5)) / number * 1e9
+        print(f"{label:<34} {legacy_ns:>10.0f} {compiled_ns:>11.0f} {legacy_ns / compiled_ns:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+    main(args.number)
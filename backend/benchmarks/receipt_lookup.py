@@ -0,0 +1,136 @@
+"""
+Receipt Lookup
+Sale lookup by typed receipt code at 1M sales: the old
+`id = :x OR CAST(id AS TEXT) LIKE 'x%'` against short_codes.find_id's
+index range scan on sales.short_code.
+
+Builds a throwaway schema on DATABASE_URL (Postgres only; the point is the
+plan), fills it with --rows sales, applies migrations/020_short_codes.sql,
+then times --lookups random 8-character receipt codes through both queries
+and prints each plan's top node.
+
+Usage (from backend/):
+    python benchmarks/receipt_lookup.py [--rows 1000000] [--lookups 200]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+import short_codes
+
+LEGACY_SQL = "SELECT id FROM sales WHERE CAST(id AS TEXT) = :v OR CAST(id AS TEXT) LIKE :prefix LIMIT 1"
+
+
+def legacy_lookup(session, code):
+    # As before: typed receipt codes are upper-case, ids are stored lower-case
+    return session.execute(text(LEGACY_SQL), {"v": code.lower(), "prefix": f"{code.lower()}%"}).first()
+
+
+def short_code_lookup(session, code):
+    return short_codes.find_id(session, "sales", code)
+
+
+def timed(session, fn, codes):
+    samples, misses = [], 0
+    for code in codes:
+        start = time.perf_counter()
+        misses += fn(session, code) is None
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "misses": misses,
+    }
+
+
+def plan_top(session, sql, params):
+    plan = session.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+    node = plan[0]["Plan"]
+    while node.get("Node Type") == "Limit" and node.get("Plans"):
+        node = node["Plans"][0]
+    return f"{node['Node Type']}" + (f" using {node['Index Name']}" if node.get("Index Name") else "")
+
+
+def main(args):
+    url = (os.getenv("DATABASE_URL") or "").strip()
+    if not url or "sqlite" in url:
+        sys.exit("DATABASE_URL must point at Postgres")
+    schema = f"bench_receipt_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(url)
+
+    @event.listens_for(engine, "connect")
+    def _search_path(dbapi_conn, _record):
+        # Unqualified "sales" resolves to the scratch schema, never the real table
+        cur = dbapi_conn.cursor()
+        cur.execute(f"SET search_path TO {schema}, public")
+        cur.close()
+        dbapi_conn.commit()
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+            conn.execute(text(f"CREATE TABLE {schema}.purchases (id UUID PRIMARY KEY, created_at TIMESTAMP)"))
+            conn.execute(text(f"""
+                CREATE TABLE {schema}.sales (id UUID PRIMARY KEY, net_amount NUMERIC, created_at TIMESTAMP)
+            """))
+            print(f"Loading {args.rows:,} sales...")
+            start = time.perf_counter()
+            conn.execute(text(f"""
+                INSERT INTO {schema}.sales (id, net_amount, created_at)
+                SELECT md5(random()::text || g)::uuid, round((random() * 500)::numeric, 2),
+                       now() - (random() * interval '730 days')
+                FROM generate_series(1, :n) g
+            """), {"n": args.rows})
+            conn.execute(text(f"ANALYZE {schema}.sales"))
+            print(f"  {time.perf_counter() - start:.1f}s")
+
+        print("Applying migrations/020_short_codes.sql (backfill + indexes)...")
+        start = time.perf_counter()
+        short_codes.ensure_short_codes(engine)
+        with engine.begin() as conn:
+            conn.execute(text(f"ANALYZE {schema}.sales"))
+        print(f"  {time.perf_counter() - start:.1f}s")
+
+        with Session(engine) as session:
+            ids = [r[0] for r in session.execute(
+                text("SELECT CAST(id AS TEXT) FROM sales TABLESAMPLE SYSTEM (1) LIMIT :n"), {"n": args.lookups}
+            )]
+            codes = [i[:8].upper() for i in ids]
+            random.shuffle(codes)
+
+            print(f"\n{args.lookups} lookups by 8-character receipt code")
+            print(f"{'query':<12} {'p50 ms':>9} {'p95 ms':>9} {'misses':>7}  plan")
+            legacy = timed(session, legacy_lookup, codes)
+            print(f"{'id LIKE':<12} {legacy['p50']:>9.2f} {legacy['p95']:>9.2f} {legacy['misses']:>7}  "
+                  f"{plan_top(session, LEGACY_SQL, {'v': codes[0].lower(), 'prefix': codes[0].lower() + '%'})}")
+            indexed = timed(session, short_code_lookup, codes)
+            print(f"{'short_code':<12} {indexed['p50']:>9.2f} {indexed['p95']:>9.2f} {indexed['misses']:>7}  "
+                  f"{plan_top(session, 'SELECT id FROM sales WHERE short_code LIKE :p ORDER BY short_code_period DESC LIMIT 1', {'p': codes[0] + '%'})}")
+            if legacy["p50"] and indexed["p50"]:
+                print(f"\nspeedup (p50): {legacy['p50'] / indexed['p50']:.0f}x")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,113 @@
+"""
+Scan Index Rebuild
+Times a cold ScanIndex rebuild and in-memory scan lookups, either against
+DATABASE_URL (read-only) or a synthetic in-memory SQLite catalogue.
+
+Usage (from backend/):
+    python benchmarks/scan_index.py [--rounds 3] [--lookups 10000]
+    python benchmarks/scan_index.py --sqlite --products 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+from scan_index import ScanIndex
+
+SYNTHETIC_SCHEMA = [
+    """CREATE TABLE products (
+        id TEXT PRIMARY KEY, name TEXT, sku TEXT, barcode TEXT, selling_price REAL, unit_price REAL,
+        mrp_unit REAL, vat_percentage REAL, cgst_percentage REAL, sgst_percentage REAL,
+        igst_percentage REAL, max_discount_percentage REAL, is_prescription_required BOOLEAN,
+        stock_quantity INTEGER)""",
+    """CREATE TABLE medicine_batches (
+        id TEXT PRIMARY KEY, product_id TEXT, batch_number TEXT, expiry_date DATE,
+        quantity_remaining REAL, selling_price REAL, mrp REAL, discount_percentage REAL,
+        is_active BOOLEAN)""",
+]
+
+
+def seed_sqlite(session, n, rng):
+    for ddl in SYNTHETIC_SCHEMA:
+        session.execute(text(ddl))
+    products, batches = [], []
+    for i in range(n):
+        pid = str(uuid.uuid4())
+        price = round(rng.uniform(1, 500), 2)
+        products.append({"id": pid, "name": f"Product {i}", "sku": f"SKU-{i:07d}", "barcode": f"{890000000000 + i}",
+                         "price": price, "vat": rng.choice([0, 5, 7.5, 15]), "stock": rng.randint(0, 500)})
+        for b in range(rng.randint(0, 3)):
+            batches.append({"id": str(uuid.uuid4()), "pid": pid, "bn": f"B{i}-{b}",
+                            "exp": (date.today() + timedelta(days=rng.randint(-60, 900))).isoformat(),
+                            "qty": rng.randint(1, 200), "price": price})
+    session.execute(text(
+        "INSERT INTO products VALUES (:id, :name, :sku, :barcode, :price, :price, :price, :vat, 0, 0, 0, 0, 0, :stock)"
+    ), products)
+    if batches:
+        session.execute(text(
+            "INSERT INTO medicine_batches VALUES (:id, :pid, :bn, :exp, :qty, :price, :price, 0, 1)"
+        ), batches)
+    session.commit()
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    if args.sqlite:
+        engine = create_engine("sqlite://")
+    else:
+        url = (os.getenv("DATABASE_URL") or "").strip()
+        if not url:
+            sys.exit("DATABASE_URL is not set (or pass --sqlite)")
+        engine = create_engine(url)
+    session = sessionmaker(bind=engine)()
+    if args.sqlite:
+        print(f"Seeding {args.products} synthetic products into in-memory SQLite...")
+        seed_sqlite(session, args.products, rng)
+
+    build_ms = []
+    index = None
+    for _ in range(args.rounds):
+        index = ScanIndex()
+        count = index.rebuild(session)
+        build_ms.append(index.last_build_ms)
+    print(f"cold rebuild: {count} products, {index.stats()['codes']} codes, "
+          f"min {min(build_ms):.0f} ms, max {max(build_ms):.0f} ms over {args.rounds} rounds")
+
+    codes = list(index._codes)
+    if not codes:
+        print("no codes indexed; skipping lookups")
+        return
+    timings = []
+    for _ in range(args.lookups):
+        code = rng.choice(codes)
+        start = time.perf_counter()
+        index.lookup(session, code)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    timings.sort()
+    pct = lambda p: timings[min(len(timings) - 1, int(len(timings) * p))]
+    print(f"lookup: p50 {pct(0.5):.1f} us  p99 {pct(0.99):.1f} us  hits {index.hits}  db loads {index.reloads}")
+    session.close()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sqlite", action="store_true", help="Benchmark a synthetic in-memory SQLite catalogue")
+    main(parser.parse_args())
@@ -0,0 +1,87 @@
+"""
+List Serialization
+Compares the per-row Pydantic path used by the list endpoints with the
+fast_json row projection, on synthetic medicine-batch rows.
+
+Usage (from backend/):
+    python benchmarks/serialization.py [--rows 10000,100000] [--repeat 3]
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+
+import fast_json
+from fast_json import dumps, project_rows
+from pharmacy_models import MedicineBatchResponse
+from pharmacy_routes import _BATCH_LIST_COERCE, _BATCH_LIST_FIELDS
+
+
+def synthetic_rows(n, rng):
+    now = datetime.utcnow()
+    rows = []
+    for i in range(n):
+        price = Decimal(f"{rng.uniform(1, 500):.2f}")
+        received = Decimal(rng.randint(10, 500))
+        rows.append((
+            uuid.uuid4(), str(uuid.uuid4()), f"B{i:06d}", date.today() - timedelta(days=30),
+            date.today() + timedelta(days=rng.randint(1, 900)), None, uuid.uuid4(),
+            received, received - 5, Decimal(5), Decimal(0), Decimal(0),
+            price, price * Decimal("1.2"), price * Decimal("1.1"), Decimal(0),
+            None, f"R-{i % 40}", None, True, False, now, now,
+        ))
+    return rows
+
+
+def legacy(rows):
+    """What the endpoints did: dict per row -> response model -> jsonable_encoder -> json"""
+    fields = _BATCH_LIST_FIELDS
+    models = []
+    for row in rows:
+        values = dict(zip(fields, row))
+        for name, convert in _BATCH_LIST_COERCE.items():
+            values[name] = convert(values[name])
+        models.append(MedicineBatchResponse(**values))
+    return json.dumps(jsonable_encoder(models)).encode()
+
+
+def fast(rows):
+    return dumps(project_rows(rows, _BATCH_LIST_FIELDS, _BATCH_LIST_COERCE))
+
+
+def best_of(fn, rows, repeat):
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(fn(rows))
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, size
+
+
+def main(args):
+    rng = random.Random(42)
+    encoder = "orjson" if fast_json.orjson is not None and fast_json.FAST_JSON_ENABLED else "json"
+    print(f"fast path encoder: {encoder}")
+    print(f"{'rows':>8} {'legacy ms':>10} {'fast ms':>10} {'speedup':>8} {'bytes':>12}")
+    for n in (int(x) for x in args.rows.split(",")):
+        rows = synthetic_rows(n, rng)
+        legacy_ms, _ = best_of(legacy, rows, args.repeat)
+        fast_ms, size = best_of(fast, rows, args.repeat)
+        print(f"{n:>8} {legacy_ms:>10.1f} {fast_ms:>10.1f} {legacy_ms / fast_ms:>7.1f}x {size:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000")
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
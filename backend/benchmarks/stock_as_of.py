@@ -0,0 +1,177 @@
+"""
+Stock As Of
+Point-in-time stock over a year of movements: summing stock_transactions up
+to the date (the only way before the ledger) against stock_ledger's latest
+snapshot plus one interval of running balances.
+
+Builds a throwaway schema on DATABASE_URL (Postgres only), applies
+migrations/022_stock_ledger.sql, loads --movements synthetic movements over
+--days days into both stock_transactions and stock_ledger, takes the daily
+snapshots through stock_ledger.take_stock_snapshot, then times --queries
+random dates through both paths and checks they agree.
+
+Usage (from backend/):
+    python benchmarks/stock_as_of.py [--products 2000] [--movements 1000000] [--days 365] [--queries 20]
+
+Exits with status 1 if the ledger disagrees with the transaction history.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+import stock_ledger
+
+OPENING = 1000
+
+LEGACY_SQL = text("""
+    SELECT CAST(product_id AS TEXT) AS product_id,
+           SUM(CASE WHEN transaction_type IN ('purchase', 'sales_return', 'opening_stock', 'stock_adjustment_in')
+                    THEN quantity ELSE -quantity END) AS quantity
+    FROM stock_transactions
+    WHERE created_at < :at
+    GROUP BY product_id
+""")
+
+
+def legacy_as_of(session, at):
+    return {r[0]: float(r[1]) for r in session.execute(LEGACY_SQL, {"at": at}) if r[1]}
+
+
+def ledger_as_of(session, at):
+    return {i["product_id"]: i["quantity"] for i in stock_ledger.stock_as_of(session, at)["items"]}
+
+
+def timed(fn, session, dates):
+    samples, results = [], []
+    for at in dates:
+        start = time.perf_counter()
+        results.append(fn(session, at))
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples), results
+
+
+def load(engine, schema, args, start):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+        conn.execute(text("CREATE TABLE products (id UUID PRIMARY KEY, stock_quantity INTEGER)"))
+        conn.execute(text(
+            "CREATE TABLE medicine_batches (id UUID PRIMARY KEY, product_id UUID, store_id UUID, quantity_remaining NUMERIC)"
+        ))
+        conn.execute(text("CREATE TABLE product_stock (id UUID PRIMARY KEY, product_id UUID, store_id UUID, current_qty NUMERIC)"))
+        conn.execute(text("""
+            CREATE TABLE stock_transactions (
+                id BIGSERIAL PRIMARY KEY, product_id UUID, transaction_type TEXT, quantity INTEGER, created_at TIMESTAMPTZ
+            )
+        """))
+        conn.execute(text("CREATE INDEX idx_bench_trans_product ON stock_transactions (product_id)"))
+        conn.execute(text("CREATE INDEX idx_bench_trans_created ON stock_transactions (created_at DESC)"))
+
+    # Triggers, indexes and the opening snapshot (empty here; replaced below)
+    stock_ledger.ensure_stock_ledger(engine)
+
+    print(f"Loading {args.movements:,} movements over {args.days} days for {args.products:,} products...")
+    t0 = time.perf_counter()
+    params = {"n": args.products, "m": args.movements, "days": args.days, "start": start, "opening": OPENING}
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM stock_ledger_snapshots"))
+        conn.execute(text("""
+            INSERT INTO stock_ledger_snapshots (snapshot_at, level, product_id, balance)
+            SELECT :start, 'product', md5('p' || k)::uuid::text, :opening FROM generate_series(1, :n) k
+        """), params)
+        conn.execute(text("""
+            INSERT INTO stock_transactions (product_id, transaction_type, quantity, created_at)
+            SELECT md5('p' || k)::uuid, 'opening_stock', :opening, :start FROM generate_series(1, :n) k
+        """), params)
+        conn.execute(text("""
+            CREATE TEMP TABLE moves AS
+            SELECT g, md5('p' || (1 + g % :n))::uuid::text AS product_id,
+                   CASE WHEN random() < 0.3 THEN 1 + (random() * 40)::int ELSE -(1 + (random() * 10)::int) END AS q,
+                   CAST(:start AS TIMESTAMPTZ) + (g::float / :m) * (:days * interval '1 day') AS t
+            FROM generate_series(1, :m) g
+        """), params)
+        conn.execute(text("""
+            INSERT INTO stock_transactions (product_id, transaction_type, quantity, created_at)
+            SELECT product_id::uuid, CASE WHEN q > 0 THEN 'purchase' ELSE 'sales' END, abs(q), t FROM moves
+        """))
+        conn.execute(text("""
+            INSERT INTO stock_ledger (level, product_id, quantity, balance, occurred_at)
+            SELECT 'product', product_id, q, :opening + SUM(q) OVER (PARTITION BY product_id ORDER BY t, g), t
+            FROM moves ORDER BY t, g
+        """), params)
+        conn.execute(text("ANALYZE stock_transactions"))
+        conn.execute(text("ANALYZE stock_ledger"))
+    print(f"  {time.perf_counter() - t0:.1f}s")
+
+    print("Taking daily snapshots...")
+    t0 = time.perf_counter()
+    with Session(engine) as session:
+        for day in range(1, args.days + 1):
+            stock_ledger.take_stock_snapshot(session, start + timedelta(days=day))
+        session.execute(text("ANALYZE stock_ledger_snapshots"))
+        session.commit()
+    print(f"  {time.perf_counter() - t0:.1f}s")
+
+
+def main(args):
+    url = (os.getenv("DATABASE_URL") or "").strip()
+    if not url or "sqlite" in url:
+        sys.exit("DATABASE_URL must point at Postgres")
+    schema = f"bench_ledger_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(url)
+
+    @event.listens_for(engine, "connect")
+    def _search_path(dbapi_conn, _record):
+        # Unqualified table names resolve to the scratch schema, never the real tables
+        cur = dbapi_conn.cursor()
+        cur.execute(f"SET search_path TO {schema}")
+        cur.close()
+        dbapi_conn.commit()
+
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=args.days + 1)
+    failed = False
+    try:
+        load(engine, schema, args, start)
+        dates = [start + timedelta(seconds=random.uniform(3600, args.days * 86400)) for _ in range(args.queries)]
+        with Session(engine) as session:
+            print(f"\n{args.queries} point-in-time queries (all products)")
+            print(f"{'path':<20} {'p50 ms':>9} {'max ms':>9}")
+            legacy_p50, legacy_max, expected = timed(legacy_as_of, session, dates)
+            print(f"{'sum transactions':<20} {legacy_p50:>9.1f} {legacy_max:>9.1f}")
+            ledger_p50, ledger_max, actual = timed(ledger_as_of, session, dates)
+            print(f"{'ledger + snapshot':<20} {ledger_p50:>9.1f} {ledger_max:>9.1f}")
+            print(f"\nspeedup (p50): {legacy_p50 / ledger_p50:.0f}x")
+        mismatches = sum(1 for e, a in zip(expected, actual) if e != a)
+        failed = mismatches > 0
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        engine.dispose()
+
+    if failed:
+        print(f"FAIL: ledger disagrees with stock_transactions on {mismatches} of {args.queries} dates")
+        sys.exit(1)
+    print("OK: ledger balances match the transaction history")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--movements", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--queries", type=int, default=20)
+    main(parser.parse_args())
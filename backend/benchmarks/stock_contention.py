@@ -0,0 +1,175 @@
+"""
+Stock Contention
+Many threads selling the same hot product at once, comparing the old
+read-modify-write (SELECT stock, compute in Python, UPDATE with the result)
+with stock_service.adjust_stock's conditional in-database decrement.
+
+Reports throughput and lost updates (units sold that the final stock does
+not account for). Postgres runs in a throwaway schema on DATABASE_URL;
+--sqlite uses a temporary database file.
+
+Usage (from backend/):
+    python benchmarks/stock_contention.py [--threads 16] [--sales 200] [--work-ms 2]
+    python benchmarks/stock_contention.py --sqlite --threads 4
+
+Exits with status 1 if the conditional path loses an update or oversells.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+from stock_service import adjust_stock
+
+PRODUCT_ID = "bench-hot-product"
+
+
+def legacy_sale(session, work_s):
+    stock = session.execute(text("SELECT stock_quantity FROM products WHERE id = :pid"), {"pid": PRODUCT_ID}).scalar()
+    if work_s:
+        time.sleep(work_s)  # rest of the request (item insert, history, batch) between read and write
+    if stock < 1:
+        session.rollback()
+        return False
+    session.execute(text("UPDATE products SET stock_quantity = :s WHERE id = :pid"), {"s": stock - 1, "pid": PRODUCT_ID})
+    session.commit()
+    return True
+
+
+def service_sale(session, work_s):
+    if work_s:
+        time.sleep(work_s)
+    try:
+        adjust_stock(session, PRODUCT_ID, -1)
+    except HTTPException:
+        session.rollback()
+        return False
+    session.commit()
+    return True
+
+
+def run(Session, sale, threads, sales_per_thread, initial, work_s):
+    with Session() as s:
+        s.execute(text("UPDATE products SET stock_quantity = :n WHERE id = :pid"), {"n": initial, "pid": PRODUCT_ID})
+        s.commit()
+    sold, errors = [0] * threads, [0] * threads
+    barrier = threading.Barrier(threads)
+
+    def worker(i):
+        session = Session()
+        barrier.wait()
+        for _ in range(sales_per_thread):
+            try:
+                sold[i] += sale(session, work_s)
+            except OperationalError:
+                # SQLite: "database is locked" when two read-then-write transactions collide
+                session.rollback()
+                errors[i] += 1
+        session.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    with Session() as s:
+        final = s.execute(text("SELECT stock_quantity FROM products WHERE id = :pid"), {"pid": PRODUCT_ID}).scalar()
+    total_sold = sum(sold)
+    return {
+        "sold": total_sold,
+        "errors": sum(errors),
+        "final": final,
+        "lost": total_sold - (initial - final) if final >= 0 else None,
+        "oversold": final < 0,
+        "ops_per_s": (threads * sales_per_thread) / elapsed,
+        "elapsed_s": elapsed,
+    }
+
+
+def main(args):
+    schema = None
+    tmpdir = None
+    if args.sqlite:
+        tmpdir = tempfile.mkdtemp()
+        engine = create_engine(f"sqlite:///{tmpdir}/contention.db", connect_args={"timeout": 30})
+    else:
+        url = (os.getenv("DATABASE_URL") or "").strip()
+        if not url or "sqlite" in url:
+            sys.exit("DATABASE_URL must point at Postgres (or pass --sqlite)")
+        schema = f"bench_stock_{uuid.uuid4().hex[:8]}"
+        engine = create_engine(url, pool_size=args.threads + 2, max_overflow=0)
+
+        @event.listens_for(engine, "connect")
+        def _search_path(dbapi_conn, _record):
+            # Unqualified "products" resolves to the scratch schema, never the real table
+            cur = dbapi_conn.cursor()
+            cur.execute(f"SET search_path TO {schema}")
+            cur.close()
+            dbapi_conn.commit()
+
+    with engine.begin() as conn:
+        if schema:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+        conn.execute(text("CREATE TABLE products (id TEXT PRIMARY KEY, stock_quantity INTEGER, updated_at TIMESTAMP)"))
+        conn.execute(text("INSERT INTO products (id, stock_quantity) VALUES (:pid, 0)"), {"pid": PRODUCT_ID})
+    Session = sessionmaker(bind=engine)
+
+    # Enough stock for every attempt, so any shortfall is a lost update rather than a sell-out
+    initial = args.threads * args.sales
+    work_s = args.work_ms / 1000
+    failed = False
+    try:
+        print(f"{args.threads} threads x {args.sales} sales, {args.work_ms} ms work per sale, stock {initial}")
+        print(f"{'path':<12} {'ops/s':>9} {'sold':>7} {'final':>7} {'lost':>6} {'errors':>7}")
+        for name, sale in (("read-write", legacy_sale), ("conditional", service_sale)):
+            r = run(Session, sale, args.threads, args.sales, initial, work_s)
+            print(f"{name:<12} {r['ops_per_s']:>9.0f} {r['sold']:>7} {r['final']:>7} "
+                  f"{'n/a' if r['lost'] is None else r['lost']:>6} {r['errors']:>7}")
+            if sale is service_sale and (r["oversold"] or r["lost"]):
+                failed = True
+
+        # Oversell check: stock for half the attempts; the conditional path must stop at zero
+        r = run(Session, service_sale, args.threads, args.sales, initial // 2, work_s)
+        print(f"sell-out: sold {r['sold']} of {initial // 2}, final stock {r['final']}")
+        if r["final"] != 0 or r["sold"] != initial // 2:
+            failed = True
+    finally:
+        with engine.begin() as conn:
+            if schema:
+                conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        engine.dispose()
+        if tmpdir:
+            for f in Path(tmpdir).iterdir():
+                f.unlink()
+            os.rmdir(tmpdir)
+
+    if failed:
+        print("FAIL: conditional decrements lost updates or oversold")
+        sys.exit(1)
+    print("OK: zero lost updates, no oversell")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--sales", type=int, default=200, help="Sales attempted per thread")
+    parser.add_argument("--work-ms", type=float, default=2.0, help="Simulated request work per sale")
+    parser.add_argument("--sqlite", action="store_true", help="Use a temporary SQLite database file")
+    main(parser.parse_args())
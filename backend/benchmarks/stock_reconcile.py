@@ -0,0 +1,167 @@
+"""
+Stock Reconcile
+Full-database stock reconciliation at 500k batches: stock_reconcile's
+range-parallel check with one worker and with --workers, then a repair pass
+and a re-check.
+
+Loads --products products with --batches batches and a product_stock row
+each, puts --drift of the products out of step (product total or store row),
+and checks every drifted product is found, repaired, and gone on re-check.
+Postgres runs in a throwaway schema on DATABASE_URL; --sqlite uses a
+temporary database file.
+
+Usage (from backend/):
+    python benchmarks/stock_reconcile.py [--products 50000] [--batches 500000] [--workers 4] [--drift 0.01]
+    python benchmarks/stock_reconcile.py --sqlite
+
+Exits with status 1 if drift is missed or survives the repair.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from sqlalchemy import column, create_engine, event, insert, table, text
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+from stock_reconcile import reconcile_stock
+
+CHUNK = 5000
+
+_products = table("products", column("id"), column("name"), column("stock_quantity"))
+_batches = table("medicine_batches", column("id"), column("product_id"), column("quantity_remaining"))
+_product_stock = table("product_stock", column("id"), column("product_id"), column("store_id"), column("current_qty"))
+
+
+def _insert(conn, tbl, rows):
+    for i in range(0, len(rows), CHUNK):
+        conn.execute(insert(tbl).values(rows[i:i + CHUNK]))
+
+
+def load(engine, args):
+    id_type = "UUID" if engine.dialect.name == "postgresql" else "TEXT"
+    rng = random.Random(7)
+    product_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(args.products)]
+    batch_qty = {pid: 0 for pid in product_ids}
+    batches = []
+    for i in range(args.batches):
+        pid = product_ids[i % args.products]
+        qty = rng.randint(0, 200)
+        batch_qty[pid] += qty
+        batches.append({"id": str(uuid.uuid4()), "product_id": pid, "quantity_remaining": qty})
+
+    drifted = set(rng.sample(product_ids, int(args.products * args.drift)))
+    products, stock_rows = [], []
+    for n, pid in enumerate(product_ids):
+        total = batch_qty[pid]
+        off = pid in drifted
+        # Half the drift is in the product total, half in the store row
+        product_total = total + 5 if off and n % 2 == 0 else total
+        store_total = total - 3 if off and n % 2 == 1 else total
+        products.append({"id": pid, "name": f"Product {n}", "stock_quantity": product_total})
+        stock_rows.append({"id": str(uuid.uuid4()), "product_id": pid, "store_id": None, "current_qty": store_total})
+
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE products (id {id_type} PRIMARY KEY, name TEXT, stock_quantity INTEGER,
+                                   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+        """))
+        conn.execute(text(f"""
+            CREATE TABLE medicine_batches (id {id_type} PRIMARY KEY, product_id {id_type}, quantity_remaining NUMERIC,
+                                           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+        """))
+        conn.execute(text(f"""
+            CREATE TABLE product_stock (id {id_type} PRIMARY KEY, product_id {id_type}, store_id {id_type},
+                                        current_qty NUMERIC, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+        """))
+        conn.execute(text("CREATE INDEX idx_bench_batches_product ON medicine_batches (product_id)"))
+        conn.execute(text("CREATE UNIQUE INDEX idx_bench_product_stock ON product_stock (product_id, store_id)"))
+        _insert(conn, _products, products)
+        _insert(conn, _batches, batches)
+        _insert(conn, _product_stock, stock_rows)
+        conn.execute(text("ANALYZE"))
+    return drifted
+
+
+def main(args):
+    schema = None
+    tmpdir = None
+    if args.sqlite:
+        tmpdir = tempfile.mkdtemp()
+        engine = create_engine(f"sqlite:///{tmpdir}/reconcile.db", connect_args={"timeout": 30})
+    else:
+        url = (os.getenv("DATABASE_URL") or "").strip()
+        if not url or "sqlite" in url:
+            sys.exit("DATABASE_URL must point at Postgres (or pass --sqlite)")
+        schema = f"bench_reconcile_{uuid.uuid4().hex[:8]}"
+        engine = create_engine(url, pool_size=args.workers + 2, max_overflow=0)
+
+        @event.listens_for(engine, "connect")
+        def _search_path(dbapi_conn, _record):
+            # Unqualified table names resolve to the scratch schema, never the real tables
+            cur = dbapi_conn.cursor()
+            cur.execute(f"SET search_path TO {schema}")
+            cur.close()
+            dbapi_conn.commit()
+
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE SCHEMA {schema}"))
+    Session = sessionmaker(bind=engine)
+
+    failed = False
+    try:
+        print(f"Loading {args.products:,} products, {args.batches:,} batches...")
+        t0 = time.perf_counter()
+        drifted = load(engine, args)
+        print(f"  {time.perf_counter() - t0:.1f}s, {len(drifted)} products drifted")
+
+        print(f"\n{'run':<22} {'ms':>9} {'checked':>9} {'drift':>7} {'repaired':>9}")
+        runs = [("full, 1 worker", 1, False), (f"full, {args.workers} workers", args.workers, False),
+                (f"repair, {args.workers} workers", args.workers, True), ("re-check", args.workers, False)]
+        reports = {}
+        for name, workers, repair in runs:
+            r = reconcile_stock(Session, "full", repair, workers)
+            reports[name] = r
+            print(f"{name:<22} {r['elapsed_ms']:>9.0f} {r['scanned']:>9} {r['drift_count']:>7} {r['repaired_count']:>9}")
+
+        found = reports["full, 1 worker"]["drift_count"]
+        left = reports["re-check"]["drift_count"]
+        if found != len(drifted):
+            print(f"FAIL: expected {len(drifted)} drifted products, found {found}")
+            failed = True
+        if left:
+            print(f"FAIL: {left} products still drifted after repair")
+            failed = True
+    finally:
+        if schema:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        engine.dispose()
+        if tmpdir:
+            for f in Path(tmpdir).iterdir():
+                f.unlink()
+            os.rmdir(tmpdir)
+
+    if failed:
+        sys.exit(1)
+    print("OK: every drifted product found and repaired")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--batches", type=int, default=500_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--drift", type=float, default=0.01, help="Fraction of products put out of step")
+    parser.add_argument("--sqlite", action="store_true", help="Use a temporary SQLite database file")
+    main(parser.parse_args())
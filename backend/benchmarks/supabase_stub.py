@@ -0,0 +1,98 @@
+"""
+Supabase Stub Server
+Minimal PostgREST/GoTrue stand-in for exercising the HTTP client and circuit
+breaker under injected latency and failures.
+
+Usage:
+    python benchmarks/supabase_stub.py --port 54321 --latency-ms 1500 --failure-rate 0.3
+    SUPABASE_URL=http://127.0.0.1:54321 uvicorn main:app
+
+Endpoints: /rest/v1/profiles, /rest/v1/user_roles, /auth/v1/token, /auth/v1/user,
+/auth/v1/admin/users. Every user is returned with --role.
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = None
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _handle(self):
+        cfg = self.config
+        if cfg.latency_ms:
+            time.sleep(cfg.latency_ms / 1000.0)
+        if random.random() < cfg.failure_rate:
+            self._reply(cfg.failure_status, {"message": "stub failure"})
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        user_id = (query.get("id") or query.get("user_id") or ["eq." + cfg.user_id])[0].split("eq.", 1)[-1]
+        body = self._read_json() if self.command in ("POST", "PATCH") else {}
+
+        if url.path == "/rest/v1/profiles":
+            row = {"id": user_id, "full_name": "Stub User", "email": "stub@example.com",
+                   "phone": None, "role": cfg.role, "created_at": "2024-01-01T00:00:00"}
+            row.update(body if isinstance(body, dict) else {})
+            self._reply(200, [row])
+        elif url.path == "/rest/v1/user_roles":
+            self._reply(200 if self.command == "GET" else 201, [{"user_id": user_id, "role": cfg.role}])
+        elif url.path in ("/auth/v1/token", "/auth/v1/user"):
+            user = {"id": cfg.user_id, "email": body.get("email", "stub@example.com"), "user_metadata": {}}
+            if url.path == "/auth/v1/user":
+                self._reply(200, user)
+            else:
+                self._reply(200, {"access_token": "stub", "refresh_token": "stub", "expires_in": 3600, "user": user})
+        elif url.path == "/auth/v1/admin/users":
+            self._reply(200, {"id": str(uuid.uuid4()), "email": body.get("email"), "user_metadata": body.get("user_metadata", {})})
+        else:
+            self._reply(404, {"message": "not found"})
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PATCH = _handle
+
+    def log_message(self, fmt, *args):
+        if self.config.verbose:
+            super().log_message(fmt, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--role", default="employee")
+    parser.add_argument("--user-id", default=str(uuid.uuid4()))
+    parser.add_argument("--verbose", action="store_true")
+    StubHandler.config = parser.parse_args()
+
+    server = ThreadingHTTPServer((StubHandler.config.host, StubHandler.config.port), StubHandler)
+    print(f"Supabase stub on http://{StubHandler.config.host}:{StubHandler.config.port} "
+          f"(latency {StubHandler.config.latency_ms} ms, failure rate {StubHandler.config.failure_rate})")
+    server.serve_forever()
@@ -0,0 +1,398 @@
+"""
+POS Checkout
+Whole-cart sale (items, payments, loyalty, coupon) in one transaction
+
+Replaces the POST /api/sales + one POST /api/sales/items per line flow:
+- one query reads every product in the cart and validates stock up front
+- sale, items, payments and loyalty entries go in as multi-row INSERTs
+- product and batch stock drop with one conditional UPDATE each
+  (stock_service.py), so a
+  concurrent till that got there first fails this checkout instead of
+  driving stock negative; lines without a batch are drawn FEFO
+  (batch_allocation.py)
+- medication history and reorder alerts are queued as outbox events
+  (outbox.py) in the same transaction
+- everything commits once; any failure rolls the whole cart back
+- a cart carrying an idempotency_key already stored on a sale returns that
+  sale, so a till retrying after a dropped connection never sells twice
+"""
+
+import math
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, column, insert, table, text
+from sqlalchemy.exc import IntegrityError
+
+from batch_allocation import allocate_fefo
+from outbox import emit
+from stock_service import apply_stock_changes
+
+# POS earns one point per this much of the net amount; one point redeems one currency unit
+LOYALTY_EARN_PER_AMOUNT = float(os.getenv("LOYALTY_EARN_PER_AMOUNT", "10"))
+
+_sales = table(
+    "sales",
+    column("id"), column("customer_name"), column("customer_phone"), column("customer_email"),
+    column("total_amount"), column("discount"), column("tax"), column("net_amount"),
+    column("payment_method"), column("payment_status"), column("notes"), column("idempotency_key"),
+    column("created_by"), column("created_at"), column("updated_at"),
+)
+_sales_items = table(
+    "sales_items",
+    column("id"), column("sale_id"), column("product_id"), column("quantity"), column("unit_price"),
+    column("total_price"), column("batch_number"), column("expiry_date"), column("vat_percentage"),
+    column("created_at"),
+)
+_sale_payments = table(
+    "sale_payments",
+    column("id"), column("sale_id"), column("amount"), column("method"), column("status"),
+    column("created_by"), column("created_at"), column("cleared_at"),
+)
+_loyalty_transactions = table(
+    "loyalty_transactions",
+    column("id"), column("customer_id"), column("sale_id"), column("transaction_type"),
+    column("points"), column("balance_after"), column("notes"),
+)
+
+_PRODUCTS_SQL = text("""
+    SELECT id, name, stock_quantity, generic_name, is_prescription_required
+    FROM products
+    WHERE id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+_SALES_BY_KEY_SQL = text("""
+    SELECT idempotency_key, id FROM sales WHERE idempotency_key IN :keys
+""").bindparams(bindparam("keys", expanding=True))
+
+
+def _load_products(db, quantities: Dict[str, int]) -> Dict[str, dict]:
+    rows = db.execute(_PRODUCTS_SQL, {"ids": list(quantities)}).mappings().all()
+    products = {str(r["id"]): r for r in rows}
+    missing = [pid for pid in quantities if pid not in products]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Product not found: {', '.join(missing)}")
+    short = [
+        f"{products[pid]['name']} (available {products[pid]['stock_quantity'] or 0}, requested {qty})"
+        for pid, qty in quantities.items()
+        if (products[pid]["stock_quantity"] or 0) < qty
+    ]
+    if short:
+        raise HTTPException(status_code=400, detail=f"Insufficient stock: {'; '.join(short)}")
+    return products
+
+
+def _decrement_batches(db, batches: Dict[tuple, int]):
+    """One conditional UPDATE for every (product, batch) sold from an explicit batch"""
+    if not batches:
+        return
+    params, whens, keys = {}, [], []
+    for i, ((pid, batch_no), qty) in enumerate(batches.items()):
+        params[f"bp{i}"], params[f"bb{i}"], params[f"bq{i}"] = pid, batch_no, qty
+        match = f"(product_id = :bp{i} AND batch_number = :bb{i})"
+        whens.append(f"WHEN {match} THEN :bq{i}")
+        keys.append(match)
+    delta = f"CASE {' '.join(whens)} END"
+    result = db.execute(text(f"""
+        UPDATE medicine_batches
+        SET quantity_remaining = quantity_remaining - {delta},
+            quantity_sold = COALESCE(quantity_sold, 0) + {delta},
+            updated_at = CURRENT_TIMESTAMP
+        WHERE ({' OR '.join(keys)}) AND quantity_remaining >= {delta}
+    """), params)
+    if result.rowcount != len(batches):
+        raise HTTPException(status_code=409, detail="Batch not found or batch stock insufficient")
+
+
+def _find_customer(db, customer_id: Optional[str], phone: Optional[str]):
+    if customer_id:
+        row = db.execute(text("SELECT id FROM customers WHERE id = :cid"), {"cid": customer_id}).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        return str(row[0])
+    if phone:
+        row = db.execute(text("SELECT id FROM customers WHERE phone = :phone LIMIT 1"), {"phone": phone}).first()
+        return str(row[0]) if row else None
+    return None
+
+
+def _apply_coupon(db, code: str, customer_id: Optional[str], amount: float) -> dict:
+    """Validate with apply_coupon_code() and claim one use; Postgres only"""
+    if db.get_bind().dialect.name != "postgresql":
+        raise HTTPException(status_code=400, detail="Coupon codes are not available on this database")
+    result = db.execute(
+        text("SELECT apply_coupon_code(:code, :cid, :amount)"),
+        {"code": code, "cid": customer_id, "amount": amount},
+    ).scalar() or {}
+    if not result.get("valid"):
+        raise HTTPException(status_code=400, detail=result.get("message") or "Invalid coupon code")
+    claimed = db.execute(text("""
+        UPDATE coupon_codes SET usage_count = COALESCE(usage_count, 0) + 1
+        WHERE id = :id AND (usage_limit IS NULL OR COALESCE(usage_count, 0) < usage_limit)
+    """), {"id": result["coupon_id"]})
+    if claimed.rowcount != 1:
+        raise HTTPException(status_code=409, detail="Coupon usage limit exceeded")
+    return {"coupon_id": result["coupon_id"], "code": code, "discount": round(float(result.get("discount_amount") or 0), 2)}
+
+
+def _apply_loyalty(db, customer_id: str, earn: int, redeem: int) -> int:
+    """Conditional earn/redeem on the customer row; returns the new balance"""
+    row = db.execute(text("""
+        UPDATE customers
+        SET loyalty_points = COALESCE(loyalty_points, 0) + :earn - :redeem,
+            loyalty_tier = CASE
+                WHEN COALESCE(loyalty_points, 0) + :earn - :redeem >= 1000 THEN 'Gold'
+                WHEN COALESCE(loyalty_points, 0) + :earn - :redeem >= 500 THEN 'Silver'
+                ELSE 'Bronze'
+            END,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = :cid AND COALESCE(loyalty_points, 0) >= :redeem
+        RETURNING loyalty_points
+    """), {"cid": customer_id, "earn": earn, "redeem": redeem}).first()
+    if row is None:
+        raise HTTPException(status_code=400, detail="Insufficient loyalty points")
+    return int(row[0])
+
+
+def _medication_lines(lines, products):
+    out = []
+    for line in lines:
+        product = products[str(line.product_id)]
+        if product["generic_name"] or product["is_prescription_required"]:
+            out.append({
+                "product_id": str(line.product_id),
+                "product_name": product["name"],
+                "generic_name": product["generic_name"],
+                "is_prescription_required": bool(product["is_prescription_required"]),
+                "quantity": line.quantity,
+                "unit_price": line.unit_price,
+            })
+    return out
+
+
+def _subtotal(cart) -> float:
+    return round(sum(line.quantity * line.unit_price for line in cart.items), 2)
+
+
+def _earned_points(net_amount: float) -> int:
+    return int(math.floor(net_amount / LOYALTY_EARN_PER_AMOUNT)) if LOYALTY_EARN_PER_AMOUNT > 0 else 0
+
+
+def _redeemable_points(requested: int, payable: float) -> int:
+    """Whole points that fit in `payable`, at most `requested`"""
+    return max(0, min(requested, int(math.floor(round(payable, 2)))))
+
+
+def _sale_rows(cart, sale_id: str, user_id: Optional[str], now, extra_discount: float = 0):
+    """The sales row and sale_payments rows for `cart`; totals come from the lines"""
+    subtotal = _subtotal(cart)
+    discount = round(min(cart.discount + extra_discount, subtotal), 2)
+    net_amount = round(subtotal - discount + cart.tax, 2)
+
+    payments = [p for p in cart.payments if p.amount > 0]
+    paid = round(sum(p.amount for p in payments), 2)
+    payment_method = payments[0].method if payments else cart.payment_method
+    payment_status = "completed" if not payments or paid + 0.01 >= net_amount else "pending"
+
+    sale = {
+        "id": sale_id,
+        "customer_name": cart.customer_name,
+        "customer_phone": cart.customer_phone,
+        "customer_email": cart.customer_email,
+        "total_amount": subtotal,
+        "discount": discount,
+        "tax": cart.tax,
+        "net_amount": net_amount,
+        "payment_method": payment_method,
+        "payment_status": payment_status,
+        "notes": cart.notes,
+        "idempotency_key": getattr(cart, "idempotency_key", None),
+        "created_by": user_id,
+        "created_at": now,
+        "updated_at": now,
+    }
+    payment_rows = [{
+        "id": str(uuid.uuid4()),
+        "sale_id": sale_id,
+        "amount": p.amount,
+        "method": p.method,
+        # Same policy as record_sale_payment: cash clears immediately, the rest await reconciliation
+        "status": "cleared" if p.method == "cash" else "pending",
+        "created_by": user_id,
+        "created_at": now,
+        "cleared_at": now if p.method == "cash" else None,
+    } for p in payments]
+    return sale, payment_rows
+
+
+def _item_rows(sale_id: str, line, parts, now):
+    """One sales_items row per batch the line was drawn from"""
+    if not parts:
+        expiry = line.expiry_date.date() if isinstance(line.expiry_date, datetime) else line.expiry_date
+        parts = [{"batch_number": line.batch_no, "expiry_date": expiry, "quantity": line.quantity}]
+    return [{
+        "id": str(uuid.uuid4()),
+        "sale_id": sale_id,
+        "product_id": str(line.product_id),
+        "quantity": part["quantity"],
+        "unit_price": line.unit_price,
+        "total_price": round(part["quantity"] * line.unit_price, 2),
+        "batch_number": part["batch_number"],
+        "expiry_date": part["expiry_date"],
+        "vat_percentage": line.gst_percent,
+        "created_at": now,
+    } for part in parts]
+
+
+def _items_out(items):
+    return [{
+        **{k: v for k, v in item.items() if k not in ("batch_number", "vat_percentage")},
+        "batch_no": item["batch_number"],
+        "gst_percent": item["vat_percentage"],
+    } for item in items]
+
+
+def find_sales_by_key(db, keys) -> Dict[str, str]:
+    """{idempotency_key: sale_id} for the keys already recorded"""
+    keys = [k for k in keys if k]
+    if not keys:
+        return {}
+    rows = db.execute(_SALES_BY_KEY_SQL, {"keys": keys}).all()
+    return {r[0]: str(r[1]) for r in rows}
+
+
+def replay_sale(db, sale_id: str) -> dict:
+    """Checkout response for a sale that already exists (an idempotent retry)"""
+    sale = db.execute(text("""
+        SELECT id, customer_name, customer_phone, customer_email, total_amount, discount, tax, net_amount,
+               payment_method, payment_status, notes, idempotency_key, created_by, created_at, updated_at
+        FROM sales WHERE id = :sid
+    """), {"sid": sale_id}).mappings().first()
+    items = db.execute(text("""
+        SELECT id, sale_id, product_id, quantity, unit_price, total_price, batch_number, expiry_date,
+               vat_percentage, created_at
+        FROM sales_items WHERE sale_id = :sid
+    """), {"sid": sale_id}).mappings().all()
+    payments = db.execute(
+        text("SELECT id, amount, method, status FROM sale_payments WHERE sale_id = :sid"), {"sid": sale_id}
+    ).mappings().all()
+    return {
+        "sale": dict(sale),
+        "items": _items_out([dict(i) for i in items]),
+        "payments": [dict(p) for p in payments],
+        "loyalty": None,
+        "coupon": None,
+        "duplicate": True,
+    }
+
+
+def checkout(db, cart, user_id: Optional[str]) -> dict:
+    """
+    Create the sale for `cart` (a CheckoutRequest) and commit; rolls back on
+    any error. A cart whose idempotency_key is already recorded returns the
+    stored sale instead of selling again.
+    """
+    key = getattr(cart, "idempotency_key", None)
+    if key:
+        existing = find_sales_by_key(db, [key])
+        if existing:
+            return replay_sale(db, existing[key])
+    try:
+        result = _checkout(db, cart, user_id)
+        db.commit()
+        return result
+    except IntegrityError:
+        db.rollback()
+        # Lost a race with a retry of the same cart; that one's sale stands
+        existing = find_sales_by_key(db, [key])
+        if not existing:
+            raise
+        return replay_sale(db, existing[key])
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _checkout(db, cart, user_id: Optional[str]) -> dict:
+    now = datetime.utcnow()
+    sale_id = str(uuid.uuid4())
+
+    quantities: Dict[str, int] = {}
+    batches: Dict[tuple, int] = {}
+    for line in cart.items:
+        pid = str(line.product_id)
+        quantities[pid] = quantities.get(pid, 0) + line.quantity
+        if line.batch_no:
+            key = (pid, line.batch_no)
+            batches[key] = batches.get(key, 0) + line.quantity
+    products = _load_products(db, quantities)
+
+    subtotal = _subtotal(cart)
+    customer_id = None
+    if cart.customer_id or cart.customer_phone:
+        customer_id = _find_customer(db, cart.customer_id, cart.customer_phone)
+    if cart.loyalty_redeem and not customer_id:
+        raise HTTPException(status_code=400, detail="Loyalty redemption needs a known customer")
+
+    coupon = _apply_coupon(db, cart.coupon_code, customer_id, subtotal) if cart.coupon_code else None
+    coupon_discount = coupon["discount"] if coupon else 0
+    # Points cover whatever the discount and coupon leave payable; only those are deducted
+    redeem = _redeemable_points(cart.loyalty_redeem, subtotal - cart.discount - coupon_discount)
+    sale, payment_rows = _sale_rows(cart, sale_id, user_id, now, redeem + coupon_discount)
+    net_amount = sale["net_amount"]
+    db.execute(insert(_sales).values(sale))
+    if payment_rows:
+        db.execute(insert(_sale_payments).values(payment_rows))
+
+    apply_stock_changes(db, {pid: -qty for pid, qty in quantities.items()})
+    _decrement_batches(db, batches)
+
+    items = []
+    for line in cart.items:
+        parts = None
+        if not line.batch_no:
+            # No batch picked at the till: draw first-expiry-first-out (None = not batch-tracked)
+            parts = allocate_fefo(db, line.product_id, line.quantity, update_product=False)
+        items.extend(_item_rows(sale_id, line, parts, now))
+    db.execute(insert(_sales_items).values(items))
+
+    loyalty = None
+    if customer_id and (cart.loyalty_redeem or cart.earn_loyalty):
+        earn = _earned_points(net_amount)
+        balance = _apply_loyalty(db, customer_id, earn, redeem)
+        entries = []
+        if earn > 0:
+            entries.append({"transaction_type": "earn", "points": earn, "balance_after": balance, "notes": "POS earn"})
+        if redeem > 0:
+            entries.append({"transaction_type": "redeem", "points": -redeem,
+                            "balance_after": balance - earn, "notes": "POS redeem"})
+        if entries:
+            db.execute(insert(_loyalty_transactions).values([
+                {"id": str(uuid.uuid4()), "customer_id": customer_id, "sale_id": sale_id, **e} for e in entries
+            ]))
+        loyalty = {"customer_id": customer_id, "earned": earn, "redeemed": redeem, "balance": balance}
+
+    if coupon:
+        db.execute(text("""
+            INSERT INTO coupon_usage_log (coupon_id, code, customer_id, sale_id, discount_applied, used_by)
+            VALUES (:coupon_id, :code, :cid, :sid, :discount, :user_id)
+        """), {**coupon, "cid": customer_id, "sid": sale_id, "user_id": user_id})
+
+    # Medication history and reorder alerts run off the checkout path, via the outbox
+    medication = _medication_lines(cart.items, products) if customer_id else []
+    if medication:
+        emit(db, "sale.medication_dispensed",
+             {"sale_id": sale_id, "customer_id": customer_id, "at": now.isoformat(), "lines": medication},
+             aggregate_id=sale_id)
+    emit(db, "stock.decreased", {"product_ids": list(quantities)}, aggregate_id=sale_id)
+
+    return {
+        "sale": sale,
+        "items": _items_out(items),
+        "payments": [{"id": p["id"], "amount": p["amount"], "method": p["method"], "status": p["status"]} for p in payment_rows],
+        "loyalty": loyalty,
+        "coupon": {"code": coupon["code"], "discount": coupon["discount"]} if coupon else None,
+    }
@@ -0,0 +1,280 @@
+"""
+Response Compression
+gzip / brotli ASGI middleware for JSON, CSV and HTML payloads
+
+Compresses responses whose content type is on COMPRESSION_TYPES and whose
+body is at least COMPRESSION_MIN_BYTES. Streaming responses (more than one
+body message) are compressed incrementally without buffering the whole body.
+Brotli is used when the client accepts it and the `brotli` package is
+installed; otherwise gzip. Large one-shot bodies are compressed in the
+threadpool so the event loop is not blocked.
+
+Per-route bytes in/out and CPU time are exposed through `compression_stats()`.
+"""
+
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+from anyio import to_thread
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_OFFLOAD_BYTES = int(os.getenv("COMPRESSION_OFFLOAD_BYTES", "262144"))
+COMPRESSION_TYPES = tuple(
+    t.strip().lower()
+    for t in os.getenv(
+        "COMPRESSION_TYPES",
+        "application/json,text/csv,text/html,text/plain,application/javascript,image/svg+xml",
+    ).split(",")
+    if t.strip()
+)
+
+_MAX_ROUTE_KEYS = 200
+
+
+class CompressionMetrics:
+    """Per-route counters used to tune the threshold and level"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict] = {}
+
+    def record(self, route: str, encoding: Optional[str], bytes_in: int, bytes_out: int, cpu_ms: float):
+        with self._lock:
+            if route not in self._routes and len(self._routes) >= _MAX_ROUTE_KEYS:
+                route = "(other)"
+            stats = self._routes.setdefault(route, {
+                "responses": 0, "compressed": 0, "bytes_in": 0, "bytes_out": 0, "cpu_ms": 0.0,
+            })
+            stats["responses"] += 1
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+            if encoding:
+                stats["compressed"] += 1
+                stats["cpu_ms"] += cpu_ms
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            routes = {}
+            for route, s in self._routes.items():
+                saved = s["bytes_in"] - s["bytes_out"]
+                routes[route] = {
+                    **s,
+                    "cpu_ms": round(s["cpu_ms"], 2),
+                    "bytes_saved": saved,
+                    "ratio": round(s["bytes_out"] / s["bytes_in"], 3) if s["bytes_in"] else None,
+                    "cpu_us_per_kb_saved": round(s["cpu_ms"] * 1000 / (saved / 1024), 1) if saved > 0 else None,
+                }
+        return {
+            "enabled": COMPRESSION_ENABLED,
+            "min_bytes": COMPRESSION_MIN_BYTES,
+            "gzip_level": COMPRESSION_GZIP_LEVEL,
+            "brotli": brotli is not None,
+            "brotli_quality": COMPRESSION_BROTLI_QUALITY,
+            "routes": routes,
+        }
+
+
+compression_metrics = CompressionMetrics()
+
+
+def compression_stats() -> Dict:
+    return compression_metrics.snapshot()
+
+
+def _accepted_encoding(headers) -> Optional[str]:
+    """'br' or 'gzip' per Accept-Encoding (q=0 excluded), or None"""
+    raw = ""
+    for key, value in headers:
+        if key == b"accept-encoding":
+            raw = value.decode("latin-1").lower()
+            break
+    accepted = set()
+    for part in raw.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.replace(" ", "")
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            # wbits 31 = gzip container
+            self._obj = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+        self.cpu_ms = 0.0
+
+    def compress(self, data: bytes) -> bytes:
+        start = time.thread_time()
+        out = self._obj.process(data) if self.encoding == "br" else self._obj.compress(data)
+        self.cpu_ms += (time.thread_time() - start) * 1000
+        return out
+
+    def finish(self) -> bytes:
+        start = time.thread_time()
+        out = self._obj.finish() if self.encoding == "br" else self._obj.flush()
+        self.cpu_ms += (time.thread_time() - start) * 1000
+        return out
+
+    def whole(self, data: bytes) -> bytes:
+        return self.compress(data) + self.finish()
+
+
+def _route_key(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        return getattr(endpoint, "__name__", str(endpoint))
+    return scope.get("path", "")
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware so streaming responses stay streaming"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = _accepted_encoding(scope.get("headers") or [])
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressionResponder(scope, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, scope, send, encoding: str):
+        self.scope = scope
+        self._send = send
+        self.encoding = encoding
+        self.start_message = None
+        self.eligible = False
+        self.started = False
+        self.compressor: Optional[_Compressor] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def send(self, message):
+        kind = message["type"]
+        if kind == "http.response.start":
+            self.start_message = message
+            self.eligible = self._is_eligible(message)
+            return
+        if kind != "http.response.body":
+            await self._send(message)
+            return
+        if not self.eligible:
+            await self._flush_start()
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+
+        if not self.started:
+            if not more:
+                await self._send_whole(body)
+                return
+            # First chunk of a stream: switch to incremental compression
+            self.compressor = _Compressor(self.encoding)
+            await self._flush_start(compressed=True, length=None)
+
+        self.bytes_in += len(body)
+        out = self.compressor.compress(body) if body else b""
+        if not more:
+            out += self.compressor.finish()
+        if out or not more:
+            self.bytes_out += len(out)
+            await self._send({"type": "http.response.body", "body": out, "more_body": more})
+        if not more:
+            self._record(self.encoding)
+
+    def _is_eligible(self, message) -> bool:
+        status = message["status"]
+        if status < 200 or status in (204, 206, 304):
+            return False
+        content_type, length = "", None
+        for key, value in message.get("headers", []):
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type":
+                content_type = value.decode("latin-1").split(";")[0].strip().lower()
+            elif key == b"content-length":
+                length = int(value)
+        if content_type not in COMPRESSION_TYPES:
+            return False
+        if length is not None and length < COMPRESSION_MIN_BYTES:
+            compression_metrics.record(_route_key(self.scope), None, length, length, 0.0)
+            return False
+        return True
+
+    async def _send_whole(self, body: bytes):
+        if len(body) < COMPRESSION_MIN_BYTES:
+            await self._flush_start()
+            await self._send({"type": "http.response.body", "body": body})
+            self.bytes_in = self.bytes_out = len(body)
+            self._record(None)
+            return
+        self.compressor = _Compressor(self.encoding)
+        if len(body) >= COMPRESSION_OFFLOAD_BYTES:
+            out = await to_thread.run_sync(self.compressor.whole, body)
+        else:
+            out = self.compressor.whole(body)
+        self.bytes_in, self.bytes_out = len(body), len(out)
+        await self._flush_start(compressed=True, length=len(out))
+        await self._send({"type": "http.response.body", "body": out})
+        self._record(self.encoding)
+
+    async def _flush_start(self, compressed: bool = False, length: Optional[int] = None):
+        if self.started:
+            return
+        self.started = True
+        message = self.start_message
+        if compressed:
+            headers = []
+            for key, value in message.get("headers", []):
+                if key == b"content-length":
+                    continue
+                if key == b"etag" and not value.startswith(b"W/"):
+                    # The compressed bytes differ from the identity representation
+                    value = b"W/" + value
+                headers.append((key, value))
+            headers.append((b"content-encoding", self.encoding.encode()))
+            headers.append((b"vary", b"Accept-Encoding"))
+            if length is not None:
+                headers.append((b"content-length", str(length).encode()))
+            message = {**message, "headers": headers}
+        await self._send(message)
+
+    def _record(self, encoding: Optional[str]):
+        cpu_ms = self.compressor.cpu_ms if self.compressor is not None else 0.0
+        compression_metrics.record(_route_key(self.scope), encoding, self.bytes_in, self.bytes_out, cpu_ms)
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from offload import OffloadRoute
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from pydantic import BaseModel, EmailStr, Field, validator
@@ -20,7 +21,7 @@ from crm_models import (
     RewardRedemptionCreate, RewardRedemptionResponse
 )
 
-router = APIRouter(prefix="/api/crm", tags=["CRM"])
+router = APIRouter(prefix="/api/crm", tags=["CRM"], route_class=OffloadRoute)
 
 # Database dependency
 def get_db():
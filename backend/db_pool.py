@@ -0,0 +1,197 @@
+"""
+Database Connection Pooling
+Environment-driven engine construction with pool metrics
+
+DB_POOL_MODE:
+    auto      - pgbouncer for Supabase transaction-pooler URLs, queue otherwise
+    queue     - QueuePool against a direct Postgres connection
+    pgbouncer - QueuePool that is safe behind a transaction pooler (no prepared
+                statements, no session-level SET)
+    null      - NullPool, a new connection per checkout
+
+main.py and the routers share one engine per process (shared_engine), so
+DB_POOL_SIZE + DB_MAX_OVERFLOW is the most connections one process opens;
+the whole deployment uses that times the number of worker processes (the
+scheduler is one more).
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+DB_POOL_MODE = (os.getenv("DB_POOL_MODE") or "auto").strip().lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+
+# engine id -> (label, pool mode, PoolMetrics, engine)
+_POOL_METRICS: Dict[int, tuple] = {}
+
+# url -> the process-wide engine for it
+_SHARED_ENGINES: Dict[str, Engine] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+class PoolMetrics:
+    """Checkout wait times and physical connection counts for one engine"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.timeouts = 0
+        self.connects = 0
+
+    def record_wait(self, waited_ms: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total_ms += waited_ms
+            if waited_ms > self.wait_max_ms:
+                self.wait_max_ms = waited_ms
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_avg_ms": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.record_wait(0.0, timed_out=True)
+            raise
+        if self.metrics is not None:
+            self.metrics.record_wait((time.perf_counter() - start) * 1000)
+        return conn
+
+
+def is_transaction_pooler(url: str) -> bool:
+    url = url.rstrip()
+    return "pooler.supabase.com" in url or ":6543/" in url or url.endswith(":6543/postgres")
+
+
+def resolve_pool_mode(url: str, mode: Optional[str] = None) -> str:
+    mode = (mode or DB_POOL_MODE).strip().lower()
+    if mode not in ("queue", "pgbouncer", "null"):
+        mode = "pgbouncer" if is_transaction_pooler(url) else "queue"
+    return mode
+
+
+def create_pooled_engine(url: str, mode: Optional[str] = None, label: str = "main", **overrides) -> Engine:
+    """Build an engine for DATABASE_URL according to the DB_POOL_* settings"""
+    if "sqlite" in url:
+        return create_engine(url, connect_args={"check_same_thread": False})
+
+    mode = resolve_pool_mode(url, mode)
+    behind_pooler = mode == "pgbouncer" or is_transaction_pooler(url)
+    connect_args: Dict = {}
+    kwargs: Dict = {"pool_pre_ping": True}
+
+    if mode == "null":
+        kwargs["poolclass"] = NullPool
+    else:
+        kwargs.update(
+            poolclass=TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+
+    if behind_pooler and make_url(url).drivername in ("postgresql+psycopg", "postgresql+psycopg3"):
+        # psycopg 3 prepares repeated statements server-side; transaction poolers cannot route them
+        connect_args["prepare_threshold"] = None
+
+    if DB_STATEMENT_TIMEOUT_MS > 0 and not behind_pooler:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+
+    if connect_args:
+        kwargs["connect_args"] = connect_args
+    kwargs.update(overrides)
+
+    engine = create_engine(url, **kwargs)
+    metrics = PoolMetrics()
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.metrics = metrics
+    _POOL_METRICS[id(engine)] = (label, mode, metrics, engine)
+
+    @event.listens_for(engine, "connect")
+    def _count_connect(dbapi_conn, conn_record):
+        metrics.record_connect()
+
+    if DB_STATEMENT_TIMEOUT_MS > 0 and behind_pooler:
+        # Startup options and session SETs do not survive transaction pooling; scope it per transaction
+        @event.listens_for(engine, "begin")
+        def _set_statement_timeout(conn):
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+            finally:
+                cursor.close()
+
+    return engine
+
+
+def shared_engine(url: str) -> Engine:
+    """The one pooled engine for `url` in this process, built on first use"""
+    url = url.strip()
+    with _SHARED_LOCK:
+        engine = _SHARED_ENGINES.get(url)
+        if engine is None:
+            engine = _SHARED_ENGINES[url] = create_pooled_engine(url, label="main")
+        return engine
+
+
+def pool_stats(engine: Engine) -> Dict:
+    """Checked-out / idle / overflow counts plus wait-time metrics"""
+    pool = engine.pool
+    label, mode, metrics, _ = _POOL_METRICS.get(id(engine), ("unregistered", "default", None, engine))
+    stats: Dict = {"engine": label, "mode": mode, "pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            pool_size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(0, pool.overflow()),
+            timeout_seconds=pool.timeout(),
+        )
+    if metrics is not None:
+        stats.update(metrics.snapshot())
+    stats["statement_timeout_ms"] = DB_STATEMENT_TIMEOUT_MS
+    return stats
+
+
+def all_pool_stats() -> List[Dict]:
+    """Stats for every engine built through create_pooled_engine"""
+    return [pool_stats(entry[3]) for entry in _POOL_METRICS.values()]
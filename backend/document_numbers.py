@@ -0,0 +1,159 @@
+"""
+Document Numbers
+Collision-free chalan, voucher, invoice, return and PO numbering
+
+Each numbering series is a row in document_counters keyed by (prefix, period),
+e.g. ('OP', '112025') for this month's opening-stock chalans. Taking a number
+is one UPDATE ... RETURNING on that row:
+
+    UPDATE document_counters SET last_value = last_value + 1
+    WHERE prefix = :prefix AND period = :period
+    RETURNING last_value
+
+so it costs the same however many documents exist, and two concurrent
+requests can never get the same number (the second waits on the row lock
+until the first commits). The increment belongs to the caller's transaction:
+a rolled-back document gives its number back, and the series has no gaps.
+
+The first number of a new series is seeded from the documents already in the
+table (the old COUNT/MAX scheme), so switching over mid-period does not reuse
+a number that was already issued. migrations/019_document_counters.sql has
+the same logic for the Postgres functions (generate_invoice_number(),
+generate_purchase_order_number(), generate_voucher_number()).
+"""
+
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from sqlalchemy import text
+
+DOCUMENT_COUNTERS_FILE = Path(__file__).parent / "migrations" / "019_document_counters.sql"
+
+DOCUMENT_COUNTERS_DDL = """
+CREATE TABLE IF NOT EXISTS document_counters (
+    prefix TEXT NOT NULL,
+    period TEXT NOT NULL DEFAULT '',
+    last_value BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (prefix, period)
+)
+"""
+
+_INCREMENT_SQL = text("""
+    UPDATE document_counters
+    SET last_value = last_value + :count, updated_at = CURRENT_TIMESTAMP
+    WHERE prefix = :prefix AND period = :period
+    RETURNING last_value
+""")
+
+# A concurrent first call may create the row between our UPDATE and INSERT; then it increments instead
+_START_SQL = text("""
+    INSERT INTO document_counters (prefix, period, last_value, updated_at)
+    VALUES (:prefix, :period, :start, CURRENT_TIMESTAMP)
+    ON CONFLICT (prefix, period) DO UPDATE
+    SET last_value = document_counters.last_value + :count, updated_at = CURRENT_TIMESTAMP
+    RETURNING last_value
+""")
+
+
+def ensure_document_counters(engine):
+    """Apply migration 019 on Postgres (table and numbering functions); just the table elsewhere"""
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.exec_driver_sql(DOCUMENT_COUNTERS_FILE.read_text(encoding="utf-8"))
+        else:
+            conn.exec_driver_sql(DOCUMENT_COUNTERS_DDL)
+
+
+def next_number(db, prefix: str, period: str = "", seed: Optional[Callable[[], int]] = None, count: int = 1) -> int:
+    """
+    Reserve `count` numbers in the (prefix, period) series; returns the last
+    one. `seed()` gives the highest number already issued and is only called
+    when the series does not exist yet.
+    """
+    params = {"prefix": prefix, "period": period, "count": count}
+    row = db.execute(_INCREMENT_SQL, params).first()
+    if row is not None:
+        return int(row[0])
+    start = 0
+    if seed is not None:
+        try:
+            # Savepoint: a seed query against a missing legacy column must not abort the caller
+            with db.begin_nested():
+                start = int(seed() or 0)
+        except Exception as e:
+            print(f"[WARN] Could not seed document counter {prefix}/{period}: {e}")
+    return int(db.execute(_START_SQL, {**params, "start": start + count}).first()[0])
+
+
+def _max_suffix(db, sql: str, pattern: str, **params) -> int:
+    """Largest trailing number among existing document numbers (seed helper)"""
+    highest = 0
+    for (value,) in db.execute(text(sql), params):
+        match = re.search(pattern, value or "")
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return highest
+
+
+# Chalans: PREFIX + 6 digits + MMYYYY, one series per prefix and month
+CHALAN_PREFIXES = {
+    'OP': 'OP',      # Opening Stock
+    'TRNS': 'TR',    # Transfer
+    'ADJ': 'ADJ',    # Adjustment
+    'PUR': 'PUR',    # Purchase
+    'RET': 'RET'     # Return
+}
+RECEIVE_TYPES = ('OP', 'TRNS', 'ADJ')
+
+
+def chalan_number(db, chalan_type: str, now: Optional[datetime] = None) -> str:
+    now = now or datetime.now()
+    prefix = CHALAN_PREFIXES.get(chalan_type, 'GEN')
+    month_year = f"{now.month:02d}{now.year}"
+    month_start = datetime(now.year, now.month, 1)
+    next_month = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+
+    def seed():
+        # Chalans issued this month before the counter existed (range predicate, index-friendly)
+        if chalan_type in RECEIVE_TYPES:
+            sql = """SELECT COUNT(*) FROM elc_receive_master
+                     WHERE receive_type = :t AND chalan_date >= :start AND chalan_date < :end"""
+        else:
+            sql = """SELECT COUNT(*) FROM elc_issue_master
+                     WHERE issue_type = :t AND chalan_date >= :start AND chalan_date < :end"""
+        return db.execute(text(sql), {"t": chalan_type, "start": month_start, "end": next_month}).scalar()
+
+    number = next_number(db, prefix, month_year, seed)
+    return f"{prefix}{number:06d}{month_year}"
+
+
+# Vouchers: PV-0001 / RV-0001 / JV-0001, one running series per type
+VOUCHER_PREFIXES = {"payment": "PV", "receipt": "RV", "journal": "JV"}
+
+
+def voucher_number(db, voucher_type: str) -> str:
+    prefix = VOUCHER_PREFIXES.get(voucher_type, "V")
+    number = next_number(db, f"voucher:{prefix}", "", lambda: _max_suffix(
+        db, "SELECT voucher_no FROM vouchers WHERE voucher_no LIKE :p", r"-(\d+)$", p=f"{prefix}-%"))
+    return f"{prefix}-{str(number).zfill(4)}"
+
+
+def service_invoice_number(db, now: Optional[datetime] = None) -> str:
+    """SI + YYYYMMDD + 4 digits, one series per day"""
+    day = (now or datetime.now()).strftime('%Y%m%d')
+    number = next_number(db, "SI", day, lambda: _max_suffix(
+        db, "SELECT invoice_number FROM service_invoices WHERE invoice_number LIKE :p",
+        rf"^SI{day}(\d+)$", p=f"SI{day}%"))
+    return f"SI{day}{str(number).zfill(4)}"
+
+
+def sales_return_number(db, now: Optional[datetime] = None) -> str:
+    """SR + YYYYMMDD + 4 digits, one series per day"""
+    day = (now or datetime.now()).strftime('%Y%m%d')
+    number = next_number(db, "SR", day, lambda: _max_suffix(
+        db, "SELECT return_number FROM sales_returns WHERE return_number LIKE :p",
+        rf"^SR{day}(\d+)$", p=f"SR{day}%"))
+    return f"SR{day}{str(number).zfill(4)}"
@@ -2,9 +2,12 @@
 Enhanced Pharmacy API Routes
 New endpoints for drug interactions, prescriptions, and refill reminders
 """
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
+from offload import OffloadRoute
+from db_pool import shared_engine
+from pagination import PageParams, page_params, paginate_sql
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import text, create_engine
+from sqlalchemy import text
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, date
@@ -16,7 +19,8 @@ load_dotenv()
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+# Same pool as main.py; one pool per process keeps the connection count bounded
+engine = shared_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Database dependency
@@ -27,7 +31,7 @@ def get_db():
     finally:
         db.close()
 
-router = APIRouter(prefix="/api/pharmacy/enhanced", tags=["Pharmacy Enhanced"])
+router = APIRouter(prefix="/api/pharmacy/enhanced", tags=["Pharmacy Enhanced"], route_class=OffloadRoute)
 
 # Pydantic Models
 class DrugInteractionCreate(BaseModel):
@@ -395,17 +399,16 @@ async def delete_allergy(allergy_id: str, db: Session = Depends(get_db)):
 
 # All Prescriptions (GET)
 @router.get("/prescriptions")
-async def list_all_prescriptions(db: Session = Depends(get_db)):
+async def list_all_prescriptions(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
     """Get all prescription records"""
-    result = db.execute(text("""
+    result = paginate_sql(db, """
         SELECT p.id, p.prescription_number, p.customer_id, c.name as customer_name,
                p.doctor_name, p.doctor_license, p.diagnosis,
                p.prescription_date, p.valid_until,
                p.refills_allowed, p.refills_used, p.is_active, p.notes
         FROM prescription_records p
         LEFT JOIN customers c ON p.customer_id = c.id
-        ORDER BY p.prescription_date DESC
-    """)).fetchall()
+    """, None, page, response, [("prescription_date", True), ("id", True)])
 
     return [
         {
@@ -428,16 +431,15 @@ async def list_all_prescriptions(db: Session = Depends(get_db)):
 
 # All Insurance Claims (GET)
 @router.get("/insurance-claims")
-async def get_all_claims(db: Session = Depends(get_db)):
+async def get_all_claims(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
     """Get all insurance claims"""
-    result = db.execute(text("""
+    result = paginate_sql(db, """
         SELECT id, claim_number, customer_id, insurance_provider,
                policy_number, claim_amount, approved_amount,
                claim_status, submitted_date, approval_date, payment_date,
                rejection_reason, notes
         FROM insurance_claims
-        ORDER BY submitted_date DESC
-    """)).fetchall()
+    """, None, page, response, [("submitted_date", True), ("id", True)])
 
     return [
         {
@@ -0,0 +1,117 @@
+"""
+Outbox Event Handlers
+Consumers for domain events emitted by the sale and purchase endpoints
+
+Each handler runs in the dispatcher's transaction (inside a savepoint) and
+must not commit; raising marks the event for retry. Events:
+
+- audit.logged               -> audit_logs row
+- sale.medication_dispensed  -> patient_medication_history rows
+- stock.decreased            -> low-stock / reorder notifications
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, column, insert, table, text
+
+from outbox import handles
+
+MEDICATION_REFILL_DAYS = 30
+
+_medication_history = table(
+    "patient_medication_history",
+    column("id"), column("customer_id"), column("product_id"), column("sale_id"), column("product_name"),
+    column("generic_name"), column("quantity"), column("unit_price"), column("dispensed_at"),
+    column("next_refill_date"),
+)
+
+
+@handles("audit.logged")
+def record_audit_log(db, payload: dict):
+    old_value, new_value = payload.get("old_value"), payload.get("new_value")
+    db.execute(text("""
+        INSERT INTO audit_logs (id, user_id, action, table_name, record_id, old_value, new_value, created_at)
+        VALUES (:id, :user_id, :action, :table_name, :record_id, :old_value, :new_value, :created_at)
+    """), {
+        "id": str(uuid.uuid4()),
+        "user_id": payload.get("user_id"),
+        "action": payload["action"],
+        "table_name": payload["table_name"],
+        "record_id": payload.get("record_id"),
+        "old_value": str(old_value) if old_value is not None else None,
+        "new_value": str(new_value) if new_value is not None else None,
+        "created_at": payload.get("at") or datetime.utcnow(),
+    })
+
+
+def _resolve_customer(db, sale_id: str):
+    # Same match create_sale_item used: a customer with the sale's name or phone
+    row = db.execute(text("""
+        SELECT c.id FROM customers c
+        JOIN sales s ON s.id = :sid
+        WHERE c.name = s.customer_name OR c.phone = s.customer_phone
+        LIMIT 1
+    """), {"sid": sale_id}).first()
+    return str(row[0]) if row else None
+
+
+@handles("sale.medication_dispensed")
+def record_medication_history(db, payload: dict):
+    sale_id = payload["sale_id"]
+    customer_id = payload.get("customer_id") or _resolve_customer(db, sale_id)
+    if not customer_id:
+        return
+    dispensed_at = payload.get("at") or datetime.utcnow()
+    if isinstance(dispensed_at, str):
+        dispensed_at = datetime.fromisoformat(dispensed_at)
+    rows = [{
+        "id": str(uuid.uuid4()),
+        "customer_id": customer_id,
+        "product_id": line["product_id"],
+        "sale_id": sale_id,
+        "product_name": line["product_name"],
+        "generic_name": line.get("generic_name") or line["product_name"],
+        "quantity": line["quantity"],
+        "unit_price": line["unit_price"],
+        "dispensed_at": dispensed_at,
+        "next_refill_date": dispensed_at + timedelta(days=MEDICATION_REFILL_DAYS) if line.get("is_prescription_required") else None,
+    } for line in payload.get("lines", [])]
+    if rows:
+        db.execute(insert(_medication_history).values(rows))
+
+
+_STOCK_LEVELS_SQL = text("""
+    SELECT CAST(id AS TEXT), name, stock_quantity, reorder_level, min_stock_level
+    FROM products
+    WHERE id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+
+@handles("stock.decreased")
+def raise_reorder_alerts(db, payload: dict):
+    """Notify once per product when a sale takes it to or below its reorder point"""
+    product_ids = [str(pid) for pid in payload.get("product_ids", [])]
+    if not product_ids:
+        return
+    for product_id, name, stock, reorder_level, min_stock_level in db.execute(_STOCK_LEVELS_SQL, {"ids": product_ids}).all():
+        reorder_point = max(reorder_level or 0, min_stock_level or 0)
+        if reorder_point <= 0 or (stock or 0) > reorder_point:
+            continue
+        action_url = f"/products/{product_id}"
+        # An unread alert for the product is already on the board; don't stack duplicates
+        if db.execute(text("""
+            SELECT 1 FROM app_notifications
+            WHERE category = 'inventory' AND action_url = :url AND is_read = false
+            LIMIT 1
+        """), {"url": action_url}).first():
+            continue
+        db.execute(text("""
+            INSERT INTO app_notifications (id, user_id, title, body, type, category, action_url, is_read, created_at)
+            VALUES (:id, NULL, :title, :body, 'warning', 'inventory', :url, false, CURRENT_TIMESTAMP)
+        """), {
+            "id": str(uuid.uuid4()),
+            "title": f"Reorder {name}",
+            "body": f"Stock is {stock}, at or below the reorder point of {reorder_point}",
+            "url": action_url,
+        })
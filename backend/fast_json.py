@@ -0,0 +1,115 @@
+"""
+Fast JSON Responses
+Row-to-bytes serialization for large list endpoints
+
+Routes opt in by returning `rows_response(...)` instead of a list of
+Pydantic models. Column-projected rows are zipped into dicts, passed through
+a few per-column coercions that reproduce the response model's output, and
+encoded straight to bytes. Per-row model validation and jsonable_encoder are
+skipped, so only use this for trusted database output.
+
+orjson is used when installed (set FAST_JSON_ENABLED=false to force the stdlib
+json module).
+"""
+
+import json
+import os
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def _default(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None and FAST_JSON_ENABLED:
+    # OPT_UTC_Z matches Pydantic's "Z" suffix for UTC datetimes
+    _ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps(content: Any) -> bytes:
+        return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# Coercions matching how the existing endpoints fill their response models
+def str_or_none(value):
+    return str(value) if value is not None else None
+
+
+def str_or_empty(value):
+    return str(value) if value else ""
+
+
+def float_or_zero(value):
+    return float(value) if value else 0.0
+
+
+def decimal_str(value):
+    # Pydantic serializes Decimal fields as strings
+    return str(value) if value is not None else None
+
+
+def default_true(value):
+    return value if value is not None else True
+
+
+def default_false(value):
+    return value if value is not None else False
+
+
+def int_or_zero(value):
+    return value or 0
+
+
+def project_rows(
+    rows: Iterable[Sequence],
+    fields: Sequence[str],
+    coerce: Optional[Dict[str, Callable]] = None,
+) -> list:
+    """Zip positional rows with `fields`, applying `coerce[field]` where given"""
+    if not coerce:
+        return [dict(zip(fields, row)) for row in rows]
+    converters = [(i, name, coerce.get(name)) for i, name in enumerate(fields)]
+    out = []
+    for row in rows:
+        item = {}
+        for i, name, convert in converters:
+            value = row[i]
+            item[name] = convert(value) if convert is not None else value
+        out.append(item)
+    return out
+
+
+def rows_response(
+    rows: Iterable[Sequence],
+    fields: Sequence[str],
+    coerce: Optional[Dict[str, Callable]] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> FastJSONResponse:
+    return FastJSONResponse(project_rows(rows, fields, coerce), headers=headers)
@@ -3,6 +3,7 @@ HR Management API Routes
 """
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from offload import OffloadRoute
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from typing import List, Optional
@@ -24,7 +25,7 @@ from hrm_models import (
     PayrollDetailCreate, PayrollDetailResponse
 )
 
-router = APIRouter(prefix="/api/hrm", tags=["HR Management"])
+router = APIRouter(prefix="/api/hrm", tags=["HR Management"], route_class=OffloadRoute)
 
 # Placeholder dependencies
 def get_db():
@@ -0,0 +1,363 @@
+"""
+Invoice Rendering
+Precompiled sale invoice templates, an LRU cache of rendered invoices and batch printing
+
+The templates are compiled once, at import, into plain functions (one f-string
+each), so rendering an invoice is a single formatting call per block instead
+of re-parsing a template.
+
+A rendered invoice body is cached under (sale id, sale version). The version
+comes from the same query that loads the invoice header: the sale's
+updated_at plus the count and total of its items, so editing a sale or adding
+a line renders it afresh and a stale invoice is never served. A reprint is
+one indexed query; the items/products join and the rendering are skipped.
+
+render_batch() prints many invoices as one HTML document (one page each).
+Chunks of sales are loaded and rendered by a small thread pool, each worker
+with its own session, and pages are yielded in request order as soon as
+their chunk is ready.
+"""
+
+import html
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from string import Formatter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+
+INVOICE_CACHE_SIZE = int(os.getenv("INVOICE_CACHE_SIZE", "1000"))
+INVOICE_RENDER_WORKERS = int(os.getenv("INVOICE_RENDER_WORKERS", "4"))
+INVOICE_BATCH_MAX = int(os.getenv("INVOICE_BATCH_MAX", "500"))
+INVOICE_BATCH_CHUNK = 50
+
+
+def compile_template(source: str) -> Callable[..., str]:
+    """Turn a str.format-style template into a function taking its fields as keywords"""
+    fields = sorted({name for _, name, _, _ in Formatter().parse(source) if name})
+    params = f"*, {', '.join(fields)}" if fields else ""
+    code = compile(f"lambda {params}: f{source!r}", "<invoice template>", "eval")
+    return eval(code)
+
+
+_PAGE_HEAD = """<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset='utf-8' />
+    <title>{title} - PHARMAZINE</title>
+    <style>
+      * {{ box-sizing: border-box; margin: 0; padding: 0; }}
+      body {{ font-family: Arial, sans-serif; padding: 32px; font-size: 13px; color: #222; }}
+      .invoice + .invoice {{ page-break-before: always; margin-top: 48px; }}
+      .header {{ text-align: center; border-bottom: 2px solid #1d4ed8; padding-bottom: 16px; margin-bottom: 20px; }}
+      .header h1 {{ font-size: 28px; color: #1d4ed8; letter-spacing: 2px; }}
+      .header p {{ color: #555; font-size: 12px; margin-top: 4px; }}
+      .invoice-meta {{ display: flex; justify-content: space-between; margin-bottom: 20px; }}
+      .meta-box {{ background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 6px; padding: 12px 16px; min-width: 200px; }}
+      .meta-box h3 {{ font-size: 11px; color: #64748b; text-transform: uppercase; letter-spacing: 1px; margin-bottom: 6px; }}
+      .meta-box p {{ font-size: 13px; font-weight: 600; }}
+      .meta-box .sub {{ font-size: 12px; color: #555; font-weight: normal; }}
+      table {{ width: 100%; border-collapse: collapse; margin-bottom: 16px; }}
+      thead tr {{ background: #1d4ed8; color: white; }}
+      thead th {{ padding: 10px 8px; text-align: left; font-size: 12px; }}
+      tbody tr:nth-child(even) {{ background: #f8fafc; }}
+      tbody td {{ padding: 9px 8px; border-bottom: 1px solid #e2e8f0; }}
+      .totals {{ float: right; width: 280px; }}
+      .totals table {{ border: 1px solid #e2e8f0; border-radius: 6px; overflow: hidden; }}
+      .totals td {{ padding: 8px 12px; }}
+      .totals tr:last-child {{ background: #1d4ed8; color: white; font-weight: bold; font-size: 15px; }}
+      .footer {{ clear: both; margin-top: 40px; text-align: center; color: #94a3b8; font-size: 11px; border-top: 1px solid #e2e8f0; padding-top: 12px; }}
+      @media print {{ body {{ padding: 16px; }} .invoice + .invoice {{ margin-top: 0; }} }}
+    </style>
+  </head>
+  <body>
+"""
+
+_PAGE_TAIL = """
+    <script>window.onload = function() {{ window.print(); }};</script>
+  </body>
+</html>"""
+
+_INVOICE = """
+    <div class="invoice">
+    <div class="header">
+      <h1>PHARMAZINE</h1>
+      <p>Your Health, Our Priority &nbsp;|&nbsp; Licensed Pharmacy Management System</p>
+    </div>
+
+    <div class="invoice-meta">
+      <div class="meta-box">
+        <h3>Bill To</h3>
+        <p>{customer_name}</p>
+        {customer_phone}
+      </div>
+      <div class="meta-box" style="text-align:right">
+        <h3>Invoice Details</h3>
+        <p>#{code}</p>
+        <p class="sub">{sale_date}</p>
+        <p class="sub">Payment: {payment_method}</p>
+      </div>
+    </div>
+
+    <table>
+      <thead>
+        <tr>
+          <th>#</th>
+          <th>SKU</th>
+          <th>Medicine / Product</th>
+          <th style='text-align:center'>Qty</th>
+          <th style='text-align:right'>Unit Price</th>
+          <th style='text-align:right'>Disc%</th>
+          <th style='text-align:right'>Amount</th>
+        </tr>
+      </thead>
+      <tbody>
+        {rows}
+      </tbody>
+    </table>
+
+    <div class="totals">
+      <table>
+        <tr><td>Subtotal:</td><td style='text-align:right'>&#2547;{total_amount:.2f}</td></tr>
+        {discount_row}
+        {tax_row}
+        <tr><td>NET TOTAL:</td><td style='text-align:right'>&#2547;{net_amount:.2f}</td></tr>
+      </table>
+    </div>
+
+    <div class="footer">
+      Thank you for choosing Pharmazine &bull; Powered by Pharmazine PMS
+    </div>
+    </div>
+"""
+
+_ROW = """<tr>
+          <td>{n}</td>
+          <td>{sku}</td>
+          <td>{name}{generic}</td>
+          <td style='text-align:center'>{quantity}</td>
+          <td style='text-align:right'>&#2547;{unit_price:.2f}</td>
+          <td style='text-align:right'>{discount_percentage:.1f}%</td>
+          <td style='text-align:right'>&#2547;{total_price:.2f}</td>
+        </tr>"""
+
+_ADJUSTMENT_ROW = ("<tr><td colspan='6' style='text-align:right;padding:6px 8px;'>{label}:</td>"
+                   "<td style='text-align:right;padding:6px 8px;'>&#2547;{amount:.2f}</td></tr>")
+
+_NO_ITEMS = '<tr><td colspan="7" style="text-align:center;padding:20px;color:#999">No items found</td></tr>'
+
+# Compiled once at startup
+render_page_head = compile_template(_PAGE_HEAD)
+render_page_tail = compile_template(_PAGE_TAIL)
+render_invoice_body = compile_template(_INVOICE)
+render_row = compile_template(_ROW)
+render_adjustment_row = compile_template(_ADJUSTMENT_ROW)
+
+# Header plus the version inputs; correlated counts are seeks on idx_sales_items_sale_id
+_HEADER_SQL = text("""
+    SELECT CAST(s.id AS TEXT) AS id, s.customer_name, s.customer_phone, s.payment_method,
+           s.total_amount, s.discount, s.tax, s.net_amount, s.created_at, s.updated_at,
+           (SELECT COUNT(*) FROM sales_items si WHERE si.sale_id = s.id) AS item_count,
+           (SELECT COALESCE(SUM(si.total_price), 0) FROM sales_items si WHERE si.sale_id = s.id) AS item_total
+    FROM sales s
+    WHERE s.id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+_ITEMS_SQL = """
+    SELECT CAST(si.sale_id AS TEXT) AS sale_id, p.sku, p.name, p.generic_name, si.quantity,
+           si.unit_price, {discount} AS discount_percentage, si.total_price
+    FROM sales_items si
+    JOIN products p ON p.id = si.product_id
+    WHERE si.sale_id IN :ids
+    ORDER BY si.created_at, si.id
+"""
+
+
+def _num(value) -> float:
+    return float(value or 0)
+
+
+def sale_version(header) -> Tuple:
+    return (str(header.updated_at), int(header.item_count or 0), round(_num(header.item_total), 2))
+
+
+def _sale_date(created_at) -> str:
+    try:
+        return created_at.strftime("%d %B %Y %I:%M %p") if created_at else str(created_at)
+    except Exception:
+        return str(created_at)
+
+
+def render_invoice(header, items) -> str:
+    """Invoice body (one page) for a sale header row and its item rows"""
+    rows = "".join(
+        render_row(
+            n=i + 1,
+            sku=html.escape(it.sku or ""),
+            name=html.escape(it.name or ""),
+            generic=f'<br><small style="color:#666">{html.escape(it.generic_name)}</small>' if it.generic_name else "",
+            quantity=it.quantity,
+            unit_price=_num(it.unit_price),
+            discount_percentage=_num(it.discount_percentage),
+            total_price=_num(it.total_price),
+        )
+        for i, it in enumerate(items)
+    )
+    return render_invoice_body(
+        customer_name=html.escape(header.customer_name or "Walk-in Customer"),
+        customer_phone=f'<p class="sub">{html.escape(header.customer_phone)}</p>' if header.customer_phone else "",
+        code=header.id[:8].upper(),
+        sale_date=_sale_date(header.created_at),
+        payment_method=html.escape((header.payment_method or "cash").title()),
+        rows=rows or _NO_ITEMS,
+        total_amount=_num(header.total_amount),
+        discount_row=render_adjustment_row(label="Discount", amount=_num(header.discount)) if header.discount else "",
+        tax_row=render_adjustment_row(label="Tax / VAT", amount=_num(header.tax)) if header.tax else "",
+        net_amount=_num(header.net_amount),
+    )
+
+
+def page(title: str, bodies: Iterable[str]) -> str:
+    return render_page_head(title=html.escape(title)) + "".join(bodies) + render_page_tail()
+
+
+class InvoiceCache:
+    """Size-bounded LRU of rendered invoice bodies keyed by (sale id, sale version)"""
+
+    def __init__(self, max_size: int = INVOICE_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._latest: Dict[str, Tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sale_id: str, version: Tuple) -> Optional[str]:
+        with self._lock:
+            body = self._entries.get((sale_id, version))
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((sale_id, version))
+            self.hits += 1
+            return body
+
+    def put(self, sale_id: str, version: Tuple, body: str):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            # An older version of the same sale can never be asked for again
+            old = self._latest.get(sale_id)
+            if old is not None and old != version:
+                self._entries.pop((sale_id, old), None)
+            self._latest[sale_id] = version
+            self._entries[(sale_id, version)] = body
+            self._entries.move_to_end((sale_id, version))
+            while len(self._entries) > self.max_size:
+                (evicted_id, evicted_version), _ = self._entries.popitem(last=False)
+                if self._latest.get(evicted_id) == evicted_version:
+                    del self._latest[evicted_id]
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+invoice_cache = InvoiceCache()
+
+
+def normalize_ids(db, sale_ids: Iterable[str]) -> List[str]:
+    """Canonical (lower-case) ids; on Postgres, values that cannot be a uuid are dropped"""
+    postgres = db.get_bind().dialect.name == "postgresql"
+    ids = []
+    for value in sale_ids:
+        try:
+            ids.append(str(uuid.UUID(str(value))))
+        except ValueError:
+            if not postgres:
+                ids.append(str(value))
+    return list(dict.fromkeys(ids))
+
+
+def render_sales(db, sale_ids: List[str]) -> Dict[str, str]:
+    """Rendered invoice bodies keyed by normalize_ids() id (unknown ids are left out)"""
+    sale_ids = normalize_ids(db, sale_ids)
+    if not sale_ids:
+        return {}
+    headers = db.execute(_HEADER_SQL, {"ids": sale_ids}).all()
+    bodies, stale = {}, {}
+    for header in headers:
+        version = sale_version(header)
+        body = invoice_cache.get(header.id, version)
+        if body is None:
+            stale[header.id] = (header, version)
+        else:
+            bodies[header.id] = body
+    if stale:
+        discount = "si.discount_percentage" if db.get_bind().dialect.name == "postgresql" else "0"
+        items_sql = text(_ITEMS_SQL.format(discount=discount)).bindparams(bindparam("ids", expanding=True))
+        items: Dict[str, list] = {sid: [] for sid in stale}
+        for row in db.execute(items_sql, {"ids": list(stale)}):
+            items[row.sale_id].append(row)
+        for sid, (header, version) in stale.items():
+            bodies[sid] = render_invoice(header, items[sid])
+            invoice_cache.put(sid, version, bodies[sid])
+    return bodies
+
+
+def render_sale_page(db, sale_id: str) -> Optional[str]:
+    """Full printable invoice page for one sale, or None if it does not exist"""
+    bodies = render_sales(db, [sale_id])
+    if not bodies:
+        return None
+    return page(f"Invoice #{sale_id[:8].upper()}", bodies.values())
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _render_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, INVOICE_RENDER_WORKERS), thread_name_prefix="invoice")
+        return _pool
+
+
+def render_batch(session_factory, sale_ids: List[str]) -> Iterator[str]:
+    """
+    One printable HTML document for many sales, yielded piece by piece in
+    `sale_ids` order. Ids that do not match a sale are skipped.
+    """
+    def work(chunk: List[str]) -> List[str]:
+        session = session_factory()
+        try:
+            bodies = render_sales(session, chunk)
+        finally:
+            session.close()
+        return [bodies[sid] for sid in chunk if sid in bodies]
+
+    with session_factory() as session:
+        sale_ids = normalize_ids(session, sale_ids)
+    pool = _render_pool()
+    chunks = [sale_ids[i:i + INVOICE_BATCH_CHUNK] for i in range(0, len(sale_ids), INVOICE_BATCH_CHUNK)]
+    futures = [pool.submit(work, chunk) for chunk in chunks]
+    try:
+        yield render_page_head(title=f"Invoices ({len(sale_ids)})")
+        for future in futures:
+            yield "".join(future.result())
+        yield render_page_tail()
+    finally:
+        # Client went away: drop the chunks that have not started
+        for future in futures:
+            future.cancel()
@@ -7,17 +7,39 @@ _backend_dir = Path(__file__).resolve().parent
 if str(_backend_dir) not in sys.path:
     sys.path.insert(0, str(_backend_dir))
 
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, status, UploadFile, File, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from rbac import Permission
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, Date, Text, ForeignKey, func
+from rbac import Permission, RBACHelper
+from role_cache import role_cache, is_supabase_authoritative
+from offload import OffloadRoute, configure_threadpool, lag_monitor
+from pagination import PageParams, apply_keyset, clamp_limit, fetch_page, page_params, paginate, paginate_sql
+from db_pool import shared_engine, pool_stats, all_pool_stats
+from supabase_http import supabase_http
+from resource_versions import etag_guard, resource_versions
+from product_search import SEARCH_DEFAULT_LIMIT, ensure_search_indexes, search_products
+from scan_index import scan_index
+from sync_feed import SYNC_MAX_CHANGES, ensure_sync_schema, get_changes
+from fast_json import FastJSONResponse, project_rows, str_or_none
+from compression import CompressionMiddleware, compression_stats
+from checkout import checkout
+from document_numbers import chalan_number, ensure_document_counters
+from short_codes import ensure_short_codes, find_id
+from stock_ledger import end_of_day, ensure_stock_ledger, stock_as_of, stock_movements
+from stock_reconcile import ensure_stock_reconciliation, last_reconciliation, reconcile_stock
+from sale_returns import ensure_sale_returns, process_return
+from invoice_render import INVOICE_BATCH_MAX, invoice_cache, render_batch, render_sale_page
+from sale_ingest import IDEMPOTENCY_DDL, SALE_BATCH_MAX, ingest_sales
+from batch_allocation import allocate_fefo
+from stock_service import adjust_stock, apply_stock_changes
+from outbox import emit, ensure_outbox_schema, outbox_backlog, outbox_dispatcher
+import event_handlers  # noqa: F401 (registers the outbox consumers)
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Date, Text, ForeignKey, func
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
-from sqlalchemy.pool import NullPool
-from pydantic import BaseModel, EmailStr, validator, Field, field_validator, ConfigDict
+from pydantic import BaseModel, EmailStr, validator, Field, field_validator, ConfigDict, ValidationError
 from typing import List, Optional, Any, Tuple
 from datetime import datetime, timedelta, date
 import os
@@ -26,8 +48,9 @@ from uuid import UUID
 import secrets
 from jose import JWTError, jwt
 from dotenv import load_dotenv
-from sqlalchemy import text
+from sqlalchemy import event, text, or_
 from io import StringIO, TextIOWrapper
+from types import SimpleNamespace
 import csv
 import requests
 from requests.exceptions import RequestException
@@ -106,6 +129,10 @@ def _supabase_rest_headers() -> dict:
     }
 
 
+# Older call sites use this name for the service-role PostgREST headers
+_rest_headers = _supabase_rest_headers
+
+
 def _rest_get_profile(*, email: Optional[str] = None, user_id: Optional[str] = None) -> Optional[dict]:
     """Fetch a single profile row via Supabase PostgREST."""
     if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
@@ -118,11 +145,10 @@ def _rest_get_profile(*, email: Optional[str] = None, user_id: Optional[str] = N
     else:
         return None
     try:
-        resp = requests.get(
+        resp = supabase_http.get(
             f"{SUPABASE_URL}/rest/v1/profiles",
             headers=_supabase_rest_headers(),
             params=params,
-            timeout=10,
         )
         if resp.status_code == 200:
             rows = resp.json()
@@ -140,11 +166,10 @@ def _rest_upsert_profile(data: dict) -> Optional[dict]:
     headers = _supabase_rest_headers()
     headers["Prefer"] = "resolution=merge-duplicates,return=representation"
     try:
-        resp = requests.post(
+        resp = supabase_http.post(
             f"{SUPABASE_URL}/rest/v1/profiles",
             headers=headers,
             json=data,
-            timeout=10,
         )
         if resp.status_code in (200, 201):
             rows = resp.json()
@@ -152,6 +177,10 @@ def _rest_upsert_profile(data: dict) -> Optional[dict]:
                 return rows[0]
     except Exception:
         pass
+    finally:
+        # After the write, so a lookup racing it cannot re-cache the old role
+        if data.get("id"):
+            role_cache.invalidate(data["id"])
     return None
 
 
@@ -162,18 +191,20 @@ def _rest_update_profile(user_id: str, fields: dict) -> Optional[dict]:
     headers = _supabase_rest_headers()
     headers["Prefer"] = "return=representation"
     try:
-        resp = requests.patch(
+        resp = supabase_http.patch(
             f"{SUPABASE_URL}/rest/v1/profiles",
             headers=headers,
             params={"id": f"eq.{user_id}"},
             json=fields,
-            timeout=10,
         )
         if resp.status_code in (200, 204):
             rows = resp.json() if resp.text.strip() else []
             return rows[0] if rows else fields
     except Exception:
         pass
+    finally:
+        if "role" in fields:
+            role_cache.invalidate(user_id)
     return None
 
 
@@ -183,11 +214,10 @@ def _rest_get_roles(user_id: str) -> List[str]:
         return ["employee"]
     # Primary: user_roles table (created by Supabase trigger on every signup)
     try:
-        resp = requests.get(
+        resp = supabase_http.get(
             f"{SUPABASE_URL}/rest/v1/user_roles",
             headers=_supabase_rest_headers(),
             params={"user_id": f"eq.{user_id}", "select": "role"},
-            timeout=10,
         )
         if resp.status_code == 200:
             rows = resp.json() or []
@@ -198,11 +228,10 @@ def _rest_get_roles(user_id: str) -> List[str]:
         pass
     # Fallback: profiles.role VARCHAR column (may hold pharmacy-specific roles)
     try:
-        resp = requests.get(
+        resp = supabase_http.get(
             f"{SUPABASE_URL}/rest/v1/profiles",
             headers=_supabase_rest_headers(),
             params={"id": f"eq.{user_id}", "select": "role"},
-            timeout=10,
         )
         if resp.status_code == 200:
             rows = resp.json() or []
@@ -310,6 +339,8 @@ security = HTTPBearer()
 
 # Create FastAPI app
 app = FastAPI(title="Pharmazine API", version="1.0.0")
+# Most handlers are `async def` around blocking Session/requests calls; run those in the threadpool
+app.router.route_class = OffloadRoute
 
 # CORS configuration
 default_cors_origins = [
@@ -342,9 +373,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Estimate", "ETag"],
     max_age=600,  # Cache preflight requests for 10 minutes
 )
 
+# gzip/brotli for large JSON and CSV bodies (see compression.py for tuning knobs)
+app.add_middleware(CompressionMiddleware)
+
 @app.exception_handler(HTTPException)
 async def sanitize_http_exception(request: Request, exc: HTTPException):
     detail = exc.detail
@@ -544,16 +579,10 @@ except Exception as e:
     print(f"[WARNING] Error loading Multi-Branch Management routes: {e}")
 
 # Database setup
-if "sqlite" in DATABASE_URL:
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    # Supabase transaction pooler (6543 / *.pooler.supabase.com): use NullPool so connections
-    # are not held across transactions (avoids prepared-statement / PgBouncer issues).
-    _pool_kw = {}
-    if "pooler.supabase.com" in DATABASE_URL or ":6543/" in DATABASE_URL or DATABASE_URL.rstrip().endswith(":6543/postgres"):
-        _pool_kw["poolclass"] = NullPool
-        _pool_kw["pool_pre_ping"] = True
-    engine = create_engine(DATABASE_URL, **_pool_kw)
+# Pool mode, sizes and statement_timeout come from DB_POOL_* (see db_pool.py). Supabase
+# transaction-pooler URLs default to a PgBouncer-safe QueuePool instead of NullPool. The
+# routers bind to this same engine, so the pool is per process, not per module.
+engine = shared_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -587,6 +616,66 @@ try:
 except Exception as _v_err:
     print(f"[WARN] Could not ensure vouchers table: {_v_err}")
 
+# Ensure product search indexes exist (Postgres only; see migrations/015_product_search.sql)
+# Built CONCURRENTLY, so a first start on a large catalogue does not block stock writes
+if "sqlite" not in DATABASE_URL:
+    try:
+        ensure_search_indexes(engine)
+    except Exception as _s_err:
+        print(f"[WARN] Could not ensure product search indexes: {_s_err}")
+
+# Ensure the document number counters exist (chalans, vouchers, invoices, POs)
+try:
+    ensure_document_counters(engine)
+except Exception as _dc_err:
+    print(f"[WARN] Could not ensure document_counters table: {_dc_err}")
+
+# Ensure indexed short codes for receipt / purchase prefix lookups (Postgres only)
+try:
+    ensure_short_codes(engine)
+except Exception as _sc_err:
+    print(f"[WARN] Could not ensure sale/purchase short codes, prefix lookups will scan: {_sc_err}")
+
+# Running-balance stock ledger and snapshots for point-in-time stock (Postgres only)
+try:
+    ensure_stock_ledger(engine)
+except Exception as _sl_err:
+    print(f"[WARN] Could not ensure stock ledger, /api/stock/as-of is unavailable: {_sl_err}")
+
+# Watermark for incremental stock reconciliation (Postgres only; needs the stock ledger)
+try:
+    ensure_stock_reconciliation(engine)
+except Exception as _rc_err:
+    print(f"[WARN] Could not ensure stock reconciliation state, runs will scan in full: {_rc_err}")
+
+# Index the already-returned lookup used by partial sales returns (Postgres only)
+try:
+    ensure_sale_returns(engine)
+except Exception as _sr_err:
+    print(f"[WARN] Could not ensure sales return index: {_sr_err}")
+
+# Ensure sale idempotency keys exist (Postgres only; see migrations/018_idempotency_keys.sql)
+if "sqlite" not in DATABASE_URL:
+    try:
+        with engine.connect() as conn:
+            for _ddl in IDEMPOTENCY_DDL:
+                conn.execute(text(_ddl))
+            conn.commit()
+    except Exception as _idem_err:
+        print(f"[WARN] Could not ensure sale idempotency keys: {_idem_err}")
+
+# Ensure delta-sync change log and triggers exist (Postgres only)
+try:
+    ensure_sync_schema(engine)
+except Exception as _sync_err:
+    print(f"[WARN] Could not ensure sync change log: {_sync_err}")
+
+# Ensure the domain event outbox exists; without it side effects run inline
+try:
+    ensure_outbox_schema(engine)
+except Exception as _outbox_err:
+    print(f"[WARN] Could not ensure domain_events outbox, running event handlers inline: {_outbox_err}")
+
 # Database Models
 class Profile(Base):
     __tablename__ = "profiles"
@@ -880,6 +969,8 @@ class Sale(Base):
     emi_amount = Column(Float)
     emi_interest_rate = Column(Float)
     notes = Column(Text)
+    # Client-generated; a replayed sale with a known key returns the stored one
+    idempotency_key = Column(String, unique=True)
     created_by = Column(String, ForeignKey("profiles.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -901,6 +992,7 @@ class SaleItem(Base):
     batch_no = Column("batch_number", String)
     expiry_date = Column(Date)
     gst_percent = Column("vat_percentage", Float)
+    idempotency_key = Column(String, unique=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class SalePayment(Base):
@@ -1144,7 +1236,7 @@ def upsert_profile_from_supabase(
                 "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
                 "Accept": "application/json",
             }
-            resp = requests.get(rest_url, headers=headers, params=params, timeout=10)
+            resp = supabase_http.get(rest_url, headers=headers, params=params)
             if resp.status_code == 200:
                 arr = resp.json() or []
                 if isinstance(arr, list) and len(arr) > 0:
@@ -1176,8 +1268,17 @@ def upsert_profile_from_supabase(
         if supabase_role:
             profile.role = supabase_role
 
+    # Now and again once the caller commits, so a lookup in between cannot keep the old role
+    role_cache.invalidate(user_id)
+    db.info.setdefault("role_cache_invalidate", set()).add(user_id)
     return profile
 
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_roles(session):
+    for user_id in session.info.pop("role_cache_invalidate", ()):
+        role_cache.invalidate(user_id)
+
 def ensure_user_has_role(db: Session, user_id: str, role: str = "employee"):
     # Deprecated: roles now sourced from Profile.role (single source of truth).
     # Keep as no-op for backward compatibility in case of stray calls.
@@ -1212,11 +1313,10 @@ def create_supabase_user(email: str, password: str, full_name: Optional[str] = N
         payload["user_metadata"] = metadata
 
     try:
-        response = requests.post(
+        response = supabase_http.post(
             f"{SUPABASE_ADMIN_URL}/users",
             headers=_supabase_headers(SUPABASE_SERVICE_ROLE_KEY),
             json=payload,
-            timeout=10,
         )
     except RequestException:
         raise HTTPException(
@@ -1295,11 +1395,10 @@ def authenticate_with_supabase(email: str, password: str) -> Tuple[Optional[dict
         )
 
     try:
-        response = requests.post(
+        response = supabase_http.post(
             f"{SUPABASE_AUTH_URL}/token?grant_type=password",
             headers=_supabase_headers(SUPABASE_ANON_KEY),
             json={"email": email, "password": password},
-            timeout=12,
         )
     except RequestException:
         raise HTTPException(
@@ -1328,14 +1427,13 @@ def authenticate_with_supabase(email: str, password: str) -> Tuple[Optional[dict
     # Some GoTrue deployments return tokens without embedding `user`; recover via /user.
     if not data.get("user") and data.get("access_token"):
         try:
-            ur = requests.get(
+            ur = supabase_http.get(
                 f"{SUPABASE_AUTH_URL}/user",
                 headers={
                     "apikey": SUPABASE_ANON_KEY,
                     "Authorization": f"Bearer {data['access_token']}",
                     "Content-Type": "application/json",
                 },
-                timeout=12,
             )
             if ur.status_code == 200:
                 uj = ur.json()
@@ -1382,10 +1480,20 @@ def get_user_by_email(db: Session, email: str):
     e = email.strip().lower()
     return db.query(Profile).filter(func.lower(Profile.email) == e).first()
 
-def get_roles_for_user(db: Session, user_id: str) -> List[str]:
+def get_roles_for_user(db: Session, user_id: str, profile: Optional[Profile] = None) -> List[str]:
+    # Served from the per-process role cache; entries expire after the refresh
+    # interval (Supabase mode) or TTL (local mode) and are dropped on role writes.
+    cached = role_cache.get(user_id)
+    if cached is not None:
+        return cached
+    roles = _resolve_roles_for_user(db, user_id, profile)
+    role_cache.set(user_id, roles)
+    return roles
+
+def _resolve_roles_for_user(db: Session, user_id: str, profile: Optional[Profile] = None) -> List[str]:
     # Try live read from Supabase profiles.role for freshest value
     try:
-        if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY and user_id:
+        if is_supabase_authoritative() and SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY and user_id:
             rest_url = f"{SUPABASE_URL}/rest/v1/profiles"
             params = {"id": f"eq.{user_id}", "select": "role"}
             headers = {
@@ -1394,7 +1502,7 @@ def get_roles_for_user(db: Session, user_id: str) -> List[str]:
                 "Accept": "application/json",
                 "Accept-Profile": "public",
             }
-            resp = requests.get(rest_url, headers=headers, params=params, timeout=12)
+            resp = supabase_http.get(rest_url, headers=headers, params=params)
             if resp.status_code == 200:
                 arr = resp.json() or []
                 if isinstance(arr, list) and len(arr) > 0:
@@ -1402,7 +1510,7 @@ def get_roles_for_user(db: Session, user_id: str) -> List[str]:
                     if isinstance(sup_role, str) and sup_role.lower() in ("admin", "manager", "employee"):
                         # Sync local cache to avoid stale fallbacks later
                         try:
-                            u = db.query(Profile).filter(Profile.id == user_id).first()
+                            u = profile if profile is not None else db.query(Profile).filter(Profile.id == user_id).first()
                             if u and u.role != sup_role.lower():
                                 u.role = sup_role.lower()
                                 db.commit()
@@ -1412,7 +1520,7 @@ def get_roles_for_user(db: Session, user_id: str) -> List[str]:
     except Exception:
         pass
     # Fallback: local profile.role
-    user = db.query(Profile).filter(Profile.id == user_id).first()
+    user = profile if profile is not None else db.query(Profile).filter(Profile.id == user_id).first()
     if user and getattr(user, "role", None):
         return [user.role]
     # Fallback to legacy user_roles if present
@@ -1421,9 +1529,91 @@ def get_roles_for_user(db: Session, user_id: str) -> List[str]:
         return [r.role for r in roles]
     return ["employee"]
 
+class AuthContext:
+    """Request-scoped auth state: token claims, profile, roles and permission set.
+
+    Profile, roles and permissions are resolved lazily, so a permission check
+    answered from the role cache does not touch the database at all.
+    """
+
+    _UNLOADED = object()
+
+    def __init__(self, db: Session, user_id: str, payload: dict, profile=_UNLOADED):
+        self._db = db
+        self.user_id = user_id
+        self.payload = payload
+        self._profile = profile
+        self._roles: Optional[List[str]] = None
+        self._permissions = None
+
+    @property
+    def profile(self) -> Optional[Profile]:
+        if self._profile is AuthContext._UNLOADED:
+            # Permission checks fall back to Supabase roles when the local DB is unreachable
+            try:
+                self._profile = self._db.query(Profile).filter(Profile.id == self.user_id).first()
+            except Exception:
+                self._db.rollback()
+                self._profile = None
+        return self._profile
+
+    @property
+    def roles(self) -> List[str]:
+        if self._roles is None:
+            profile = None if self._profile is AuthContext._UNLOADED else self._profile
+            self._roles = get_roles_for_user(self._db, self.user_id, profile)
+        return self._roles
+
+    @property
+    def permissions(self):
+        if self._permissions is None:
+            self._permissions = RBACHelper.get_user_permissions(self.roles)
+        return self._permissions
+
+    def has_permission(self, permission) -> bool:
+        return RBACHelper.has_permission(self.roles, permission)
+
+    def as_user_dict(self) -> dict:
+        """Dict shape used by the routers' current_user dependencies"""
+        profile = self.profile
+        return {
+            "id": self.user_id,
+            "email": profile.email if profile else self.payload.get("email"),
+            "full_name": profile.full_name if profile else None,
+            "role": self.roles[0] if self.roles else None,
+            "roles": list(self.roles),
+        }
+
+def _resolve_auth_context(request: Request, token: str, db: Session) -> AuthContext:
+    """Decode the bearer token once per request; the profile loads on first use."""
+    ctx = getattr(request.state, "auth_context", None)
+    if ctx is not None:
+        return ctx
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user_id = payload.get("sub")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    ctx = AuthContext(db, str(user_id), payload)
+    request.state.auth_context = ctx
+    return ctx
+
+def get_auth_context(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db),
+) -> AuthContext:
+    return _resolve_auth_context(request, credentials.credentials, db)
+
 def require_roles(allowed_roles: List[str]):
-    def _checker(current_user: Profile = Depends(get_current_user), db: Session = Depends(get_db)):
-        roles = get_roles_for_user(db, current_user.id)
+    def _checker(ctx: AuthContext = Depends(get_auth_context)):
+        roles = ctx.roles
         if not any(role in allowed_roles for role in roles):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden: insufficient role")
         return True
@@ -1444,30 +1634,13 @@ def require_staff():
 
 def require_permission(permission):
     """Require specific permission for endpoint access"""
-    from rbac import RBACHelper
-    
-    async def permission_checker(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-        try:
-            token = credentials.credentials
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id = payload.get("sub")
-            
-            if not user_id:
-                raise HTTPException(status_code=401, detail="Invalid token")
-            
-            # Get user roles
-            user_roles = get_roles_for_user(db, user_id)
-            
-            # Check permission
-            if not RBACHelper.has_permission(user_roles, permission):
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"Insufficient permissions. Required: {permission.value}"
-                )
-            
-            return True
-        except JWTError:
-            raise HTTPException(status_code=401, detail="Could not validate credentials")
+    def permission_checker(ctx: AuthContext = Depends(get_auth_context)):
+        if not ctx.has_permission(permission):
+            raise HTTPException(
+                status_code=403,
+                detail=f"Insufficient permissions. Required: {permission.value}"
+            )
+        return True
     
     return permission_checker
 
@@ -1476,71 +1649,34 @@ def generate_chalan_number(receive_type: str, db: Session) -> str:
     """
     Generate chalan number in format: TYPE + 6 digits + MMYYYY
     Examples: OP000001112025, TR000001112025, ADJ000001112025
+
+    Numbers come from the (prefix, month) row in document_counters, taken in
+    the caller's transaction, so concurrent chalans never share a number.
     """
-    from datetime import datetime
-    
-    # Get current month and year
-    now = datetime.now()
-    month_year = f"{now.month:02d}{now.year}"
-    
-    # Map receive types to prefixes
-    type_prefixes = {
-        'OP': 'OP',      # Opening Stock
-        'TRNS': 'TR',    # Transfer
-        'ADJ': 'ADJ',    # Adjustment
-        'PUR': 'PUR',    # Purchase
-        'RET': 'RET'     # Return
-    }
-    
-    prefix = type_prefixes.get(receive_type, 'GEN')
-    
-    # Get the next sequential number for this type and month/year
-    # Count existing records for this type and month/year
-    if receive_type in ['OP', 'TRNS', 'ADJ']:
-        # For receive types, check elc_receive_master table
-        count = db.query(ElcReceiveMaster).filter(
-            ElcReceiveMaster.receive_type == receive_type,
-            func.extract('month', ElcReceiveMaster.chalan_date) == now.month,
-            func.extract('year', ElcReceiveMaster.chalan_date) == now.year
-        ).count()
-    else:
-        # For issue types, check elc_issue_master table
-        count = db.query(ElcIssueMaster).filter(
-            ElcIssueMaster.issue_type == receive_type,
-            func.extract('month', ElcIssueMaster.chalan_date) == now.month,
-            func.extract('year', ElcIssueMaster.chalan_date) == now.year
-        ).count()
-    
-    # Generate next sequential number (1-based)
-    next_number = count + 1
-    
-    # Format as 6-digit number with leading zeros
-    sequential = f"{next_number:06d}"
-    
-    # Combine: PREFIX + 6 digits + MMYYYY
-    chalan_no = f"{prefix}{sequential}{month_year}"
-    
-    return chalan_no
+    return chalan_number(db, receive_type)
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = db.query(Profile).filter(Profile.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
+def get_current_user(ctx: AuthContext = Depends(get_auth_context)):
+    if ctx.profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return ctx.profile
+
+def get_current_user_dict(ctx: AuthContext = Depends(get_auth_context)) -> dict:
+    return ctx.as_user_dict()
+
+# Routers declare placeholder get_current_user dependencies; bind them to the
+# shared request-scoped AuthContext so every dependency reuses one decode.
+for _router_module in (
+    "pharmacy_routes", "service_routes", "hrm_routes", "finance_routes", "crm_routes",
+    "auto_reorder_routes", "notification_routes", "backup_routes", "system_config_routes",
+    "messages_routes",
+):
+    _placeholder = getattr(sys.modules.get(_router_module), "get_current_user", None)
+    if _placeholder is not None:
+        app.dependency_overrides[_placeholder] = get_current_user_dict
 
 # Pydantic models for requests
 class LoginRequest(BaseModel):
@@ -1774,6 +1910,43 @@ class PaymentCreate(BaseModel):
     method: str  # cash | card | online | bank
     status: Optional[str] = None  # pending | cleared (admin can set cleared)
 
+class CheckoutLine(BaseModel):
+    product_id: str
+    quantity: int = Field(..., gt=0)
+    unit_price: float = Field(..., ge=0)
+    batch_no: Optional[str] = None
+    expiry_date: Optional[datetime] = None
+    gst_percent: Optional[float] = None
+
+class CheckoutPayment(BaseModel):
+    amount: float = Field(..., ge=0)
+    method: str = Field(..., pattern="^(cash|bkash|upay|visa|bank_transfer)$")
+
+class CheckoutRequest(BaseModel):
+    """Whole POS cart; totals are recomputed server-side from the lines"""
+    customer_name: str = Field("Walk-in Customer", min_length=1, max_length=255)
+    customer_phone: Optional[str] = Field(None, max_length=20)
+    customer_email: Optional[EmailStr] = None
+    customer_id: Optional[str] = None
+    items: List[CheckoutLine] = Field(..., min_length=1)
+    payments: List[CheckoutPayment] = []
+    payment_method: str = Field("cash", pattern="^(cash|bkash|upay|visa|bank_transfer)$")
+    discount: float = Field(0, ge=0)
+    tax: float = Field(0, ge=0)
+    coupon_code: Optional[str] = None
+    loyalty_redeem: int = Field(0, ge=0)
+    earn_loyalty: bool = False
+    notes: Optional[str] = None
+    # Client-generated per sale; replaying the same key never sells twice
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=100)
+
+class SaleBatchRequest(BaseModel):
+    """Sales queued offline; each entry is validated as a CheckoutRequest on its own"""
+    sales: List[dict] = Field(..., min_length=1, max_length=SALE_BATCH_MAX)
+
+class InvoiceBatchRequest(BaseModel):
+    sale_ids: List[str] = Field(..., min_length=1, max_length=INVOICE_BATCH_MAX)
+
 class PurchaseItemCreate(BaseModel):
     product_id: str
     qty: float
@@ -2454,21 +2627,10 @@ async def register(request: RegisterRequest, db: Session = Depends(get_db)):
     return profile
 
 @app.get("/api/auth/me", response_model=ProfileResponse)
-async def get_current_user_info(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
-):
-    try:
-        current_user = get_current_user(credentials, db)
-        return current_user
-    except Exception:
-        pass
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        uid = payload.get("sub")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
-    profile_data = _rest_get_profile(user_id=uid)
+async def get_current_user_info(ctx: AuthContext = Depends(get_auth_context)):
+    if ctx.profile is not None:
+        return ctx.profile
+    profile_data = _rest_get_profile(user_id=ctx.user_id)
     if not profile_data:
         raise HTTPException(status_code=404, detail="User not found")
     return _profile_dict_to_response(profile_data)
@@ -2516,7 +2678,7 @@ async def list_all_users(db: Session = Depends(get_db)):
         return result
     else:
         try:
-            resp = requests.get(
+            resp = supabase_http.get(
                 f"{SUPABASE_URL}/rest/v1/profiles",
                 headers=_rest_headers(),
                 params={"select": "id,full_name,email,phone,role,created_at", "order": "created_at.desc"},
@@ -2524,7 +2686,7 @@ async def list_all_users(db: Session = Depends(get_db)):
             if resp.status_code == 200:
                 profiles_data = resp.json() or []
                 for p in profiles_data:
-                    roles_resp = requests.get(
+                    roles_resp = supabase_http.get(
                         f"{SUPABASE_URL}/rest/v1/user_roles",
                         headers=_rest_headers(),
                         params={"user_id": f"eq.{p['id']}", "select": "role"},
@@ -2561,118 +2723,230 @@ async def update_user_role(user_id: str, req: RoleUpdateRequest, db: Session = D
         else:
             db.add(UserRole(id=str(uuid.uuid4()), user_id=user_id, role=req.role))
         db.commit()
+        role_cache.invalidate(user_id)
         return {"success": True, "user_id": user_id, "role": req.role}
     else:
         try:
-            requests.patch(
+            supabase_http.patch(
                 f"{SUPABASE_URL}/rest/v1/profiles",
                 headers={**_rest_headers(), "Content-Type": "application/json"},
                 params={"id": f"eq.{user_id}"},
                 json={"role": req.role},
             )
-            patch_resp = requests.patch(
+            patch_resp = supabase_http.patch(
                 f"{SUPABASE_URL}/rest/v1/user_roles",
                 headers={**_rest_headers(), "Content-Type": "application/json"},
                 params={"user_id": f"eq.{user_id}"},
                 json={"role": req.role},
             )
             if not patch_resp.ok:
-                requests.post(
+                supabase_http.post(
                     f"{SUPABASE_URL}/rest/v1/user_roles",
                     headers={**_rest_headers(), "Content-Type": "application/json"},
                     json={"id": str(uuid.uuid4()), "user_id": user_id, "role": req.role},
                 )
+            role_cache.invalidate(user_id)
             return {"success": True, "user_id": user_id, "role": req.role}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
 # CRUD endpoints for all entities
-@app.get("/api/categories", response_model=List[CategoryResponse])
+@app.get("/api/categories", response_model=List[CategoryResponse], dependencies=[Depends(etag_guard("categories"))])
 async def get_categories(db: Session = Depends(get_db)):
     return db.query(Category).all()
 
-@app.get("/api/subcategories", response_model=List[SubcategoryResponse])
+@app.get("/api/subcategories", response_model=List[SubcategoryResponse], dependencies=[Depends(etag_guard("subcategories"))])
 async def get_subcategories(db: Session = Depends(get_db)):
     return db.query(Subcategory).all()
 
-@app.get("/api/countries", response_model=List[CountryResponse])
+@app.get("/api/countries", response_model=List[CountryResponse], dependencies=[Depends(etag_guard("countries"))])
 async def get_countries(db: Session = Depends(get_db)):
     return db.query(Country).all()
 
 @app.get("/api/suppliers", response_model=List[SupplierResponse], dependencies=[Depends(require_permission(Permission.VIEW_SUPPLIERS))])
-async def get_suppliers(db: Session = Depends(get_db)):
-    return db.query(Supplier).all()
+async def get_suppliers(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    return paginate(db, db.query(Supplier), page, response, [(Supplier.name, False), (Supplier.id, False)])
 
 @app.get("/api/customers", response_model=List[CustomerResponse], dependencies=[Depends(require_permission(Permission.VIEW_CUSTOMERS))])
-async def get_customers(db: Session = Depends(get_db)):
-    return db.query(Customer).all()
+async def get_customers(
+    response: Response,
+    search: Optional[str] = None,
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+):
+    query = db.query(Customer)
+    if search:
+        term = f"%{search.strip()}%"
+        query = query.filter(or_(Customer.name.ilike(term), Customer.phone.ilike(term), Customer.email.ilike(term)))
+    return paginate(db, query, page, response, [(Customer.name, False), (Customer.id, False)])
 
-@app.get("/api/companies", response_model=List[CompanyResponse])
+@app.get("/api/companies", response_model=List[CompanyResponse], dependencies=[Depends(etag_guard("companies"))])
 async def get_companies(db: Session = Depends(get_db)):
     return db.query(Company).all()
 
+_PRODUCT_LIST_FIELDS = list(ProductResponse.model_fields)
+_PRODUCT_COLUMN_FIELDS = {f for f in _PRODUCT_LIST_FIELDS if f in Product.__table__.columns}
+_PRODUCT_STOCK_STATES = ("in_stock", "low", "out")
+
 @app.get("/api/products", response_model=List[ProductResponse], dependencies=[Depends(require_permission(Permission.VIEW_PRODUCTS))])
-async def get_products(db: Session = Depends(get_db)):
-    products = db.query(Product).all()
-    result = []
-    for product in products:
-        product_dict = {
-            "id": str(product.id) if product.id else None,
-            "name": product.name,
-            "sku": product.sku,
-            "category_id": str(product.category_id) if product.category_id else None,
-            "category": None,
-            "subcategory_id": str(product.subcategory_id) if product.subcategory_id else None,
-            "supplier_id": str(product.supplier_id) if product.supplier_id else None,
-            "description": product.description,
-            "unit_price": product.unit_price,
-            "cost_price": product.cost_price,
-            "stock_quantity": product.stock_quantity,
-            "reorder_level": product.reorder_level,
-            "min_stock_level": product.min_stock_level,
-            "max_stock_level": product.max_stock_level,
-            "image_url": product.image_url,
-            "brand": product.brand,
-            "model": product.model,
-            "manufacturer": product.manufacturer,
-            "country_of_origin": product.country_of_origin,
-            "mrp_unit": product.mrp_unit,
-            "mrp_strip": product.mrp_strip,
-            "weight": product.weight,
-            "dimensions": product.dimensions,
-            "color": product.color,
-            "specifications": product.specifications,
-            "features": product.features,
-            "package_contents": product.package_contents,
-            "unit_type": getattr(product, "unit_type", None),
-            "unit_size": getattr(product, "unit_size", None),
-            "unit_multiplier": getattr(product, "unit_multiplier", None),
-            "purchase_price": getattr(product, "purchase_price", None),
-            "selling_price": getattr(product, "selling_price", None),
-            "min_stock_threshold": getattr(product, "min_stock_threshold", None),
-            "batch_number": None,  # Moved to medicine_batches table
-            "expiry_date": None,  # Moved to medicine_batches table
-            "manufacturing_date": None,  # Moved to medicine_batches table
-            "shelf_life": getattr(product, "shelf_life", None),
-            "active_ingredients": getattr(product, "active_ingredients", None),
-            "dosage": getattr(product, "dosage", None),
-            "storage_instructions": getattr(product, "storage_instructions", None),
-            "indications": getattr(product, "indications", None),
-            "side_effects": getattr(product, "side_effects", None),
-            "prescription_required": getattr(product, "prescription_required", False),
-            "created_at": product.created_at,
-            "updated_at": product.updated_at
-        }
-        
-        # Get category name if category_id exists
-        if product.category_id:
-            category = db.query(Category).filter(Category.id == product.category_id).first()
-            if category:
-                product_dict["category"] = category.name
-        
-        result.append(ProductResponse(**product_dict))
-    
-    return result
+async def get_products(
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    category_id: Optional[str] = None,
+    supplier_id: Optional[str] = None,
+    stock_state: Optional[str] = None,
+    prescription_required: Optional[bool] = None,
+    search: Optional[str] = None,
+    fields: Optional[str] = None,
+    etag: str = Depends(etag_guard("products")),
+    db: Session = Depends(get_db),
+):
+    """
+    Product catalogue in a single query joined to categories.
+
+    Without `limit` the whole catalogue is returned, as existing screens expect.
+    With `limit` the list is keyset-paginated by (name, id); the cursor for the
+    next page comes back in the X-Next-Cursor header and is passed as `after`.
+    `fields` is a comma-separated projection, e.g. `id,name,sku,selling_price,stock_quantity`.
+    """
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in _PRODUCT_LIST_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    else:
+        requested = _PRODUCT_LIST_FIELDS
+    if stock_state and stock_state not in _PRODUCT_STOCK_STATES:
+        raise HTTPException(status_code=400, detail=f"stock_state must be one of: {', '.join(_PRODUCT_STOCK_STATES)}")
+
+    column_names = [f for f in requested if f in _PRODUCT_COLUMN_FIELDS]
+    for key in ("id", "name"):
+        if key not in column_names:
+            column_names.append(key)
+    columns = [getattr(Product, f) for f in column_names]
+    if "category" in requested:
+        query = db.query(*columns, Category.name.label("category")).outerjoin(Category, Category.id == Product.category_id)
+    else:
+        query = db.query(*columns)
+
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+    if supplier_id:
+        query = query.filter(Product.supplier_id == supplier_id)
+    if prescription_required is not None:
+        rx_flags = or_(Product.is_prescription_required.is_(True), Product.prescription_required.is_(True))
+        query = query.filter(rx_flags if prescription_required else ~rx_flags)
+    if stock_state:
+        qty = func.coalesce(Product.stock_quantity, 0)
+        reorder = func.coalesce(Product.reorder_level, 0)
+        if stock_state == "out":
+            query = query.filter(qty <= 0)
+        elif stock_state == "low":
+            query = query.filter(qty > 0, qty <= reorder)
+        else:
+            query = query.filter(qty > reorder)
+    if search:
+        term = f"%{search.strip()}%"
+        query = query.filter(or_(
+            Product.name.ilike(term),
+            Product.sku.ilike(term),
+            Product.generic_name.ilike(term),
+            Product.barcode.ilike(term),
+        ))
+
+    query = apply_keyset(query, [(Product.name, False), (Product.id, False)], after)
+    rows, next_cursor = fetch_page(query, clamp_limit(limit), key=lambda r: (r.name, r.id))
+
+    # Rows go straight to bytes; no per-row model validation or jsonable_encoder
+    row_fields = column_names + (["category"] if "category" in requested else [])
+    items = project_rows(rows, row_fields, {"id": str_or_none})
+    if row_fields != requested:
+        items = [{f: item.get(f) for f in requested} for item in items]
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return FastJSONResponse(items, headers=headers)
+
+@app.get("/api/products/search", dependencies=[Depends(require_permission(Permission.VIEW_PRODUCTS))])
+async def search_products_endpoint(q: str, limit: int = SEARCH_DEFAULT_LIMIT, db: Session = Depends(get_db)):
+    """
+    Ranked typeahead search by name, generic name, brand, SKU or barcode.
+    Each hit carries sellable stock and the best active batch price.
+    """
+    return search_products(db, q, limit)
+
+@app.get("/api/pos/scan/{code}", dependencies=[Depends(require_permission(Permission.VIEW_PRODUCTS))])
+async def scan_product_code(code: str, db: Session = Depends(get_db)):
+    """Resolve a scanned barcode or SKU to product, price, tax and FEFO-ordered batches."""
+    entry = scan_index.lookup(db, code)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No product for this code")
+    return entry
+
+@app.get("/api/stock/as-of", dependencies=[Depends(require_permission(Permission.VIEW_PRODUCTS))])
+async def get_stock_as_of(
+    date: date,
+    level: str = "product",
+    product_id: Optional[str] = None,
+    store_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Stock at the end of `date` per product, batch or store (from the stock ledger)."""
+    return stock_as_of(db, end_of_day(date), level, product_id, store_id)
+
+@app.get("/api/stock/movements", dependencies=[Depends(require_permission(Permission.VIEW_PRODUCTS))])
+async def get_stock_movements(
+    product_id: str,
+    start: date,
+    end: date,
+    level: str = "product",
+    batch_id: Optional[str] = None,
+    store_id: Optional[str] = None,
+    limit: int = 1000,
+    db: Session = Depends(get_db),
+):
+    """Opening/closing stock, totals in and out, and each movement of a product from `start` to `end` inclusive."""
+    return stock_movements(db, product_id, end_of_day(start) - timedelta(days=1), end_of_day(end),
+                           level, batch_id, store_id, max(1, min(limit, 5000)))
+
+@app.post("/api/stock/reconcile", dependencies=[Depends(require_admin())])
+async def run_stock_reconciliation(mode: str = "incremental", repair: bool = False):
+    """Compare product, batch and store stock totals; `repair` fixes what can be attributed."""
+    if mode not in ("incremental", "full"):
+        raise HTTPException(status_code=400, detail="mode must be 'incremental' or 'full'")
+    report = reconcile_stock(SessionLocal, mode, repair)
+    if report.get("skipped"):
+        raise HTTPException(status_code=409, detail=report["reason"])
+    if report["repaired_count"]:
+        scan_index.invalidate(*[d["product_id"] for d in report["drift"] if d["repaired"]])
+    return report
+
+@app.get("/api/stock/reconcile", dependencies=[Depends(require_admin())])
+async def get_stock_reconciliation(db: Session = Depends(get_db)):
+    """Report of the last reconciliation run."""
+    report = last_reconciliation(db)
+    if report is None:
+        raise HTTPException(status_code=404, detail="No reconciliation has run yet")
+    return report
+
+@app.get("/api/sync/changes", dependencies=[Depends(require_permission(Permission.VIEW_PRODUCTS))])
+async def sync_changes(
+    since: Optional[int] = None,
+    limit: int = SYNC_MAX_CHANGES,
+    ctx: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db),
+):
+    """
+    Products, batches, discount configs and customers changed since `since`.
+    Upserts carry the full row, deletes are ids. Poll again with the returned
+    token; `has_more` means call again immediately, `full_resync` means reload
+    the tables through their list endpoints first. Customers are only included
+    for callers who may view them.
+    """
+    feed = get_changes(db, since, limit)
+    if not ctx.has_permission(Permission.VIEW_CUSTOMERS):
+        feed["changes"].pop("customers", None)
+    return feed
 
 @app.get("/api/products/{product_id}/stock", dependencies=[Depends(require_permission(Permission.VIEW_STOCK))])
 async def get_product_stock(product_id: str, db: Session = Depends(get_db)):
@@ -2686,12 +2960,37 @@ async def get_product_stock(product_id: str, db: Session = Depends(get_db)):
         return {"product_id": product_id, "total_qty": float(qty)}
 
 @app.get("/api/sales", response_model=List[SaleResponse], dependencies=[Depends(require_permission(Permission.VIEW_SALES))])
-async def get_sales(db: Session = Depends(get_db)):
-    return db.query(Sale).all()
+async def get_sales(
+    response: Response,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+):
+    query = db.query(Sale)
+    if from_date:
+        query = query.filter(Sale.created_at >= from_date)
+    if to_date:
+        query = query.filter(Sale.created_at <= to_date)
+    if payment_status:
+        query = query.filter(Sale.payment_status == payment_status)
+    return paginate(db, query, page, response, [(Sale.created_at, True), (Sale.id, True)])
 
 @app.get("/api/stock-transactions", response_model=List[StockTransactionResponse])
-async def get_stock_transactions(db: Session = Depends(get_db)):
-    return db.query(StockTransaction).all()
+async def get_stock_transactions(
+    response: Response,
+    product_id: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+):
+    query = db.query(StockTransaction)
+    if product_id:
+        query = query.filter(StockTransaction.product_id == product_id)
+    if transaction_type:
+        query = query.filter(StockTransaction.transaction_type == transaction_type)
+    return paginate(db, query, page, response, [(StockTransaction.created_at, True), (StockTransaction.id, True)])
 
 @app.get("/api/sales/{sale_id}/items", response_model=List[SaleItemResponse], dependencies=[Depends(require_permission(Permission.VIEW_SALES))])
 async def get_sale_items(sale_id: str, db: Session = Depends(get_db)):
@@ -2705,9 +3004,9 @@ async def create_category(category: CategoryCreate, db: Session = Depends(get_db
         **category.model_dump()
     )
     db.add(db_category)
+    write_audit_log(db, None, "create", "categories", db_category.id, None, {"name": db_category.name, "description": db_category.description})
     db.commit()
     db.refresh(db_category)
-    write_audit_log(db, None, "create", "categories", db_category.id, None, {"name": db_category.name, "description": db_category.description})
     return db_category
 
 @app.post("/api/subcategories", response_model=SubcategoryResponse, dependencies=[Depends(require_staff())])
@@ -2829,9 +3128,10 @@ async def create_product(product: ProductCreate, db: Session = Depends(get_db)):
         **data
     )
     db.add(db_product)
+    write_audit_log(db, None, "create", "products", db_product.id, None, {"sku": db_product.sku, "name": db_product.name})
     db.commit()
     db.refresh(db_product)
-    write_audit_log(db, None, "create", "products", db_product.id, None, {"sku": db_product.sku, "name": db_product.name})
+    scan_index.invalidate(db_product.id)
     return db_product
 
 # UPDATE and DELETE endpoints
@@ -2844,9 +3144,9 @@ async def update_category(category_id: str, category: CategoryCreate, db: Sessio
     for key, value in category.model_dump().items():
         setattr(db_category, key, value)
     
+    write_audit_log(db, None, "update", "categories", db_category.id, old_state, {"name": db_category.name, "description": db_category.description})
     db.commit()
     db.refresh(db_category)
-    write_audit_log(db, None, "update", "categories", db_category.id, old_state, {"name": db_category.name, "description": db_category.description})
     return db_category
 
 @app.delete("/api/categories/{category_id}", dependencies=[Depends(require_staff())])
@@ -2856,8 +3156,8 @@ async def delete_category(category_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Category not found")
     old_state = {"name": db_category.name}
     db.delete(db_category)
-    db.commit()
     write_audit_log(db, None, "delete", "categories", category_id, old_state, None)
+    db.commit()
     return {"message": "Category deleted successfully"}
 
 @app.put("/api/suppliers/{supplier_id}", response_model=SupplierResponse, dependencies=[Depends(require_staff())])
@@ -2923,9 +3223,10 @@ async def update_product(product_id: str, product: ProductCreate, db: Session =
         if key in valid_cols:
             setattr(db_product, key, value)
 
+    write_audit_log(db, None, "update", "products", db_product.id, None, {"name": db_product.name, "sku": db_product.sku})
     db.commit()
     db.refresh(db_product)
-    write_audit_log(db, None, "update", "products", db_product.id, None, {"name": db_product.name, "sku": db_product.sku})
+    scan_index.invalidate(db_product.id)
     return db_product
 
 @app.delete("/api/products/{product_id}", dependencies=[Depends(require_staff())])
@@ -2935,8 +3236,9 @@ async def delete_product(product_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Product not found")
     
     db.delete(db_product)
-    db.commit()
     write_audit_log(db, None, "delete", "products", product_id, None, None)
+    db.commit()
+    scan_index.invalidate(product_id)
     return {"message": "Product deleted successfully"}
 
 @app.get("/api/dashboard/stats", dependencies=[Depends(require_permission(Permission.VIEW_DASHBOARD))])
@@ -3038,31 +3340,14 @@ async def trigger_daily_summary(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Failed to send summary: {str(e)}")
 
 @app.get("/api/rbac/permissions")
-async def get_user_permissions(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    if _probe_db():
-        try:
-            from rbac import get_current_user_permissions
-            return get_current_user_permissions(db, user_id)
-        except Exception:
-            pass
-
-    from rbac import RBACHelper
-    role_names = _rest_get_roles(user_id)
-    permissions = RBACHelper.get_user_permissions(role_names)
-    return {
-        "user_id": user_id,
-        "roles": role_names,
-        "permissions": [perm.value for perm in permissions],
-    }
+async def get_user_permissions(ctx: AuthContext = Depends(get_auth_context)):
+    # Payload per role combination is precomputed in rbac; "version" changes
+    # only when ROLE_PERMISSIONS does, so clients can cache on it.
+    if ctx.profile is not None:
+        role_names = ctx.roles
+    else:
+        role_names = _rest_get_roles(ctx.user_id)
+    return {"user_id": ctx.user_id, **RBACHelper.get_permissions_payload(role_names)}
 
 @app.get("/api/backups")
 async def list_backups(dependencies=[Depends(require_admin())]):
@@ -3202,11 +3487,34 @@ async def get_system_performance(db: Session = Depends(get_db)):
             "slow_api_calls": PerformanceMonitor.get_slow_api_calls(10),
             "table_sizes": optimizer.get_table_sizes()[:10],
             "index_usage": optimizer.get_index_usage()[:10],
-            "unused_indexes": optimizer.get_unused_indexes()
+            "unused_indexes": optimizer.get_unused_indexes(),
+            "role_cache": role_cache.stats(),
+            "event_loop_lag": lag_monitor.stats(),
+            "supabase_http": supabase_http.stats(),
+            "resource_versions": resource_versions.stats(),
+            "scan_index": scan_index.stats(),
+            "compression": compression_stats(),
+            "invoice_cache": invoice_cache.stats(),
+            "outbox": {**outbox_dispatcher.stats(), "backlog": outbox_backlog(db) if outbox_dispatcher.enabled else {}}
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/system/pool")
+async def get_pool_stats():
+    """Connection pool checked-out / idle / overflow counts and checkout wait times"""
+    return {**pool_stats(engine), "engines": all_pool_stats()}
+
+@app.get("/api/system/compression")
+async def get_compression_stats():
+    """Per-route bytes in/out, bytes saved and compression CPU time"""
+    return compression_stats()
+
+@app.get("/api/system/event-loop")
+async def get_event_loop_lag():
+    """Event loop wake-up lag; stays near zero while blocking work runs in the threadpool"""
+    return lag_monitor.stats()
+
 @app.post("/api/system/optimize")
 async def optimize_database(db: Session = Depends(get_db), dependencies=[Depends(require_admin())]):
     """Optimize database performance"""
@@ -3288,23 +3596,15 @@ async def create_stock_transaction(transaction: StockTransactionCreate, db: Sess
     )
     db.add(db_transaction)
     
-    # Update product stock quantity
-    product = db.query(Product).filter(Product.id == transaction.product_id).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
     # Determine if this is stock in or out
     is_stock_in = transaction.transaction_type in ['purchase', 'sales_return', 'opening_stock', 'stock_adjustment_in']
     quantity_change = transaction.quantity if is_stock_in else -transaction.quantity
     
-    # Update stock quantity
-    new_quantity = product.stock_quantity + quantity_change
-    if new_quantity < 0:
-        raise HTTPException(status_code=400, detail="Insufficient stock quantity")
-    
-    product.stock_quantity = new_quantity
+    # Conditional in-database update (404 / 400 when missing or insufficient)
+    adjust_stock(db, transaction.product_id, quantity_change)
     
     db.commit()
+    scan_index.invalidate(transaction.product_id)
     db.refresh(db_transaction)
     return db_transaction
 
@@ -3314,97 +3614,175 @@ async def delete_stock_transaction(transaction_id: str, db: Session = Depends(ge
     if not transaction:
         raise HTTPException(status_code=404, detail="Stock transaction not found")
     
-    # Reverse the stock change
-    product = db.query(Product).filter(Product.id == transaction.product_id).first()
-    if product:
-        is_stock_in = transaction.transaction_type in ['purchase', 'sales_return', 'opening_stock', 'stock_adjustment_in']
-        quantity_change = transaction.quantity if is_stock_in else -transaction.quantity
-        product.stock_quantity -= quantity_change
+    # Reverse the stock change (a deleted product has nothing to reverse)
+    is_stock_in = transaction.transaction_type in ['purchase', 'sales_return', 'opening_stock', 'stock_adjustment_in']
+    quantity_change = transaction.quantity if is_stock_in else -transaction.quantity
+    if quantity_change and not apply_stock_changes(db, {transaction.product_id: -quantity_change}, require_all=False):
+        if db.query(Product.id).filter(Product.id == transaction.product_id).first():
+            raise HTTPException(status_code=400, detail="Cannot reverse: stock from this transaction has already been used")
     
     db.delete(transaction)
     db.commit()
+    scan_index.invalidate(transaction.product_id)
     return {"message": "Stock transaction deleted successfully"}
 
+def _replayed(db: Session, model, idempotency_key: Optional[str]):
+    """The row already recorded under this Idempotency-Key, if any"""
+    if not idempotency_key:
+        return None
+    return db.query(model).filter(model.idempotency_key == idempotency_key).first()
+
 @app.post("/api/sales", response_model=SaleResponse, dependencies=[Depends(require_permission(Permission.CREATE_SALE))])
-async def create_sale(sale: SaleCreate, db: Session = Depends(get_db)):
+async def create_sale(sale: SaleCreate, db: Session = Depends(get_db),
+                      idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    existing = _replayed(db, Sale, idempotency_key)
+    if existing:
+        return existing
     db_sale = Sale(
         id=str(uuid.uuid4()),
+        idempotency_key=idempotency_key,
         **sale.model_dump()
     )
     db.add(db_sale)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = _replayed(db, Sale, idempotency_key)
+        if not existing:
+            raise
+        return existing
     db.refresh(db_sale)
     return db_sale
 
 @app.post("/api/sales/items", response_model=SaleItemResponse, dependencies=[Depends(require_permission(Permission.CREATE_SALE))])
-async def create_sale_item(item: SaleItemCreate, db: Session = Depends(get_db)):
+async def create_sale_item(item: SaleItemCreate, db: Session = Depends(get_db),
+                           idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    # A retried line must not take stock again
+    existing = _replayed(db, SaleItem, idempotency_key)
+    if existing:
+        return existing
     db_item = SaleItem(
         id=str(uuid.uuid4()),
+        idempotency_key=idempotency_key,
         **item.model_dump()
     )
     db.add(db_item)
     
-    # Update product stock quantity
+    # Name / generic / Rx flag are needed for the medication history below
     product = db.query(Product).filter(Product.id == item.product_id).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    current_stock = product.stock_quantity or 0  # null-safe (avoid None < int)
-    if current_stock < item.quantity:
-        raise HTTPException(status_code=400, detail="Insufficient stock quantity")
-
-    product.stock_quantity = current_stock - item.quantity
-    
-    # Log medication history if this is a medicine product
-    if product.generic_name or product.is_prescription_required:
-        try:
-            from patient_history import PatientHistoryService
-            
-            # Get sale to find customer
-            sale = db.query(Sale).filter(Sale.id == item.sale_id).first()
-            if sale:
-                # Find or create customer ID (simplified - in production, ensure customer exists)
-                customer = db.query(Customer).filter(
-                    or_(
-                        Customer.name == sale.customer_name,
-                        Customer.phone == sale.customer_phone
-                    )
-                ).first()
-                
-                if customer:
-                    history_service = PatientHistoryService(db)
-                    history_service.log_medication_sale(
-                        customer_id=customer.id,
-                        product_id=product.id,
-                        sale_id=sale.id,
-                        product_name=product.name,
-                        generic_name=product.generic_name or product.name,
-                        quantity=item.quantity,
-                        unit_price=item.unit_price,
-                        prescription_number=None,  # Can be added to SaleItem model if needed
-                        doctor_name=None,
-                        refill_days=30 if product.is_prescription_required else None
-                    )
-        except Exception as e:
-            print(f"[WARNING] Failed to log medication history: {e}")
+    # Conditional in-database decrement; two tills can no longer both sell the last unit
+    adjust_stock(db, item.product_id, -item.quantity)
 
     # ── Deduct from medicine_batches.quantity_remaining ───────────────────
+    allocation = None
     if item.batch_no:
-        try:
-            db.execute(text("""
-                UPDATE medicine_batches
-                SET quantity_remaining = GREATEST(0, quantity_remaining - :qty),
-                    quantity_sold = COALESCE(quantity_sold, 0) + :qty,
-                    updated_at = now()
-                WHERE product_id::text = :pid AND batch_number = :bn
-            """), {"qty": item.quantity, "pid": str(item.product_id), "bn": item.batch_no})
-        except Exception:
-            pass  # Non-fatal
+        result = db.execute(text("""
+            UPDATE medicine_batches
+            SET quantity_remaining = quantity_remaining - :qty,
+                quantity_sold = COALESCE(quantity_sold, 0) + :qty,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE product_id = :pid AND batch_number = :bn AND quantity_remaining >= :qty
+        """), {"qty": item.quantity, "pid": str(item.product_id), "bn": item.batch_no})
+        if result.rowcount == 0 and db.execute(text(
+            "SELECT 1 FROM medicine_batches WHERE product_id = :pid AND batch_number = :bn"
+        ), {"pid": str(item.product_id), "bn": item.batch_no}).first():
+            raise HTTPException(status_code=409, detail=f"Insufficient quantity in batch {item.batch_no}")
+    else:
+        # No batch picked at the till: draw first-expiry-first-out (None = product not batch-tracked)
+        allocation = allocate_fefo(db, item.product_id, item.quantity, update_product=False)
+
+    if allocation:
+        # One sales_items row per batch drawn from, so returns and recalls trace to the batch
+        first, *rest = allocation
+        db_item.batch_no = first["batch_number"]
+        db_item.expiry_date = first["expiry_date"]
+        db_item.quantity = first["quantity"]
+        db_item.total_price = round(item.unit_price * first["quantity"], 2)
+        for part in rest:
+            db.add(SaleItem(
+                id=str(uuid.uuid4()),
+                sale_id=item.sale_id,
+                product_id=item.product_id,
+                quantity=part["quantity"],
+                unit_price=item.unit_price,
+                total_price=round(item.unit_price * part["quantity"], 2),
+                batch_no=part["batch_number"],
+                expiry_date=part["expiry_date"],
+                gst_percent=item.gst_percent,
+            ))
+    
+    # Medication history and reorder alerts are consumed from the outbox after commit
+    if product.generic_name or product.is_prescription_required:
+        emit(db, "sale.medication_dispensed", {
+            "sale_id": item.sale_id,
+            "at": datetime.utcnow().isoformat(),
+            "lines": [{
+                "product_id": str(product.id),
+                "product_name": product.name,
+                "generic_name": product.generic_name,
+                "is_prescription_required": bool(product.is_prescription_required),
+                "quantity": item.quantity,
+                "unit_price": item.unit_price,
+            }],
+        }, aggregate_id=item.sale_id)
+    emit(db, "stock.decreased", {"product_ids": [str(item.product_id)]}, aggregate_id=item.sale_id)
 
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # The same line was recorded concurrently; its stock change stands, ours is rolled back
+        db.rollback()
+        existing = _replayed(db, SaleItem, idempotency_key)
+        if not existing:
+            raise
+        return existing
+    scan_index.invalidate(item.product_id)
     db.refresh(db_item)
     return db_item
 
+@app.post("/api/sales/checkout")
+async def checkout_sale(
+    cart: CheckoutRequest,
+    db: Session = Depends(get_db),
+    ctx: AuthContext = Depends(get_auth_context),
+    _: bool = Depends(require_permission(Permission.CREATE_SALE)),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """Create a sale with all its lines, payments, loyalty and coupon in one transaction"""
+    if idempotency_key and not cart.idempotency_key:
+        cart.idempotency_key = idempotency_key
+    result = checkout(db, cart, ctx.user_id)
+    scan_index.invalidate(*{line.product_id for line in cart.items})
+    return result
+
+@app.post("/api/sales/batch")
+async def ingest_sale_batch(
+    batch: SaleBatchRequest,
+    db: Session = Depends(get_db),
+    ctx: AuthContext = Depends(get_auth_context),
+    _: bool = Depends(require_permission(Permission.CREATE_SALE)),
+):
+    """Replay sales queued offline; each is reported as created, duplicate or rejected"""
+    carts, rejected = [], {}
+    for i, raw in enumerate(batch.sales):
+        try:
+            carts.append(CheckoutRequest.model_validate(raw))
+        except ValidationError as e:
+            carts.append(SimpleNamespace(idempotency_key=raw.get("idempotency_key")))
+            rejected[i] = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    try:
+        result = ingest_sales(db, carts, ctx.user_id, rejected)
+    except IntegrityError:
+        # Another device replayed some of the same keys meanwhile; a second pass reports them as duplicates
+        result = ingest_sales(db, carts, ctx.user_id, rejected)
+    created = [r["index"] for r in result["results"] if r["status"] == "created"]
+    scan_index.invalidate(*{line.product_id for i in created for line in carts[i].items})
+    return result
+
 """ Requisition Endpoints """
 @app.post("/api/requisitions", response_model=RequisitionResponse)
 async def create_requisition(payload: RequisitionCreate, db: Session = Depends(get_db), current_user: Profile = Depends(get_current_user)):
@@ -3430,13 +3808,18 @@ async def create_requisition(payload: RequisitionCreate, db: Session = Depends(g
     return req
 
 @app.get("/api/requisitions", response_model=List[RequisitionResponse])
-async def list_requisitions(db: Session = Depends(get_db), current_user: Profile = Depends(get_current_user)):
-    roles = get_roles_for_user(db, current_user.id)
+async def list_requisitions(
+    response: Response,
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+    current_user: Profile = Depends(get_current_user),
+):
+    roles = get_roles_for_user(db, current_user.id, current_user)
     is_admin = "admin" in roles
     q = db.query(Requisition)
     if not is_admin:
         q = q.filter(Requisition.requested_by == current_user.id)
-    return q.order_by(Requisition.created_at.desc()).all()
+    return paginate(db, q, page, response, [(Requisition.created_at, True), (Requisition.id, True)])
 
 @app.post("/api/requisitions/{req_id}/approve", response_model=RequisitionResponse, dependencies=[Depends(require_staff())])
 async def approve_requisition(req_id: str, db: Session = Depends(get_db), current_user: Profile = Depends(get_current_user)):
@@ -3477,7 +3860,7 @@ async def create_transaction(payload: TransactionCreate, db: Session = Depends(g
     return {"id": tr.id}
 
 @app.get("/api/transactions", dependencies=[Depends(require_staff())])
-async def list_transactions(db: Session = Depends(get_db), from_date: Optional[str] = None, to_date: Optional[str] = None, type: Optional[str] = None):
+async def list_transactions(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db), from_date: Optional[str] = None, to_date: Optional[str] = None, type: Optional[str] = None):
     q = db.query(Transaction)
     if from_date:
         q = q.filter(Transaction.date >= from_date)
@@ -3493,7 +3876,7 @@ async def list_transactions(db: Session = Depends(get_db), from_date: Optional[s
             "amount": t.amount,
             "reference_id": t.reference_id,
             "description": t.description
-        } for t in q.order_by(Transaction.date.desc()).all()
+        } for t in paginate(db, q, page, response, [(Transaction.date, True), (Transaction.id, True)])
     ]
 
 @app.post("/api/expenses", dependencies=[Depends(require_staff())])
@@ -3511,7 +3894,7 @@ async def create_expense(payload: ExpenseCreate, db: Session = Depends(get_db)):
     return {"id": ex.id}
 
 @app.get("/api/expenses", dependencies=[Depends(require_staff())])
-async def list_expenses(db: Session = Depends(get_db), from_date: Optional[str] = None, to_date: Optional[str] = None, category: Optional[str] = None):
+async def list_expenses(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db), from_date: Optional[str] = None, to_date: Optional[str] = None, category: Optional[str] = None):
     q = db.query(Expense)
     if from_date:
         q = q.filter(Expense.date >= from_date)
@@ -3526,7 +3909,7 @@ async def list_expenses(db: Session = Depends(get_db), from_date: Optional[str]
             "category": e.category,
             "amount": e.amount,
             "description": e.description
-        } for e in q.order_by(Expense.date.desc()).all()
+        } for e in paginate(db, q, page, response, [(Expense.date, True), (Expense.id, True)])
     ]
 
 @app.get("/api/reports/finance/trial-balance", dependencies=[Depends(require_staff())])
@@ -3594,130 +3977,46 @@ async def export_stock_csv(db: Session = Depends(get_db)):
     })
 
 @app.get("/api/reports/sales/export", dependencies=[Depends(require_staff())])
-async def export_sales_csv(db: Session = Depends(get_db)):
-    sales = db.query(Sale).order_by(Sale.created_at.desc()).all()
-    sio = StringIO()
-    sio.write("id,date,customer_name,total_amount,net_amount,payment_method,payment_status\n")
-    for s in sales:
-        sio.write(
-            f"{s.id},{s.created_at.isoformat() if s.created_at else ''},{s.customer_name},{s.total_amount},{s.net_amount},{s.payment_method},{s.payment_status}\n"
-        )
-    sio.seek(0)
-    return StreamingResponse(sio, media_type="text/csv", headers={
+async def export_sales_csv():
+    def generate():
+        # Own session: the response streams after the handler (and its get_db session) has finished
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                Sale.id, Sale.created_at, Sale.customer_name, Sale.total_amount,
+                Sale.net_amount, Sale.payment_method, Sale.payment_status,
+            ).order_by(Sale.created_at.desc()).yield_per(2000)
+            # Stream in ~2000-row blocks so the compression middleware sees sizeable chunks
+            block = ["id,date,customer_name,total_amount,net_amount,payment_method,payment_status\n"]
+            for s in rows:
+                block.append(
+                    f"{s.id},{s.created_at.isoformat() if s.created_at else ''},{s.customer_name},{s.total_amount},{s.net_amount},{s.payment_method},{s.payment_status}\n"
+                )
+                if len(block) >= 2000:
+                    yield "".join(block)
+                    block = []
+            if block:
+                yield "".join(block)
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="text/csv", headers={
         "Content-Disposition": "attachment; filename=sales_export.csv"
     })
 
 @app.get("/api/sales/{sale_id}/invoice", response_class=HTMLResponse)
 async def get_sale_invoice_html(sale_id: str, db: Session = Depends(get_db)):
-    sale = db.query(Sale).filter(Sale.id == sale_id).first()
-    if not sale:
+    html = render_sale_page(db, sale_id)
+    if html is None:
         raise HTTPException(status_code=404, detail="Sale not found")
-    items = db.query(SaleItem, Product).join(Product, SaleItem.product_id == Product.id).filter(SaleItem.sale_id == sale_id).all()
-    rows = "".join([
-        f"""<tr>
-          <td>{i+1}</td>
-          <td>{prod.sku}</td>
-          <td>{prod.name}{('<br><small style="color:#666">' + prod.generic_name + '</small>') if prod.generic_name else ''}</td>
-          <td style='text-align:center'>{it.quantity}</td>
-          <td style='text-align:right'>&#2547;{it.unit_price:.2f}</td>
-          <td style='text-align:right'>{it.discount_percentage:.1f}%</td>
-          <td style='text-align:right'>&#2547;{it.total_price:.2f}</td>
-        </tr>"""
-        for i, (it, prod) in enumerate(items)
-    ])
-    # Format date nicely
-    try:
-        sale_date = sale.created_at.strftime("%d %B %Y %I:%M %p") if sale.created_at else str(sale.created_at)
-    except Exception:
-        sale_date = str(sale.created_at)
-
-    discount_row = f"<tr><td colspan='6' style='text-align:right;padding:6px 8px;'>Discount:</td><td style='text-align:right;padding:6px 8px;'>&#2547;{sale.discount:.2f}</td></tr>" if sale.discount else ""
-    tax_row = f"<tr><td colspan='6' style='text-align:right;padding:6px 8px;'>Tax / VAT:</td><td style='text-align:right;padding:6px 8px;'>&#2547;{sale.tax:.2f}</td></tr>" if sale.tax else ""
-
-    html = f"""<!DOCTYPE html>
-<html>
-  <head>
-    <meta charset='utf-8' />
-    <title>Invoice #{sale.id[:8].upper()} - PHARMAZINE</title>
-    <style>
-      * {{ box-sizing: border-box; margin: 0; padding: 0; }}
-      body {{ font-family: Arial, sans-serif; padding: 32px; font-size: 13px; color: #222; }}
-      .header {{ text-align: center; border-bottom: 2px solid #1d4ed8; padding-bottom: 16px; margin-bottom: 20px; }}
-      .header h1 {{ font-size: 28px; color: #1d4ed8; letter-spacing: 2px; }}
-      .header p {{ color: #555; font-size: 12px; margin-top: 4px; }}
-      .invoice-meta {{ display: flex; justify-content: space-between; margin-bottom: 20px; }}
-      .meta-box {{ background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 6px; padding: 12px 16px; min-width: 200px; }}
-      .meta-box h3 {{ font-size: 11px; color: #64748b; text-transform: uppercase; letter-spacing: 1px; margin-bottom: 6px; }}
-      .meta-box p {{ font-size: 13px; font-weight: 600; }}
-      .meta-box .sub {{ font-size: 12px; color: #555; font-weight: normal; }}
-      table {{ width: 100%; border-collapse: collapse; margin-bottom: 16px; }}
-      thead tr {{ background: #1d4ed8; color: white; }}
-      thead th {{ padding: 10px 8px; text-align: left; font-size: 12px; }}
-      tbody tr:nth-child(even) {{ background: #f8fafc; }}
-      tbody td {{ padding: 9px 8px; border-bottom: 1px solid #e2e8f0; }}
-      .totals {{ float: right; width: 280px; }}
-      .totals table {{ border: 1px solid #e2e8f0; border-radius: 6px; overflow: hidden; }}
-      .totals td {{ padding: 8px 12px; }}
-      .totals tr:last-child {{ background: #1d4ed8; color: white; font-weight: bold; font-size: 15px; }}
-      .footer {{ clear: both; margin-top: 40px; text-align: center; color: #94a3b8; font-size: 11px; border-top: 1px solid #e2e8f0; padding-top: 12px; }}
-      @media print {{ body {{ padding: 16px; }} }}
-    </style>
-  </head>
-  <body>
-    <div class="header">
-      <h1>PHARMAZINE</h1>
-      <p>Your Health, Our Priority &nbsp;|&nbsp; Licensed Pharmacy Management System</p>
-    </div>
-
-    <div class="invoice-meta">
-      <div class="meta-box">
-        <h3>Bill To</h3>
-        <p>{sale.customer_name or 'Walk-in Customer'}</p>
-        {f'<p class="sub">{sale.customer_phone}</p>' if sale.customer_phone else ''}
-      </div>
-      <div class="meta-box" style="text-align:right">
-        <h3>Invoice Details</h3>
-        <p>#{sale.id[:8].upper()}</p>
-        <p class="sub">{sale_date}</p>
-        <p class="sub">Payment: {(sale.payment_method or 'cash').title()}</p>
-      </div>
-    </div>
-
-    <table>
-      <thead>
-        <tr>
-          <th>#</th>
-          <th>SKU</th>
-          <th>Medicine / Product</th>
-          <th style='text-align:center'>Qty</th>
-          <th style='text-align:right'>Unit Price</th>
-          <th style='text-align:right'>Disc%</th>
-          <th style='text-align:right'>Amount</th>
-        </tr>
-      </thead>
-      <tbody>
-        {rows if rows else '<tr><td colspan="7" style="text-align:center;padding:20px;color:#999">No items found</td></tr>'}
-      </tbody>
-    </table>
-
-    <div class="totals">
-      <table>
-        <tr><td>Subtotal:</td><td style='text-align:right'>&#2547;{sale.total_amount:.2f}</td></tr>
-        {discount_row}
-        {tax_row}
-        <tr><td>NET TOTAL:</td><td style='text-align:right'>&#2547;{sale.net_amount:.2f}</td></tr>
-      </table>
-    </div>
-
-    <div class="footer">
-      Thank you for choosing Pharmazine &bull; Powered by Pharmazine PMS
-    </div>
-
-    <script>window.onload = function() {{ window.print(); }};</script>
-  </body>
-</html>"""
     return HTMLResponse(content=html)
 
+@app.post("/api/invoices/render-batch", response_class=HTMLResponse,
+          dependencies=[Depends(require_permission(Permission.VIEW_SALES))])
+async def render_invoice_batch(payload: InvoiceBatchRequest):
+    """Print many invoices as one HTML document (one page per sale, in request order)."""
+    return StreamingResponse(render_batch(SessionLocal, payload.sale_ids), media_type="text/html; charset=utf-8")
+
 """ CSV Import/Template Endpoints """
 TEMPLATE_HEADERS = {
     "products": [
@@ -3861,22 +4160,23 @@ async def import_opening_stock(file: UploadFile = File(...), db: Session = Depen
 
 """ Audit Logging """
 def write_audit_log(db: Session, user_id: Optional[str], action: str, table_name: str, record_id: str, old_value: Optional[dict] = None, new_value: Optional[dict] = None):
+    # Queued in the caller's transaction; the outbox dispatcher writes the audit_logs row after commit.
+    # Flush first, outside the try: a failure in the caller's own changes must reach the caller as is
+    db.flush()
     try:
-        log = AuditLog(
-            id=str(uuid.uuid4()),
-            user_id=user_id,
-            action=action,
-            table_name=table_name,
-            record_id=record_id,
-            old_value=(str(old_value) if old_value is not None else None),
-            new_value=(str(new_value) if new_value is not None else None),
-        )
-        db.add(log)
-        db.commit()
-    except Exception:
-        db.rollback()
+        with db.begin_nested():
+            emit(db, "audit.logged", {
+                "user_id": user_id,
+                "action": action,
+                "table_name": table_name,
+                "record_id": record_id,
+                "old_value": old_value,
+                "new_value": new_value,
+                "at": datetime.utcnow().isoformat(),
+            }, aggregate_id=record_id)
+    except Exception as e:
         # Don't block the request if audit logging fails
-        pass
+        print(f"[WARNING] Failed to queue audit log: {e}")
 
 @app.get("/api/audit-logs", dependencies=[Depends(require_admin())])
 async def list_audit_logs(db: Session = Depends(get_db), limit: int = 100):
@@ -3907,7 +4207,7 @@ async def record_sale_payment(
 
     method = (payment.method or "").lower()
     requested_status = (payment.status or "").lower() if payment.status else None
-    roles = get_roles_for_user(db, current_user.id)
+    roles = get_roles_for_user(db, current_user.id, current_user)
     is_admin = "admin" in roles
 
     if method in ["card", "online", "bank"] and not is_admin:
@@ -3953,11 +4253,17 @@ async def clear_payment(payment_id: str, db: Session = Depends(get_db)):
 
 # Purchases + GRN
 @app.get("/api/purchases", response_model=List[PurchaseResponse], dependencies=[Depends(require_permission(Permission.VIEW_PURCHASES))])
-async def get_purchases(db: Session = Depends(get_db)):
-    purchases = db.query(Purchase).order_by(Purchase.created_at.desc()).all()
+async def get_purchases(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    purchases = paginate(db, db.query(Purchase), page, response, [(Purchase.created_at, True), (Purchase.id, True)])
+    # One query for the whole page's items instead of one per purchase
+    items_by_purchase: dict = {}
+    if purchases:
+        page_items = db.query(PurchaseItem).filter(PurchaseItem.purchase_id.in_([p.id for p in purchases])).all()
+        for it in page_items:
+            items_by_purchase.setdefault(it.purchase_id, []).append(it)
     result = []
     for purchase in purchases:
-        items = db.query(PurchaseItem).filter(PurchaseItem.purchase_id == purchase.id).all()
+        items = items_by_purchase.get(purchase.id, [])
         purchase_dict = {
             "id": purchase.id,
             "supplier_id": purchase.supplier_id,
@@ -4018,8 +4324,8 @@ async def get_purchase(purchase_id: str, db: Session = Depends(get_db)):
     return PurchaseResponse(**purchase_dict)
 
 @app.get("/api/grns", response_model=List[GRNResponse])
-async def get_grns(db: Session = Depends(get_db)):
-    return db.query(GRN).order_by(GRN.date.desc()).all()
+async def get_grns(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    return paginate(db, db.query(GRN), page, response, [(GRN.date, True), (GRN.id, True)])
 
 @app.get("/api/grns/{grn_id}", response_model=GRNResponse)
 async def get_grn(grn_id: str, db: Session = Depends(get_db)):
@@ -4200,21 +4506,40 @@ async def confirm_grn(payload: GRNCreate, db: Session = Depends(get_db)):
     if not items:
         raise HTTPException(status_code=400, detail="No items to receive for this purchase")
     try:
+        received: dict = {}
         for it in items:
-            product = db.query(Product).filter(Product.id == it.product_id).first()
-            if not product:
-                continue
-            product.stock_quantity = (product.stock_quantity or 0) + int(it.qty)
-            # update product_stock row if exists
-            ps = db.query(ProductStock).filter(ProductStock.product_id == it.product_id).first()
-            if ps:
-                ps.current_qty = (ps.current_qty or 0) + float(it.qty)
+            received[str(it.product_id)] = received.get(str(it.product_id), 0) + float(it.qty)
+        # One in-database increment for every product (missing products are skipped)
+        apply_stock_changes(db, {pid: int(qty) for pid, qty in received.items()}, require_all=False)
+        # ...and the first product_stock row of each, if any
+        db.execute(text("""
+            UPDATE product_stock SET current_qty = COALESCE(current_qty, 0) + :qty
+            WHERE id = (SELECT id FROM product_stock WHERE product_id = :pid ORDER BY created_at, id LIMIT 1)
+        """), [{"pid": pid, "qty": qty} for pid, qty in received.items()])
+        write_audit_log(db, None, "receive", "grn", grn.id, None,
+                        {"purchase_id": purchase.id, "items": len(items), "created_by": payload.created_by})
         db.commit()
     except Exception:
         db.rollback()
         raise
+    scan_index.invalidate(*[it.product_id for it in items])
     return {"grn_id": grn.id, "received_items": len(items)}
 
+@app.on_event("startup")
+async def start_event_loop_monitoring():
+    configure_threadpool()
+    lag_monitor.start()
+
+@app.on_event("startup")
+async def start_scan_index():
+    # Built off the request path; scans before the first build fall back to per-code queries
+    scan_index.start(SessionLocal)
+
+@app.on_event("startup")
+async def start_outbox_dispatcher():
+    # Drains side effects queued by sales, GRNs and audited edits
+    outbox_dispatcher.start(SessionLocal)
+
 # Create database tables
 @app.on_event("startup")
 async def startup_event():
@@ -4361,20 +4686,20 @@ async def create_elc_issue_details(detail: ElcIssueDetailsCreate, db: Session =
     return db_detail
 
 @app.get("/api/elc-receive-master", response_model=List[ElcReceiveMasterResponse])
-async def get_elc_receive_master(db: Session = Depends(get_db)):
-    return db.query(ElcReceiveMaster).all()
+async def get_elc_receive_master(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    return paginate(db, db.query(ElcReceiveMaster), page, response, [(ElcReceiveMaster.receive_pk_no, True)])
 
 @app.get("/api/elc-receive-details", response_model=List[ElcReceiveDetailsResponse])
-async def get_elc_receive_details(db: Session = Depends(get_db)):
-    return db.query(ElcReceiveDetails).all()
+async def get_elc_receive_details(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    return paginate(db, db.query(ElcReceiveDetails), page, response, [(ElcReceiveDetails.receivedtl_pk_no, True)])
 
 @app.get("/api/elc-issue-master", response_model=List[ElcIssueMasterResponse])
-async def get_elc_issue_master(db: Session = Depends(get_db)):
-    return db.query(ElcIssueMaster).all()
+async def get_elc_issue_master(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    return paginate(db, db.query(ElcIssueMaster), page, response, [(ElcIssueMaster.issue_pk_no, True)])
 
 @app.get("/api/elc-issue-details", response_model=List[ElcIssueDetailsResponse])
-async def get_elc_issue_details(db: Session = Depends(get_db)):
-    return db.query(ElcIssueDetails).all()
+async def get_elc_issue_details(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
+    return paginate(db, db.query(ElcIssueDetails), page, response, [(ElcIssueDetails.issuedtl_pk_no, True)])
 
 # Comprehensive Stock Management Endpoint
 @app.post("/api/stock-management/opening-stock")
@@ -4692,10 +5017,9 @@ async def get_hourly_sales_today(db: Session = Depends(get_db)):
 
 @app.get("/api/sales/{sale_id}", dependencies=[Depends(require_permission(Permission.VIEW_SALES))])
 async def get_sale_by_id(sale_id: str, db: Session = Depends(get_db)):
-    """Get a single sale by ID (full or partial UUID prefix)."""
-    sale = db.query(Sale).filter(
-        (Sale.id == sale_id) | Sale.id.like(f"{sale_id}%")
-    ).first()
+    """Get a single sale by ID, or by the receipt's short code / any ID prefix."""
+    found_id = find_id(db, "sales", sale_id)
+    sale = db.query(Sale).filter(Sale.id == found_id).first() if found_id else None
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
     return {
@@ -4798,58 +5122,43 @@ async def create_sale_payment(req: SalePaymentRequest, db: Session = Depends(get
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class SaleReturnLine(BaseModel):
+    sale_item_id: str
+    quantity: int = Field(..., gt=0)
+    restockable: bool = True  # False for damaged/opened stock: refunded, not put back on the shelf
+
+
 class SaleReturnRequest(BaseModel):
     original_sale_id: str
     return_reason: str
-    total_refund: float
+    return_type: str = "customer_request"
+    lines: List[SaleReturnLine] = Field(default_factory=list)  # empty: return everything not yet returned
+    total_refund: Optional[float] = None  # ignored; the refund is computed from the returned lines
     refund_method: str = "cash"
     status: str = "completed"
 
 
-@app.post("/api/sale-returns", dependencies=[Depends(require_permission(Permission.CREATE_SALE))])
-async def create_sale_return(req: SaleReturnRequest, db: Session = Depends(get_db)):
-    """Process a sales return with stock reversal (C5)."""
-    sale = db.query(Sale).filter(Sale.id == req.original_sale_id).first()
-    if not sale:
-        raise HTTPException(status_code=404, detail="Original sale not found")
-
-    return_id = str(uuid.uuid4())
+@app.post("/api/sale-returns")
+async def create_sale_return(
+    req: SaleReturnRequest,
+    db: Session = Depends(get_db),
+    ctx: AuthContext = Depends(get_auth_context),
+    _: bool = Depends(require_permission(Permission.CREATE_SALE)),
+):
+    """Process a whole or partial sales return with stock reversal (C5)."""
     try:
-        db.execute(text("""
-            INSERT INTO sale_returns (id, original_sale_id, return_reason, total_refund, refund_method, status)
-            VALUES (:rid, :sid, :reason, :refund, :method, :status)
-        """), {
-            "rid": return_id,
-            "sid": req.original_sale_id,
-            "reason": req.return_reason,
-            "refund": req.total_refund,
-            "method": req.refund_method,
-            "status": req.status,
-        })
-
-        # Reverse stock for each sold item
-        items = db.execute(text(
-            "SELECT product_id, quantity, batch_no FROM sale_items WHERE sale_id = :sid"
-        ), {"sid": req.original_sale_id}).fetchall()
-
-        for item in items:
-            if item[0]:  # product_id exists
-                db.execute(text("""
-                    UPDATE products SET stock_quantity = stock_quantity + :qty
-                    WHERE id = :pid
-                """), {"qty": item[1], "pid": item[0]})
-
-                db.execute(text("""
-                    INSERT INTO stock_transactions
-                    (id, product_id, transaction_type, quantity, reference_number, notes, created_at)
-                    VALUES (gen_random_uuid(), :pid, 'sales_return', :qty, :ref, 'Sale return', now())
-                """), {"pid": item[0], "qty": item[1], "ref": f"RETURN-{return_id[:8]}"})
-
+        result = process_return(db, req, ctx.user_id)
+        write_audit_log(db, ctx.user_id, "return", "sales", result["original_sale_id"],
+                        new_value={"return_id": result["id"], "total_refund": result["total_refund"]})
         db.commit()
-        return {"id": return_id, "status": "completed", "total_refund": req.total_refund}
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    scan_index.invalidate(*result["restocked_products"])
+    return result
 
 
 # ─── Phase E: Procurement Module Endpoints ────────────────────────────────────
@@ -4968,15 +5277,15 @@ async def get_price_history(product_id: Optional[str] = None, limit: int = 100,
 async def get_three_way_match(purchase_id: str, db: Session = Depends(get_db)):
     """Return 3-way match data: PO vs GRN vs invoice for a purchase."""
     try:
-        # Get purchase header
+        # Get purchase header (full id, short code or id prefix)
+        found_id = find_id(db, "purchases", purchase_id)
         po = db.execute(text("""
             SELECT p.id, p.invoice_no, p.total_amount, p.date, p.po_status,
                    s.name AS supplier_name
             FROM purchases p
             LEFT JOIN suppliers s ON s.id = p.supplier_id
-            WHERE p.id = :pid OR p.id::text LIKE :prefix
-            LIMIT 1
-        """), {"pid": purchase_id, "prefix": f"{purchase_id}%"}).fetchone()
+            WHERE p.id = :pid
+        """), {"pid": found_id}).fetchone() if found_id else None
         if not po:
             raise HTTPException(status_code=404, detail="Purchase not found")
 
@@ -5031,16 +5340,15 @@ async def get_three_way_match(purchase_id: str, db: Session = Depends(get_db)):
 # ─── Phase F: Patient CRM Endpoints ───────────────────────────────────────────
 
 @app.get("/api/patients/crm")
-async def get_patients_crm(db: Session = Depends(get_db)):
+async def get_patients_crm(response: Response, page: PageParams = Depends(page_params), db: Session = Depends(get_db)):
     """Return patients/customers with CRM fields (allergies, insurance, consent)."""
     try:
-        rows = db.execute(text("""
+        rows = paginate_sql(db, """
             SELECT id, name, phone, email,
                    allergies, insurance_provider, insurance_id,
                    hipaa_consent_date, loyalty_points
             FROM customers
-            ORDER BY name
-        """)).fetchall()
+        """, None, page, response, [("name", False), ("id", False)])
         return [
             {
                 "id": str(r[0]),
@@ -4,6 +4,7 @@ Employee-to-employee communication
 """
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from offload import OffloadRoute
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from typing import List, Optional
@@ -11,7 +12,7 @@ from datetime import datetime
 import uuid
 from pydantic import BaseModel
 
-router = APIRouter(prefix="/api/messages", tags=["Internal Messages"])
+router = APIRouter(prefix="/api/messages", tags=["Internal Messages"], route_class=OffloadRoute)
 
 # Database dependency
 def get_db():
@@ -0,0 +1,24 @@
+-- Product Search Indexes
+-- Full-text, trigram and code indexes behind /api/products/search
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Prefix-matched full-text search over name, generic and brand name.
+-- 'simple' config: drug names should not be stemmed. The expression must match
+-- _TSV_EXPR in backend/product_search.py.
+CREATE INDEX IF NOT EXISTS idx_products_search_tsv ON products USING gin (
+    to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(generic_name, '') || ' ' || coalesce(brand_name, ''))
+);
+
+-- Fuzzy (typo-tolerant) matching
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING gin (lower(name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_products_generic_trgm ON products USING gin (lower(generic_name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_products_brand_trgm ON products USING gin (lower(brand_name) gin_trgm_ops);
+
+-- SKU prefix and exact barcode lookups
+CREATE INDEX IF NOT EXISTS idx_products_sku_prefix ON products (lower(sku) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_products_barcode ON products (barcode);
+
+-- Sellable batches per product (stock and best price for search results)
+CREATE INDEX IF NOT EXISTS idx_batches_sellable ON medicine_batches (product_id, expiry_date)
+    WHERE is_active AND quantity_remaining > 0;
@@ -0,0 +1,74 @@
+-- Delta Sync Change Log
+-- Row-level change capture for /api/sync/changes (products, batches, discount configs, customers)
+
+-- One row per INSERT/UPDATE/DELETE, carrying the row as it is after the change.
+-- txid orders changes by transaction; the sync token is the oldest in-flight
+-- transaction id, so a token never skips a change that commits later.
+CREATE TABLE IF NOT EXISTS change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    entity TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    op TEXT NOT NULL, -- 'upsert', 'delete'
+    payload JSONB,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_txid ON change_log(txid, seq);
+CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log(changed_at);
+
+-- Tokens older than pruned_before can no longer be served incrementally
+CREATE TABLE IF NOT EXISTS sync_state (
+    id INTEGER PRIMARY KEY,
+    pruned_before BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO sync_state (id, pruned_before) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+-- Function: record a change; TG_ARGV[0] is the entity name exposed by the feed
+CREATE OR REPLACE FUNCTION log_entity_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (entity, entity_id, op, payload)
+        VALUES (TG_ARGV[0], OLD.id::text, 'delete', NULL);
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NEW;
+    END IF;
+    INSERT INTO change_log (entity, entity_id, op, payload)
+    VALUES (TG_ARGV[0], NEW.id::text, 'upsert', to_jsonb(NEW));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers are created only when missing: DROP/CREATE TRIGGER locks the table
+-- against writes, and this file runs on every process start while tills are
+-- selling. To change a trigger's definition, give it a new name.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_change_log_products' AND tgrelid = 'products'::regclass) THEN
+        CREATE TRIGGER trigger_change_log_products
+            AFTER INSERT OR UPDATE OR DELETE ON products
+            FOR EACH ROW
+            EXECUTE FUNCTION log_entity_change('products');
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_change_log_batches' AND tgrelid = 'medicine_batches'::regclass) THEN
+        CREATE TRIGGER trigger_change_log_batches
+            AFTER INSERT OR UPDATE OR DELETE ON medicine_batches
+            FOR EACH ROW
+            EXECUTE FUNCTION log_entity_change('batches');
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_change_log_discount_configs' AND tgrelid = 'discount_configs'::regclass) THEN
+        CREATE TRIGGER trigger_change_log_discount_configs
+            AFTER INSERT OR UPDATE OR DELETE ON discount_configs
+            FOR EACH ROW
+            EXECUTE FUNCTION log_entity_change('discount_configs');
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_change_log_customers' AND tgrelid = 'customers'::regclass) THEN
+        CREATE TRIGGER trigger_change_log_customers
+            AFTER INSERT OR UPDATE OR DELETE ON customers
+            FOR EACH ROW
+            EXECUTE FUNCTION log_entity_change('customers');
+    END IF;
+END $$;
@@ -0,0 +1,23 @@
+-- Transactional Outbox
+-- Side effects (medication history, audit, notifications, reorder triggers) queued
+-- in the same transaction as the business change and run by the outbox dispatcher
+
+-- Timestamps are naive UTC, written and compared by the application
+CREATE TABLE IF NOT EXISTS domain_events (
+    id BIGSERIAL PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    aggregate_id TEXT,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'done', 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    processed_at TIMESTAMP
+);
+
+-- The dispatcher's claim query: oldest due pending events
+CREATE INDEX IF NOT EXISTS idx_domain_events_pending ON domain_events (available_at, id)
+    WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_domain_events_processed ON domain_events (processed_at)
+    WHERE status = 'done';
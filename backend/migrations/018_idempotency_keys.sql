@@ -0,0 +1,9 @@
+-- Idempotency Keys
+-- Client-generated keys that make sale replays (offline queue, retried requests) safe.
+-- Must match IDEMPOTENCY_DDL in backend/sale_ingest.py
+
+ALTER TABLE sales ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sales_idempotency_key ON sales (idempotency_key);
+
+ALTER TABLE sales_items ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sales_items_idempotency_key ON sales_items (idempotency_key);
@@ -0,0 +1,94 @@
+-- Document Counters
+-- O(1), collision-free numbering for chalans, invoices, vouchers and purchase orders.
+-- One row per (prefix, period); numbers are taken with UPDATE ... RETURNING inside the
+-- document's own transaction (see backend/document_numbers.py).
+
+CREATE TABLE IF NOT EXISTS document_counters (
+    prefix TEXT NOT NULL,
+    period TEXT NOT NULL DEFAULT '',
+    last_value BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (prefix, period)
+);
+
+-- Next number in a series. p_seed (the highest number already issued) is only used
+-- when the series row does not exist yet.
+CREATE OR REPLACE FUNCTION next_document_number(p_prefix TEXT, p_period TEXT, p_seed BIGINT DEFAULT 0)
+RETURNS BIGINT AS $$
+DECLARE
+    v_value BIGINT;
+BEGIN
+    UPDATE document_counters
+    SET last_value = last_value + 1, updated_at = now()
+    WHERE prefix = p_prefix AND period = p_period
+    RETURNING last_value INTO v_value;
+
+    IF v_value IS NULL THEN
+        INSERT INTO document_counters (prefix, period, last_value)
+        VALUES (p_prefix, p_period, COALESCE(p_seed, 0) + 1)
+        ON CONFLICT (prefix, period) DO UPDATE
+        SET last_value = document_counters.last_value + 1, updated_at = now()
+        RETURNING last_value INTO v_value;
+    END IF;
+
+    RETURN v_value;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function: Generate Invoice Number (INV + YYMM + 5 digits)
+CREATE OR REPLACE FUNCTION generate_invoice_number()
+RETURNS TEXT AS $$
+DECLARE
+    v_period TEXT := TO_CHAR(CURRENT_DATE, 'YYMM');
+    v_seed BIGINT := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM document_counters WHERE prefix = 'INV' AND period = v_period) THEN
+        SELECT COALESCE(MAX(CAST(SUBSTRING(invoice_number FROM 'INV' || v_period || '(\d+)') AS INTEGER)), 0)
+        INTO v_seed
+        FROM sales
+        WHERE invoice_number LIKE 'INV' || v_period || '%';
+    END IF;
+    RETURN 'INV' || v_period || LPAD(next_document_number('INV', v_period, v_seed)::TEXT, 5, '0');
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function: Generate Purchase Order Number (PO + YYMM + 4 digits)
+CREATE OR REPLACE FUNCTION generate_purchase_order_number()
+RETURNS TEXT AS $$
+DECLARE
+    v_period TEXT := TO_CHAR(CURRENT_DATE, 'YYMM');
+    v_seed BIGINT := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM document_counters WHERE prefix = 'PO' AND period = v_period) THEN
+        SELECT COALESCE(MAX(CAST(SUBSTRING(purchase_order_number FROM 'PO' || v_period || '(\d+)') AS INTEGER)), 0)
+        INTO v_seed
+        FROM purchases
+        WHERE purchase_order_number LIKE 'PO' || v_period || '%';
+    END IF;
+    RETURN 'PO' || v_period || LPAD(next_document_number('PO', v_period, v_seed)::TEXT, 4, '0');
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function: Generate Voucher Number (type prefix + YY + 5 digits)
+-- Previously always returned sequence 1; now a real per-type, per-year series.
+-- The series is seeded at 1 so its first number never repeats the old fixed 00001.
+CREATE OR REPLACE FUNCTION generate_voucher_number(p_voucher_type TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    v_prefix TEXT;
+    v_year TEXT := TO_CHAR(CURRENT_DATE, 'YY');
+BEGIN
+    v_prefix := CASE p_voucher_type
+        WHEN 'cash_payment' THEN 'CP'
+        WHEN 'cash_receipt' THEN 'CR'
+        WHEN 'bank_payment' THEN 'BP'
+        WHEN 'bank_receipt' THEN 'BR'
+        WHEN 'journal' THEN 'JV'
+        WHEN 'contra' THEN 'CV'
+        WHEN 'credit_note' THEN 'CN'
+        WHEN 'debit_note' THEN 'DN'
+        ELSE 'VN'
+    END;
+    RETURN v_prefix || v_year || LPAD(next_document_number('acct:' || v_prefix, v_year, 1)::TEXT, 5, '0');
+END;
+$$ LANGUAGE plpgsql;
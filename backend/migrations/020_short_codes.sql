@@ -0,0 +1,67 @@
+-- Short Codes
+-- Indexed short codes for looking up sales (receipts) and purchases by a partial id.
+-- The code is the id's first 8 characters upper-cased, which is what receipts print
+-- ("Invoice #1A2B3C4D"). It is unique per month: on the rare clash it takes more of
+-- the (dash-free) id. Prefix searches become index range scans on short_code
+-- (text_pattern_ops) instead of sequential scans over CAST(id AS TEXT) LIKE.
+
+CREATE OR REPLACE FUNCTION assign_short_code() RETURNS trigger AS $$
+DECLARE
+    v_id TEXT := upper(replace(NEW.id::text, '-', ''));
+    v_len INT := 8;
+    v_taken BOOLEAN;
+BEGIN
+    NEW.short_code_period := to_char(COALESCE(NEW.created_at, now()), 'YYYYMM');
+    LOOP
+        NEW.short_code := left(v_id, v_len);
+        EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE short_code_period = $1 AND short_code = $2)', TG_TABLE_NAME)
+            INTO v_taken USING NEW.short_code_period, NEW.short_code;
+        EXIT WHEN NOT v_taken OR v_len >= length(v_id);
+        v_len := v_len + 4;
+    END LOOP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Adds and backfills the columns the first time only, so re-running this file is cheap
+CREATE OR REPLACE FUNCTION add_short_codes(p_table TEXT) RETURNS void AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = p_table AND column_name = 'short_code') THEN
+        RETURN;
+    END IF;
+    EXECUTE format('ALTER TABLE %I ADD COLUMN short_code TEXT, ADD COLUMN short_code_period TEXT', p_table);
+    EXECUTE format($f$UPDATE %I SET short_code = upper(left(id::text, 8)),
+                                   short_code_period = to_char(COALESCE(created_at, now()), 'YYYYMM')$f$, p_table);
+    -- Same-month clashes among existing rows: every row after the first takes 12 characters
+    EXECUTE format($f$UPDATE %1$I t SET short_code = upper(left(replace(t.id::text, '-', ''), 12))
+                     FROM (SELECT id, row_number() OVER (PARTITION BY short_code_period, short_code
+                                                         ORDER BY created_at, id) AS rn
+                           FROM %1$I) d
+                     WHERE d.id = t.id AND d.rn > 1$f$, p_table);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers are created only when missing: DROP/CREATE TRIGGER locks the table
+-- against writes, and this file runs on every process start.
+SELECT add_short_codes('sales');
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sales_short_code ON sales (short_code_period, short_code);
+CREATE INDEX IF NOT EXISTS idx_sales_short_code_prefix ON sales (short_code text_pattern_ops);
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_sales_short_code' AND tgrelid = 'sales'::regclass) THEN
+        CREATE TRIGGER trg_sales_short_code BEFORE INSERT ON sales
+            FOR EACH ROW EXECUTE FUNCTION assign_short_code();
+    END IF;
+END $$;
+
+SELECT add_short_codes('purchases');
+CREATE UNIQUE INDEX IF NOT EXISTS ux_purchases_short_code ON purchases (short_code_period, short_code);
+CREATE INDEX IF NOT EXISTS idx_purchases_short_code_prefix ON purchases (short_code text_pattern_ops);
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_purchases_short_code' AND tgrelid = 'purchases'::regclass) THEN
+        CREATE TRIGGER trg_purchases_short_code BEFORE INSERT ON purchases
+            FOR EACH ROW EXECUTE FUNCTION assign_short_code();
+    END IF;
+END $$;
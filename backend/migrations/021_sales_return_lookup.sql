@@ -0,0 +1,5 @@
+-- Sales Return Lookup
+-- How much of each sale line has already been returned is summed on every return
+-- (sale_returns.py); index the lookup from a sale line to its return lines.
+
+CREATE INDEX IF NOT EXISTS idx_sales_return_items_original ON sales_return_items (original_sale_item_id);
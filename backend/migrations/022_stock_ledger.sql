@@ -0,0 +1,118 @@
+-- Stock Ledger
+-- Running-balance stock history for point-in-time stock and movement-range queries
+
+-- One row per change to a stock quantity, carrying the signed change and the
+-- balance after it, per level:
+--   product  products.stock_quantity        (product_id)
+--   batch    medicine_batches.quantity_remaining  (product_id, batch_id, store_id)
+--   store    product_stock.current_qty      (product_id, store_id)
+-- Rows are written by triggers, so every code path that moves stock is covered.
+-- Ids are stored as text: the ledger must never fail the stock update it records.
+CREATE TABLE IF NOT EXISTS stock_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    level TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    batch_id TEXT,
+    store_id TEXT,
+    quantity NUMERIC NOT NULL,
+    balance NUMERIC NOT NULL,
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    occurred_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_product ON stock_ledger(product_id, level, occurred_at, id);
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_occurred ON stock_ledger(occurred_at, id);
+
+-- Every balance at snapshot_at (non-zero only): the state before any ledger row
+-- at or after snapshot_at. A point-in-time query starts from the latest snapshot
+-- and replays at most one snapshot interval of ledger rows.
+CREATE TABLE IF NOT EXISTS stock_ledger_snapshots (
+    snapshot_at TIMESTAMPTZ NOT NULL,
+    level TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    batch_id TEXT,
+    store_id TEXT,
+    balance NUMERIC NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_snapshots_at ON stock_ledger_snapshots(snapshot_at, level, product_id);
+
+-- Function: record a quantity change; TG_ARGV[0] is the ledger level
+CREATE OR REPLACE FUNCTION stock_ledger_capture()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_old NUMERIC := 0;
+    v_new NUMERIC := 0;
+    v_product TEXT;
+    v_batch TEXT;
+    v_store TEXT;
+BEGIN
+    IF TG_ARGV[0] = 'product' THEN
+        IF TG_OP <> 'INSERT' THEN v_old := COALESCE(OLD.stock_quantity, 0); v_product := OLD.id::text; END IF;
+        IF TG_OP <> 'DELETE' THEN v_new := COALESCE(NEW.stock_quantity, 0); v_product := NEW.id::text; END IF;
+    ELSIF TG_ARGV[0] = 'batch' THEN
+        IF TG_OP <> 'INSERT' THEN
+            v_old := COALESCE(OLD.quantity_remaining, 0);
+            v_product := OLD.product_id::text; v_batch := OLD.id::text; v_store := OLD.store_id::text;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            v_new := COALESCE(NEW.quantity_remaining, 0);
+            v_product := NEW.product_id::text; v_batch := NEW.id::text; v_store := NEW.store_id::text;
+        END IF;
+    ELSE
+        IF TG_OP <> 'INSERT' THEN
+            v_old := COALESCE(OLD.current_qty, 0); v_product := OLD.product_id::text; v_store := OLD.store_id::text;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            v_new := COALESCE(NEW.current_qty, 0); v_product := NEW.product_id::text; v_store := NEW.store_id::text;
+        END IF;
+    END IF;
+
+    IF v_new <> v_old THEN
+        INSERT INTO stock_ledger (level, product_id, batch_id, store_id, quantity, balance)
+        VALUES (TG_ARGV[0], v_product, v_batch, v_store, v_new - v_old, v_new);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Opening snapshot: current balances, taken once when the ledger is created
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM stock_ledger_snapshots) THEN
+        INSERT INTO stock_ledger_snapshots (snapshot_at, level, product_id, batch_id, store_id, balance)
+        SELECT now(), 'product', id::text, NULL, NULL, stock_quantity
+        FROM products WHERE COALESCE(stock_quantity, 0) <> 0
+        UNION ALL
+        SELECT now(), 'batch', product_id::text, id::text, store_id::text, quantity_remaining
+        FROM medicine_batches WHERE COALESCE(quantity_remaining, 0) <> 0
+        UNION ALL
+        SELECT now(), 'store', product_id::text, NULL, store_id::text, current_qty
+        FROM product_stock WHERE COALESCE(current_qty, 0) <> 0;
+    END IF;
+END $$;
+
+-- Triggers are created only when missing: DROP/CREATE TRIGGER locks the table
+-- against writes, and this file runs on every process start while tills are
+-- selling. To change a trigger's definition, give it a new name.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_stock_ledger_products' AND tgrelid = 'products'::regclass) THEN
+        CREATE TRIGGER trigger_stock_ledger_products
+            AFTER INSERT OR DELETE OR UPDATE OF stock_quantity ON products
+            FOR EACH ROW
+            EXECUTE FUNCTION stock_ledger_capture('product');
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_stock_ledger_batches' AND tgrelid = 'medicine_batches'::regclass) THEN
+        CREATE TRIGGER trigger_stock_ledger_batches
+            AFTER INSERT OR DELETE OR UPDATE OF quantity_remaining ON medicine_batches
+            FOR EACH ROW
+            EXECUTE FUNCTION stock_ledger_capture('batch');
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trigger_stock_ledger_product_stock' AND tgrelid = 'product_stock'::regclass) THEN
+        CREATE TRIGGER trigger_stock_ledger_product_stock
+            AFTER INSERT OR DELETE OR UPDATE OF current_qty ON product_stock
+            FOR EACH ROW
+            EXECUTE FUNCTION stock_ledger_capture('store');
+    END IF;
+END $$;
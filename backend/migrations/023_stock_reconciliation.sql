@@ -0,0 +1,14 @@
+-- Stock Reconciliation
+-- Watermark and last report for the stock reconciliation job (stock_reconcile.py)
+
+-- Incremental runs read the products touched since the watermark from the stock ledger
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_txid ON stock_ledger(txid);
+
+-- watermark: transaction id below which every stock change has been reconciled
+CREATE TABLE IF NOT EXISTS stock_reconciliation_state (
+    id INTEGER PRIMARY KEY,
+    watermark BIGINT,
+    last_run_at TIMESTAMPTZ,
+    last_report JSONB
+);
+INSERT INTO stock_reconciliation_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
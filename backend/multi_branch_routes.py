@@ -3,6 +3,8 @@ Multi-Branch Management Routes
 Handles branch operations for multi-location pharmacy management
 """
 from fastapi import APIRouter, HTTPException, Depends, status
+from offload import OffloadRoute
+from db_pool import shared_engine
 from sqlalchemy.orm import Session
 from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, func
 from sqlalchemy.ext.declarative import declarative_base
@@ -11,7 +13,7 @@ from typing import List, Optional
 from datetime import datetime
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 
 load_dotenv()
@@ -21,7 +23,8 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL environment variable is not set")
 
-engine = create_engine(DATABASE_URL)
+# Same pool as main.py; one pool per process keeps the connection count bounded
+engine = shared_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -33,7 +36,7 @@ def get_db():
     finally:
         db.close()
 
-router = APIRouter(prefix="/api/branches", tags=["Multi-Branch Management"])
+router = APIRouter(prefix="/api/branches", tags=["Multi-Branch Management"], route_class=OffloadRoute)
 
 # ==================== MODELS ====================
 
@@ -4,13 +4,14 @@ Manage and track system notifications
 """
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from offload import OffloadRoute
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_, text
 from typing import List, Optional
 from datetime import datetime
 import uuid
 
-router = APIRouter(prefix="/api/notifications", tags=["Notifications"])
+router = APIRouter(prefix="/api/notifications", tags=["Notifications"], route_class=OffloadRoute)
 
 # Database dependency
 def get_db():
@@ -0,0 +1,112 @@
+"""
+Blocking I/O Offloading
+Run blocking `async def` route handlers in the threadpool and measure event loop lag
+"""
+
+import asyncio
+import dis
+import inspect
+import os
+from collections import deque
+from functools import wraps
+from typing import Callable, Dict
+
+from fastapi.routing import APIRoute
+
+# Handlers that never await can only block the loop; run them like plain `def` routes
+OFFLOAD_BLOCKING_ROUTES = os.getenv("OFFLOAD_BLOCKING_ROUTES", "true").strip().lower() not in ("0", "false", "no")
+THREADPOOL_WORKERS = int(os.getenv("THREADPOOL_WORKERS", "40"))
+EVENT_LOOP_LAG_INTERVAL_MS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_MS", "100"))
+
+_SUSPEND_OPCODES = {
+    "GET_AWAITABLE", "GET_AITER", "GET_ANEXT", "BEFORE_ASYNC_WITH",
+    "END_ASYNC_FOR", "SEND", "YIELD_VALUE", "YIELD_FROM",
+}
+
+
+def never_awaits(func: Callable) -> bool:
+    """True for a coroutine function whose body contains no await/async for/async with"""
+    if not inspect.iscoroutinefunction(func):
+        return False
+    code = getattr(func, "__code__", None)
+    if code is None:
+        return False
+    return not any(ins.opname in _SUSPEND_OPCODES for ins in dis.get_instructions(code))
+
+
+def run_coroutine_sync(func: Callable) -> Callable:
+    """Wrap a never-suspending coroutine function as a plain function"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        coro = func(*args, **kwargs)
+        try:
+            coro.send(None)
+        except StopIteration as exc:
+            return exc.value
+        coro.close()
+        raise RuntimeError(f"{func.__name__} suspended and cannot run in the threadpool")
+    return wrapper
+
+
+class OffloadRoute(APIRoute):
+    """APIRoute that moves blocking `async def` endpoints onto the threadpool"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if OFFLOAD_BLOCKING_ROUTES and never_awaits(endpoint):
+            endpoint = run_coroutine_sync(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def configure_threadpool(workers: int = THREADPOOL_WORKERS):
+    """Size the anyio worker pool used for sync routes and dependencies"""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = max(1, workers)
+
+
+class EventLoopLagMonitor:
+    """Measure how late the event loop wakes up from a fixed-interval sleep"""
+
+    def __init__(self, interval_ms: float = 100, window: int = 600):
+        self.interval = interval_ms / 1000.0
+        self.samples = deque(maxlen=window)
+        self.max_lag_ms = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - start - self.interval) * 1000)
+            self.samples.append(lag_ms)
+            if lag_ms > self.max_lag_ms:
+                self.max_lag_ms = lag_ms
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"samples": 0, "interval_ms": self.interval * 1000}
+
+        def pct(p: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2)
+
+        return {
+            "samples": len(ordered),
+            "interval_ms": self.interval * 1000,
+            "last_ms": round(self.samples[-1], 2),
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "max_ms": round(self.max_lag_ms, 2),
+        }
+
+
+lag_monitor = EventLoopLagMonitor(EVENT_LOOP_LAG_INTERVAL_MS)
@@ -0,0 +1,270 @@
+"""
+Transactional Outbox
+Sale/purchase side effects dispatched off the request path
+
+emit() writes a domain_events row in the caller's transaction, so an event
+exists exactly when the business change committed. OutboxDispatcher, a
+background thread like the scan index refresher, claims due events in
+batches (FOR UPDATE SKIP LOCKED on Postgres, so several workers can share
+the queue), runs each event's handlers inside a savepoint and marks it done
+in the same transaction. A failing event is retried with exponential backoff
+and parked as 'failed' after OUTBOX_MAX_ATTEMPTS.
+
+Handlers register with @handles(...) (see event_handlers.py). They must not
+commit. If the domain_events table could not be created at startup, emit()
+runs the handlers inline instead, as the endpoints did before.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, bindparam, event, insert, text
+from sqlalchemy.orm import Session
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+OUTBOX_SCHEMA_FILE = Path(__file__).parent / "migrations" / "017_domain_events.sql"
+
+_metadata = MetaData()
+
+# Mirrors migrations/017_domain_events.sql for non-Postgres databases (payload is JSONB there)
+domain_events = Table(
+    "domain_events", _metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_type", String, nullable=False),
+    Column("aggregate_id", String),
+    Column("payload", Text, nullable=False),
+    Column("status", String, nullable=False, default="pending"),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("available_at", DateTime, nullable=False),
+    Column("last_error", Text),
+    Column("created_at", DateTime, nullable=False),
+    Column("processed_at", DateTime),
+)
+
+_handlers: Dict[str, List[Callable]] = {}
+
+
+def handles(*event_types: str):
+    """Register `fn(db, payload)` as a consumer of the given event types"""
+    def register(fn):
+        for event_type in event_types:
+            _handlers.setdefault(event_type, []).append(fn)
+        return fn
+    return register
+
+
+def _run_handlers(db, event_type: str, payload: dict):
+    for handler in _handlers.get(event_type, ()):
+        handler(db, payload)
+
+
+def emit(db, event_type: str, payload: dict, aggregate_id: Optional[str] = None):
+    """Queue an event in the caller's transaction; it is dispatched after commit"""
+    if not outbox_dispatcher.enabled:
+        try:
+            with db.begin_nested():
+                _run_handlers(db, event_type, payload)
+        except Exception as e:
+            print(f"[WARNING] Inline handler for {event_type} failed: {e}")
+        return
+    now = datetime.utcnow()
+    db.execute(insert(domain_events).values(
+        event_type=event_type,
+        aggregate_id=str(aggregate_id) if aggregate_id is not None else None,
+        payload=json.dumps(payload, default=str),
+        status="pending",
+        attempts=0,
+        available_at=now,
+        created_at=now,
+    ))
+    db.info["outbox_pending"] = True
+
+
+def emit_many(db, events: List[tuple]):
+    """Queue several (event_type, payload, aggregate_id) events with one multi-row INSERT"""
+    if not events:
+        return
+    if not outbox_dispatcher.enabled:
+        for event_type, payload, aggregate_id in events:
+            emit(db, event_type, payload, aggregate_id)
+        return
+    now = datetime.utcnow()
+    db.execute(insert(domain_events).values([{
+        "event_type": event_type,
+        "aggregate_id": str(aggregate_id) if aggregate_id is not None else None,
+        "payload": json.dumps(payload, default=str),
+        "status": "pending",
+        "attempts": 0,
+        "available_at": now,
+        "created_at": now,
+    } for event_type, payload, aggregate_id in events]))
+    db.info["outbox_pending"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher(session):
+    if session.info.pop("outbox_pending", False):
+        outbox_dispatcher.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session):
+    session.info.pop("outbox_pending", None)
+
+
+def ensure_outbox_schema(engine):
+    """Apply migration 017 on Postgres, create the table elsewhere; disables the outbox on failure"""
+    try:
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as conn:
+                conn.exec_driver_sql(OUTBOX_SCHEMA_FILE.read_text(encoding="utf-8"))
+        else:
+            _metadata.create_all(engine)
+    except Exception:
+        outbox_dispatcher.enabled = False
+        raise
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(5 * 2 ** (attempts - 1), 3600))
+
+
+class OutboxDispatcher:
+    """Claims due events in batches and runs their handlers"""
+
+    def __init__(self):
+        self.enabled = True
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.dispatched = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_ms = 0.0
+        self.last_error: Optional[str] = None
+
+    def run_once(self, db, limit: int = OUTBOX_BATCH_SIZE) -> int:
+        """Process one batch of due events; returns how many were claimed"""
+        start = time.perf_counter()
+        now = datetime.utcnow()
+        lock = " FOR UPDATE SKIP LOCKED" if db.get_bind().dialect.name == "postgresql" else ""
+        rows = db.execute(text(f"""
+            SELECT id, event_type, payload, attempts
+            FROM domain_events
+            WHERE status = 'pending' AND available_at <= :now
+            ORDER BY id
+            LIMIT :limit{lock}
+        """), {"now": now, "limit": limit}).all()
+        if not rows:
+            db.rollback()
+            return 0
+
+        done, retry = [], []
+        for event_id, event_type, payload, attempts in rows:
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            try:
+                with db.begin_nested():
+                    _run_handlers(db, event_type, payload)
+                done.append(event_id)
+            except Exception as e:
+                attempts += 1
+                self.last_error = f"{event_type} #{event_id}: {e}"
+                retry.append({
+                    "id": event_id,
+                    "attempts": attempts,
+                    "status": "failed" if attempts >= OUTBOX_MAX_ATTEMPTS else "pending",
+                    "available_at": now + _backoff(attempts),
+                    "error": str(e)[:2000],
+                })
+
+        if done:
+            db.execute(text("""
+                UPDATE domain_events SET status = 'done', attempts = attempts + 1, processed_at = :now, last_error = NULL
+                WHERE id IN :ids
+            """).bindparams(bindparam("ids", expanding=True)), {"now": datetime.utcnow(), "ids": done})
+        if retry:
+            db.execute(text("""
+                UPDATE domain_events
+                SET status = :status, attempts = :attempts, available_at = :available_at, last_error = :error
+                WHERE id = :id
+            """), retry)
+        db.commit()
+
+        self.batches += 1
+        self.dispatched += len(done)
+        self.retried += sum(1 for r in retry if r["status"] == "pending")
+        self.failed += sum(1 for r in retry if r["status"] == "failed")
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+        return len(rows)
+
+    def notify(self):
+        self._wake.set()
+
+    def start(self, session_factory):
+        """Start the background dispatch thread (idempotent)"""
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        def loop():
+            while not self._stop.is_set():
+                claimed = 0
+                db = session_factory()
+                try:
+                    claimed = self.run_once(db)
+                except Exception as e:
+                    db.rollback()
+                    self.last_error = str(e)
+                    print(f"[WARN] Outbox dispatch failed: {e}")
+                finally:
+                    db.close()
+                if claimed < OUTBOX_BATCH_SIZE:
+                    # Caught up: sleep until the next commit that emitted events, or the poll interval
+                    self._wake.wait(OUTBOX_POLL_SECONDS)
+                    self._wake.clear()
+
+        self._thread = threading.Thread(target=loop, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "dispatched": self.dispatched,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_batch_ms": round(self.last_batch_ms, 2),
+            "last_error": self.last_error,
+            "handlers": {k: len(v) for k, v in _handlers.items()},
+        }
+
+
+outbox_dispatcher = OutboxDispatcher()
+
+
+def outbox_backlog(db) -> Dict:
+    rows = db.execute(text("SELECT status, COUNT(*) FROM domain_events GROUP BY status")).all()
+    return {status: int(count) for status, count in rows}
+
+
+def prune_domain_events(db, retention_days: int = OUTBOX_RETENTION_DAYS) -> int:
+    """Delete dispatched events past retention (failed ones are kept for inspection)"""
+    result = db.execute(text("DELETE FROM domain_events WHERE status = 'done' AND processed_at < :cutoff"),
+                        {"cutoff": datetime.utcnow() - timedelta(days=retention_days)})
+    db.commit()
+    return result.rowcount or 0
@@ -0,0 +1,230 @@
+"""
+Keyset Pagination
+Opaque cursors, seek-method filtering and row-count estimates for list endpoints
+
+List endpoints take `after` and `limit`; the cursor for the next page is
+returned in the X-Next-Cursor header. A request with neither gets the whole
+list, as before pagination existed (dashboards sum it client-side); a
+request with only `after` gets PAGINATION_DEFAULT_LIMIT rows. Clients that send
+`Prefer: count=estimated` also get X-Total-Estimate, taken from the planner's
+row estimate instead of a COUNT(*).
+"""
+
+import base64
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Query, Request, Response
+from sqlalchemy import and_, false, or_, text
+from sqlalchemy.orm import Session
+
+PAGINATION_DEFAULT_LIMIT = int(os.getenv("PAGINATION_DEFAULT_LIMIT", "500"))
+PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", "1000"))
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return float(value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "$dt" in value:
+            return datetime.fromisoformat(value["$dt"])
+        if "$d" in value:
+            return date.fromisoformat(value["$d"])
+    return value
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Opaque, URL-safe cursor for the sort-key values of the last row on a page"""
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return [_decode_value(v) for v in values]
+
+
+def clamp_limit(limit: Optional[int], default: Optional[int] = None) -> Optional[int]:
+    """Apply the default page size and cap at PAGINATION_MAX_LIMIT"""
+    if limit is None:
+        limit = default
+    if limit is None:
+        return None
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    return min(limit, PAGINATION_MAX_LIMIT)
+
+
+def _after(column, value, descending: bool, final: bool):
+    """Rows past `value` in `column` order, NULLs sorting as the largest value (Postgres' default)"""
+    if final:
+        return column < value if descending else column > value
+    if value is None:
+        # Ascending, nothing follows the NULL group; descending, every non-NULL does
+        return None if not descending else column.is_not(None)
+    if descending:
+        return column < value
+    return or_(column > value, column.is_(None))
+
+
+def _same(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def apply_keyset(query, order_by: Sequence[Tuple[Any, bool]], after: Optional[str]):
+    """
+    Order `query` by (column, descending) pairs and, when `after` is given,
+    seek past the row it encodes. The last column must be unique (usually id).
+    Columns are compared raw so an index on them can serve the seek; NULLs in
+    earlier keys sort last ascending and first descending, as a plain btree
+    index returns them.
+    """
+    if after:
+        values = decode_cursor(after, len(order_by))
+        clauses = []
+        for i, (column, descending) in enumerate(order_by):
+            step = _after(column, values[i], descending, i == len(order_by) - 1)
+            if step is None:
+                continue
+            equal_prefix = [_same(order_by[j][0], values[j]) for j in range(i)]
+            clauses.append(and_(*equal_prefix, step) if equal_prefix else step)
+        query = query.filter(or_(*clauses) if clauses else false())
+    return query.order_by(*[
+        column.desc().nulls_first() if descending else column.asc().nulls_last() for column, descending in order_by
+    ])
+
+
+def fetch_page(query, limit: Optional[int], key: Callable[[Any], Sequence[Any]]) -> Tuple[list, Optional[str]]:
+    """Run a keyset-ordered query and return (rows, next_cursor)"""
+    if limit is None:
+        return query.all(), None
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+class PageParams:
+    """Pagination inputs shared by list endpoints"""
+
+    def __init__(self, after: Optional[str], limit: Optional[int], estimate: bool = False):
+        self.after = after
+        self.limit = limit
+        self.estimate = estimate
+
+
+def page_params(
+    request: Request,
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    limit: Optional[int] = Query(None, description=f"Page size (max {PAGINATION_MAX_LIMIT}); omit for the full list"),
+) -> PageParams:
+    prefer = request.headers.get("prefer", "")
+    # Unpaged callers keep the full list; paging starts once a client asks for it
+    default = PAGINATION_DEFAULT_LIMIT if after else None
+    return PageParams(after, clamp_limit(limit, default), "count=estimated" in prefer)
+
+
+def estimate_count(db: Session, statement, params: Optional[dict] = None) -> Optional[int]:
+    """Planner row estimate for a query (Postgres only); None when unavailable"""
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return None
+    try:
+        with db.begin_nested():
+            if isinstance(statement, str):
+                plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {statement}"), params or {}).scalar()
+            else:
+                compiled = statement.compile(dialect=bind.dialect, compile_kwargs={"render_postcompile": True})
+                plan = db.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception:
+        return None
+
+
+def set_page_headers(response: Optional[Response], next_cursor: Optional[str], estimate: Optional[int] = None):
+    if response is None:
+        return
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if estimate is not None:
+        response.headers["X-Total-Estimate"] = str(estimate)
+
+
+def paginate(
+    db: Session,
+    query,
+    page: PageParams,
+    response: Optional[Response],
+    order_by: Sequence[Tuple[Any, bool]],
+) -> list:
+    """
+    Keyset-paginate an ORM query ordered by (attribute, descending) pairs.
+    The last attribute must be unique and non-null.
+    """
+    estimate = estimate_count(db, query.statement) if page.estimate else None
+    query = apply_keyset(query, order_by, page.after)
+    names = [attr.key for attr, _ in order_by]
+    rows, next_cursor = fetch_page(query, page.limit, lambda row: [getattr(row, name) for name in names])
+    set_page_headers(response, next_cursor, estimate)
+    return rows
+
+
+def paginate_sql(
+    db: Session,
+    sql: str,
+    params: Optional[dict],
+    page: PageParams,
+    response: Optional[Response],
+    order_by: Sequence[Tuple[str, bool]],
+) -> list:
+    """
+    Keyset-paginate a raw SELECT. `order_by` names output columns of `sql`
+    as (column, descending); the last one must be unique and non-null.
+    """
+    params = dict(params or {})
+    estimate = estimate_count(db, sql, params) if page.estimate else None
+    where = ""
+    if page.after:
+        values = decode_cursor(page.after, len(order_by))
+        clauses = []
+        for i, (column, descending) in enumerate(order_by):
+            parts = [f"{order_by[j][0]} = :_after_{j}" for j in range(i)]
+            parts.append(f"{column} {'<' if descending else '>'} :_after_{i}")
+            clauses.append("(" + " AND ".join(parts) + ")")
+        where = " WHERE " + " OR ".join(clauses)
+        params.update({f"_after_{i}": v for i, v in enumerate(values)})
+    order_sql = ", ".join(f"{column} {'DESC' if descending else 'ASC'}" for column, descending in order_by)
+    limit_sql = ""
+    if page.limit is not None:
+        limit_sql = " LIMIT :_page_limit"
+        params["_page_limit"] = page.limit + 1
+    rows = db.execute(text(f"SELECT * FROM ({sql}) AS page_src{where} ORDER BY {order_sql}{limit_sql}"), params).fetchall()
+
+    next_cursor = None
+    if page.limit is not None and len(rows) > page.limit:
+        rows = rows[:page.limit]
+        last = rows[-1]._mapping
+        next_cursor = encode_cursor([last[column] for column, _ in order_by])
+    set_page_headers(response, next_cursor, estimate)
+    return rows
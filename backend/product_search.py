@@ -0,0 +1,186 @@
+"""
+Product Search
+Ranked typeahead search over the product catalogue
+
+On Postgres, candidates come from the full-text index over name, generic and
+brand name (prefix-matched tsquery), pg_trgm similarity on the same columns,
+and prefix/exact matches on SKU and barcode. Only the top N candidates are
+joined to their active batches for stock and best price.
+
+On SQLite (local development) the same response is produced with LIKE
+matching and a simple prefix-based score.
+"""
+
+import re
+from typing import Dict, List
+
+from sqlalchemy import text
+
+from batch_allocation import SELLABLE_EXPIRY, sellable_cutoff
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+
+# Must match the expression indexed by idx_products_search_tsv
+_TSV_EXPR = (
+    "to_tsvector('simple', coalesce(p.name, '') || ' ' || "
+    "coalesce(p.generic_name, '') || ' ' || coalesce(p.brand_name, ''))"
+)
+
+# Idempotent DDL mirrored from migrations/015_product_search.sql
+SEARCH_INDEX_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS idx_products_search_tsv ON products USING gin ("
+    + _TSV_EXPR.replace("p.", "")
+    + ")",
+    "CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING gin (lower(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_products_generic_trgm ON products USING gin (lower(generic_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_products_brand_trgm ON products USING gin (lower(brand_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_products_sku_prefix ON products (lower(sku) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_products_barcode ON products (barcode)",
+    "CREATE INDEX IF NOT EXISTS idx_batches_sellable ON medicine_batches (product_id, expiry_date) "
+    "WHERE is_active AND quantity_remaining > 0",
+]
+
+
+def ensure_search_indexes(engine):
+    """
+    Apply SEARCH_INDEX_DDL on Postgres without blocking writes: each index is
+    built with CREATE INDEX CONCURRENTLY on an autocommit connection, so
+    sales keep decrementing stock while a large catalogue is indexed. An
+    index left invalid by an interrupted build is dropped and rebuilt.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for ddl in SEARCH_INDEX_DDL:
+            if ddl.startswith("CREATE INDEX IF NOT EXISTS "):
+                name = ddl.split()[5]
+                invalid = conn.execute(text(
+                    "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+                ), {"name": name}).scalar()
+                if invalid:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                ddl = ddl.replace("CREATE INDEX IF NOT EXISTS ", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ", 1)
+            conn.execute(text(ddl))
+
+_PG_SEARCH_SQL = f"""
+    WITH candidates AS (
+        SELECT p.id, p.name, p.generic_name, p.brand_name, p.sku, p.barcode,
+               p.stock_quantity, COALESCE(p.selling_price, p.unit_price) AS list_price,
+               p.is_prescription_required,
+               CASE WHEN lower(p.sku) = :ql OR p.barcode = :q THEN 10 ELSE 0 END
+               + CASE WHEN lower(p.sku) LIKE :prefix THEN 2 ELSE 0 END
+               + GREATEST(
+                   ts_rank({_TSV_EXPR}, to_tsquery('simple', :tsq)) * 2,
+                   similarity(lower(p.name), :ql),
+                   similarity(lower(coalesce(p.generic_name, '')), :ql) * 0.9,
+                   similarity(lower(coalesce(p.brand_name, '')), :ql) * 0.9
+               ) AS score
+        FROM products p
+        WHERE (:tsq <> '' AND {_TSV_EXPR} @@ to_tsquery('simple', :tsq))
+           OR lower(p.name) % :ql
+           OR lower(p.generic_name) % :ql
+           OR lower(p.brand_name) % :ql
+           OR lower(p.sku) LIKE :prefix
+           OR p.barcode = :q
+        ORDER BY score DESC, p.name
+        LIMIT :limit
+    )
+    SELECT c.*, b.best_batch_price, b.batch_stock, b.nearest_expiry
+    FROM candidates c
+    LEFT JOIN LATERAL (
+        SELECT MIN(COALESCE(mb.selling_price, mb.mrp)) AS best_batch_price,
+               SUM(mb.quantity_remaining) AS batch_stock,
+               MIN(mb.expiry_date) AS nearest_expiry
+        FROM medicine_batches mb
+        WHERE mb.product_id = c.id
+          AND mb.is_active AND mb.quantity_remaining > 0
+          AND mb.{SELLABLE_EXPIRY}
+    ) b ON TRUE
+    ORDER BY c.score DESC, c.name
+"""
+
+_SQLITE_SEARCH_SQL = f"""
+    SELECT c.*,
+           (SELECT MIN(COALESCE(mb.selling_price, mb.mrp)) FROM medicine_batches mb
+             WHERE mb.product_id = c.id AND mb.is_active AND mb.quantity_remaining > 0
+               AND mb.{SELLABLE_EXPIRY}) AS best_batch_price,
+           (SELECT SUM(mb.quantity_remaining) FROM medicine_batches mb
+             WHERE mb.product_id = c.id AND mb.is_active AND mb.quantity_remaining > 0
+               AND mb.{SELLABLE_EXPIRY}) AS batch_stock,
+           (SELECT MIN(mb.expiry_date) FROM medicine_batches mb
+             WHERE mb.product_id = c.id AND mb.is_active AND mb.quantity_remaining > 0
+               AND mb.{SELLABLE_EXPIRY}) AS nearest_expiry
+    FROM (
+        SELECT p.id, p.name, p.generic_name, p.brand_name, p.sku, p.barcode,
+               p.stock_quantity, COALESCE(p.selling_price, p.unit_price) AS list_price,
+               p.is_prescription_required,
+               CASE WHEN lower(p.sku) = :ql OR p.barcode = :q THEN 10 ELSE 0 END
+               + CASE WHEN lower(p.name) LIKE :prefix ESCAPE '\\' THEN 3
+                      WHEN lower(p.name) LIKE :word_prefix ESCAPE '\\' THEN 2
+                      WHEN lower(p.name) LIKE :contains ESCAPE '\\' THEN 1 ELSE 0 END
+               + CASE WHEN lower(p.generic_name) LIKE :prefix ESCAPE '\\' OR lower(p.brand_name) LIKE :prefix ESCAPE '\\' THEN 1.5
+                      WHEN lower(p.generic_name) LIKE :contains ESCAPE '\\' OR lower(p.brand_name) LIKE :contains ESCAPE '\\' THEN 0.5
+                      ELSE 0 END
+               + CASE WHEN lower(p.sku) LIKE :prefix ESCAPE '\\' THEN 2 ELSE 0 END AS score
+        FROM products p
+        WHERE lower(p.name) LIKE :contains ESCAPE '\\'
+           OR lower(p.generic_name) LIKE :contains ESCAPE '\\'
+           OR lower(p.brand_name) LIKE :contains ESCAPE '\\'
+           OR lower(p.sku) LIKE :prefix ESCAPE '\\'
+           OR p.barcode = :q
+        ORDER BY score DESC, p.name
+        LIMIT :limit
+    ) c
+    ORDER BY c.score DESC, c.name
+"""
+
+
+def prefix_tsquery(q: str) -> str:
+    """'para 500' -> 'para:* & 500:*'; tokens are restricted to word characters"""
+    return " & ".join(f"{token}:*" for token in re.findall(r"\w+", q.lower()))
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_products(db, q: str, limit: int = SEARCH_DEFAULT_LIMIT) -> List[Dict]:
+    """Top `limit` products for `q`, best match first. `db` is a Session or Connection."""
+    q = (q or "").strip()
+    if not q:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    dialect = getattr(db, "dialect", None) or db.get_bind().dialect
+    ql = q.lower()
+    like = _escape_like(ql)
+    params = {"q": q, "ql": ql, "prefix": f"{like}%", "limit": limit, "cutoff": sellable_cutoff()}
+
+    if dialect.name == "postgresql":
+        params["tsq"] = prefix_tsquery(q)
+        sql = _PG_SEARCH_SQL
+    else:
+        params.update(contains=f"%{like}%", word_prefix=f"% {like}%")
+        sql = _SQLITE_SEARCH_SQL
+
+    results = []
+    for row in db.execute(text(sql), params).mappings():
+        batch_stock = row["batch_stock"]
+        stock = float(batch_stock) if batch_stock is not None else float(row["stock_quantity"] or 0)
+        best_price = row["best_batch_price"]
+        results.append({
+            "id": str(row["id"]),
+            "name": row["name"],
+            "generic_name": row["generic_name"],
+            "brand_name": row["brand_name"],
+            "sku": row["sku"],
+            "barcode": row["barcode"],
+            "stock": stock,
+            "price": float(best_price) if best_price is not None else float(row["list_price"] or 0),
+            "best_batch_price": float(best_price) if best_price is not None else None,
+            "nearest_expiry": row["nearest_expiry"],
+            "prescription_required": bool(row["is_prescription_required"]),
+            "score": round(float(row["score"] or 0), 4),
+        })
+    return results
@@ -3,8 +3,10 @@ Role-Based Access Control (RBAC) System
 Granular permissions for Pharmazine
 """
 
+import hashlib
 from enum import Enum
-from typing import List, Dict, Set
+from functools import lru_cache
+from typing import List, Dict, Set, FrozenSet, Iterable, Tuple
 from sqlalchemy import Column, String, Boolean, ForeignKey, Table
 from sqlalchemy.orm import relationship, Session
 from fastapi import HTTPException, Depends
@@ -168,35 +170,85 @@ ROLE_PERMISSIONS: Dict[str, Set[Permission]] = {
 }
 
 
+# Compiled permission model: one bit per Permission, one int mask per role.
+# Built once at import so permission checks are a single AND.
+PERMISSION_BITS: Dict[Permission, int] = {perm: 1 << idx for idx, perm in enumerate(Permission)}
+
+
+def _mask_of(permissions: Iterable[Permission]) -> int:
+    mask = 0
+    for perm in permissions:
+        mask |= PERMISSION_BITS[perm]
+    return mask
+
+
+ROLE_MASKS: Dict[str, int] = {role: _mask_of(perms) for role, perms in ROLE_PERMISSIONS.items()}
+
+# Changes whenever the role → permission table changes; clients can key caches on it
+RBAC_VERSION = hashlib.sha1(
+    "|".join(
+        f"{role}:{','.join(sorted(p.value for p in perms))}"
+        for role, perms in sorted(ROLE_PERMISSIONS.items())
+    ).encode()
+).hexdigest()[:12]
+
+
+@lru_cache(maxsize=256)
+def _combined_mask(roles: Tuple[str, ...]) -> int:
+    mask = 0
+    for role in roles:
+        mask |= ROLE_MASKS.get(role, 0)
+    return mask
+
+
+@lru_cache(maxsize=256)
+def _permissions_for_mask(mask: int) -> FrozenSet[Permission]:
+    return frozenset(perm for perm, bit in PERMISSION_BITS.items() if mask & bit)
+
+
+@lru_cache(maxsize=256)
+def _payload_for_roles(roles: Tuple[str, ...]) -> Dict:
+    permissions = _permissions_for_mask(_combined_mask(roles))
+    return {
+        "roles": list(roles),
+        "permissions": [perm.value for perm in Permission if perm in permissions],
+        "version": RBAC_VERSION,
+    }
+
+
 class RBACHelper:
     """Helper class for RBAC checks"""
     
     @staticmethod
-    def get_user_permissions(user_roles: List[str]) -> Set[Permission]:
+    def get_role_mask(user_roles: List[str]) -> int:
+        """Combined permission bitmask for a list of roles (memoized)"""
+        return _combined_mask(tuple(user_roles))
+    
+    @staticmethod
+    def get_user_permissions(user_roles: List[str]) -> FrozenSet[Permission]:
         """Get all permissions for a user based on their roles"""
-        permissions = set()
-        for role in user_roles:
-            if role in ROLE_PERMISSIONS:
-                permissions.update(ROLE_PERMISSIONS[role])
-        return permissions
+        return _permissions_for_mask(_combined_mask(tuple(user_roles)))
     
     @staticmethod
     def has_permission(user_roles: List[str], required_permission: Permission) -> bool:
         """Check if user has a specific permission"""
-        user_permissions = RBACHelper.get_user_permissions(user_roles)
-        return required_permission in user_permissions
+        return bool(_combined_mask(tuple(user_roles)) & PERMISSION_BITS[required_permission])
     
     @staticmethod
     def has_any_permission(user_roles: List[str], required_permissions: List[Permission]) -> bool:
         """Check if user has any of the required permissions"""
-        user_permissions = RBACHelper.get_user_permissions(user_roles)
-        return any(perm in user_permissions for perm in required_permissions)
+        return bool(_combined_mask(tuple(user_roles)) & _mask_of(required_permissions))
     
     @staticmethod
     def has_all_permissions(user_roles: List[str], required_permissions: List[Permission]) -> bool:
         """Check if user has all required permissions"""
-        user_permissions = RBACHelper.get_user_permissions(user_roles)
-        return all(perm in user_permissions for perm in required_permissions)
+        required = _mask_of(required_permissions)
+        return _combined_mask(tuple(user_roles)) & required == required
+    
+    @staticmethod
+    def get_permissions_payload(user_roles: List[str]) -> Dict:
+        """Precomputed {roles, permissions, version} payload for a role list"""
+        return _payload_for_roles(tuple(user_roles))
 
 
 def require_permission(permission: Permission):
@@ -265,14 +317,7 @@ def get_current_user_permissions(db: Session, user_id: str) -> Dict:
         return {"permissions": [], "roles": []}
     
     # Get user roles using central resolver (reads Supabase live, falls back local)
-    role_names = get_roles_for_user(db, user_id)
-    
-    # Get permissions
-    permissions = RBACHelper.get_user_permissions(role_names)
+    role_names = get_roles_for_user(db, user_id, user)
     
-    return {
-        "user_id": user_id,
-        "roles": role_names,
-        "permissions": [perm.value for perm in permissions]
-    }
+    return {"user_id": user_id, **RBACHelper.get_permissions_payload(role_names)}
 
@@ -0,0 +1,153 @@
+"""
+Resource Versions
+Per-resource change counters and strong ETags for reference and catalogue data
+
+Every INSERT/UPDATE/DELETE that reaches the database through SQLAlchemy (ORM
+flushes and raw text() alike, on any engine) is matched against
+TABLE_RESOURCES. The affected resources are bumped once the connection goes
+back to the pool, i.e. after the transaction has committed, so a response is
+never tagged with a version newer than the data it carries.
+
+A request whose If-None-Match matches the current ETag is answered with
+304 Not Modified before the endpoint runs, without touching the database.
+
+Counters live in process memory. Writes made by other processes (the
+scheduler, a second worker, manual SQL) are picked up when the ETag epoch
+rolls over every RESOURCE_ETAG_TTL_SECONDS.
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+RESOURCE_ETAG_TTL_SECONDS = int(os.getenv("RESOURCE_ETAG_TTL_SECONDS", "300"))
+
+# table -> resources whose responses include rows from it
+TABLE_RESOURCES: Dict[str, tuple] = {
+    "categories": ("categories", "products"),
+    "subcategories": ("subcategories",),
+    "countries": ("countries",),
+    "companies": ("companies",),
+    "products": ("products",),
+    "unit_types": ("unit_types",),
+    "medicine_types": ("medicine_types",),
+    "manufacturers": ("manufacturers",),
+}
+
+_WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "WITH", "TRUNCA")
+_WRITE_TARGET = re.compile(
+    r"\b(?:INSERT\s+INTO|UPDATE(?:\s+ONLY)?|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?)\s+(?:\"?\w+\"?\.)?\"?(\w+)\"?",
+    re.IGNORECASE,
+)
+
+_PENDING = "resource_versions.pending"
+_COMMITTED = "resource_versions.committed"
+
+
+class ResourceVersions:
+    """Monotonic change counter per resource"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self.instance_id = uuid.uuid4().hex[:8]
+        self.not_modified = 0
+
+    def bump(self, resources: Iterable[str]):
+        with self._lock:
+            for resource in resources:
+                self._versions[resource] = self._versions.get(resource, 0) + 1
+
+    def version(self, resource: str) -> int:
+        return self._versions.get(resource, 0)
+
+    def etag(self, resource: str) -> str:
+        epoch = int(time.time() // RESOURCE_ETAG_TTL_SECONDS) if RESOURCE_ETAG_TTL_SECONDS > 0 else 0
+        return f'"{resource}-{self.instance_id}.{epoch}.{self.version(resource)}"'
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "versions": dict(self._versions),
+                "not_modified": self.not_modified,
+                "ttl_seconds": RESOURCE_ETAG_TTL_SECONDS,
+            }
+
+
+resource_versions = ResourceVersions()
+
+
+def tables_written(statement: str) -> set:
+    """Tracked tables targeted by a write statement; empty for reads"""
+    if statement.lstrip()[:6].upper() not in _WRITE_PREFIXES:
+        return set()
+    return {name.lower() for name in _WRITE_TARGET.findall(statement) if name.lower() in TABLE_RESOURCES}
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_write(conn, cursor, statement, parameters, context, executemany):
+    tables = tables_written(statement)
+    if tables:
+        conn.info.setdefault(_PENDING, set()).update(tables)
+
+
+@event.listens_for(Engine, "commit")
+def _mark_committed(conn):
+    pending = conn.info.pop(_PENDING, None)
+    if pending:
+        conn.info.setdefault(_COMMITTED, set()).update(pending)
+
+
+@event.listens_for(Engine, "rollback")
+def _discard_pending(conn):
+    conn.info.pop(_PENDING, None)
+
+
+@event.listens_for(Pool, "checkin")
+def _publish_on_checkin(dbapi_connection, connection_record):
+    if connection_record is None:
+        return
+    # Anything still pending here ran outside an explicit transaction (autocommit); count it too
+    tables = connection_record.info.pop(_COMMITTED, set()) | connection_record.info.pop(_PENDING, set())
+    if tables:
+        resource_versions.bump({r for table in tables for r in TABLE_RESOURCES[table]})
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def etag_guard(resource: str):
+    """
+    Dependency for conditional GETs on `resource`: raises 304 when the client's
+    copy is current, otherwise sets ETag on the response and returns it.
+    """
+
+    def _guard(request: Request, response: Response) -> str:
+        etag = resource_versions.etag(resource)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            resource_versions.not_modified += 1
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return etag
+
+    return _guard
@@ -0,0 +1,98 @@
+"""
+Role Cache
+In-process TTL + LRU cache for resolved user roles
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# "supabase": Supabase profiles.role is authoritative, re-read every ROLE_CACHE_REFRESH_SECONDS
+# "local":    never call Supabase for roles, resolve from the local profiles/user_roles tables
+ROLE_CACHE_MODE = (os.getenv("ROLE_CACHE_MODE") or "supabase").strip().lower()
+ROLE_CACHE_TTL_SECONDS = float(os.getenv("ROLE_CACHE_TTL_SECONDS", "300"))
+ROLE_CACHE_REFRESH_SECONDS = float(os.getenv("ROLE_CACHE_REFRESH_SECONDS", "60"))
+ROLE_CACHE_MAX_ENTRIES = int(os.getenv("ROLE_CACHE_MAX_ENTRIES", "2048"))
+
+
+class RoleCache:
+    """Thread-safe TTL + LRU map of user id -> role list"""
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 300):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[List[str]]:
+        """Return cached roles, or None when missing or expired"""
+        if not user_id or self.ttl_seconds <= 0:
+            return None
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, roles = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(roles)
+
+    def set(self, user_id: str, roles: List[str]):
+        """Store roles for a user, evicting the least recently used entry when full"""
+        if not user_id or self.ttl_seconds <= 0:
+            return
+        key = str(user_id)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, tuple(roles))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one user's entry, or the whole cache when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(user_id), None)
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": ROLE_CACHE_MODE,
+                "ttl_seconds": self.ttl_seconds,
+                "max_entries": self.max_entries,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def is_supabase_authoritative() -> bool:
+    return ROLE_CACHE_MODE != "local"
+
+
+role_cache = RoleCache(
+    max_entries=ROLE_CACHE_MAX_ENTRIES,
+    ttl_seconds=ROLE_CACHE_REFRESH_SECONDS if is_supabase_authoritative() else ROLE_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,346 @@
+"""
+Offline Sale Ingest
+Idempotent bulk replay of sales queued by tills while offline
+
+Every queued sale carries a client-generated idempotency key, stored in
+sales.idempotency_key under a unique index (migrations/018_idempotency_keys.sql),
+so a replay that is retried, or raced by a second device, never records the
+sale twice. POST /api/sales/batch hands the whole queue to ingest_sales():
+
+- keys already stored, or repeated within the request, come back as duplicate
+- products, batches and customers for every sale load in one query each
+- each sale is checked against the stock the sales before it in the batch
+  left, per batch: explicit-batch draws come off the same batches FEFO
+  draws from, so a sale that no longer fits is rejected and the rest go ahead
+- sales, items, payments and loyalty entries are multi-row INSERTs, product
+  and batch stock drop with one conditional UPDATE each, FEFO runs once per
+  product, and everything commits once
+- if a stock write still fails (stock moved under the check), the bulk
+  savepoint rolls back and the accepted sales replay one at a time, so a
+  bad sale is rejected on its own and never blocks the queue
+
+Sales that use a coupon or redeem loyalty points need the live coupon and
+balance checks, so they go through checkout's path one at a time, each in a
+savepoint.
+"""
+
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, insert, text
+
+from batch_allocation import SELLABLE_EXPIRY, allocate_fefo, sellable_cutoff
+from checkout import (
+    _apply_loyalty, _checkout, _decrement_batches, _earned_points, _item_rows, _loyalty_transactions,
+    _medication_lines, _sale_payments, _sale_rows, _sales, _sales_items, find_sales_by_key,
+)
+from outbox import emit_many
+from stock_service import apply_stock_changes
+
+SALE_BATCH_MAX = int(os.getenv("SALE_BATCH_MAX", "1000"))
+# Rows per multi-row INSERT; keeps the bind-parameter count well under Postgres' 65535 limit
+INGEST_INSERT_CHUNK = 500
+
+IDEMPOTENCY_DDL = [
+    "ALTER TABLE sales ADD COLUMN IF NOT EXISTS idempotency_key TEXT",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_sales_idempotency_key ON sales (idempotency_key)",
+    "ALTER TABLE sales_items ADD COLUMN IF NOT EXISTS idempotency_key TEXT",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_sales_items_idempotency_key ON sales_items (idempotency_key)",
+]
+
+_PRODUCTS_SQL = """
+    SELECT CAST(id AS TEXT) AS id, name, stock_quantity, generic_name, is_prescription_required
+    FROM products
+    WHERE id IN :ids
+"""
+
+_BATCHES_SQL = f"""
+    SELECT CAST(product_id AS TEXT) AS product_id, batch_number, quantity_remaining,
+           (is_active AND quantity_remaining > 0 AND {SELLABLE_EXPIRY}) AS sellable
+    FROM medicine_batches
+    WHERE product_id IN :ids
+"""
+
+_CUSTOMERS_BY_ID_SQL = text(
+    "SELECT CAST(id AS TEXT), phone FROM customers WHERE id IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+_CUSTOMERS_BY_PHONE_SQL = text(
+    "SELECT CAST(id AS TEXT), phone FROM customers WHERE phone IN :phones"
+).bindparams(bindparam("phones", expanding=True))
+
+
+def _lookup_ids(db, ids) -> List[str]:
+    """Drop ids that cannot match a uuid key on Postgres, so one bad id cannot fail the whole batch"""
+    ids = sorted({str(i) for i in ids})
+    if db.get_bind().dialect.name != "postgresql":
+        return ids
+    valid = []
+    for value in ids:
+        try:
+            uuid.UUID(value)
+            valid.append(value)
+        except ValueError:
+            pass
+    return valid
+
+
+def _insert_chunks(db, table, rows: List[dict]):
+    for start in range(0, len(rows), INGEST_INSERT_CHUNK):
+        db.execute(insert(table).values(rows[start:start + INGEST_INSERT_CHUNK]))
+
+
+def _load_stock(db, product_ids: List[str]):
+    """Products and per-batch quantities (with FEFO sellability), row-locked on Postgres"""
+    lock = " FOR UPDATE" if db.get_bind().dialect.name == "postgresql" else ""
+    products = {r["id"]: dict(r) for r in db.execute(
+        text(_PRODUCTS_SQL + lock).bindparams(bindparam("ids", expanding=True)), {"ids": product_ids}
+    ).mappings().all()}
+    batches: Dict[tuple, dict] = {}
+    for r in db.execute(
+        text(_BATCHES_SQL + lock).bindparams(bindparam("ids", expanding=True)),
+        {"ids": product_ids, "cutoff": sellable_cutoff()},
+    ).mappings().all():
+        batch = batches.setdefault((r["product_id"], r["batch_number"]), {"qty": 0, "sellable": False})
+        batch["qty"] += float(r["quantity_remaining"] or 0)
+        batch["sellable"] = batch["sellable"] or bool(r["sellable"])
+    return products, batches
+
+
+def _load_customers(db, carts) -> Dict[str, str]:
+    """{customer_id or phone: customer_id} for every customer the carts name"""
+    ids = _lookup_ids(db, [c.customer_id for c in carts if c.customer_id])
+    phones = sorted({c.customer_phone for c in carts if c.customer_phone and not c.customer_id})
+    found: Dict[str, str] = {}
+    if ids:
+        found.update((cid, cid) for cid, _ in db.execute(_CUSTOMERS_BY_ID_SQL, {"ids": ids}).all())
+    if phones:
+        for cid, phone in db.execute(_CUSTOMERS_BY_PHONE_SQL, {"phones": phones}).all():
+            found.setdefault(phone, cid)
+    return found
+
+
+class _StockPlan:
+    """
+    What the accepted sales will draw, checked the way the writes run:
+    explicit-batch lines first (_decrement_batches), then one FEFO draw per
+    product from whatever sellable stock those leave.
+    """
+
+    def __init__(self, products, batches):
+        self.products = products
+        self.batches = batches
+        self.stock = {pid: p["stock_quantity"] or 0 for pid, p in products.items()}
+        self.by_product: Dict[str, List[tuple]] = {}
+        for key in batches:
+            self.by_product.setdefault(key[0], []).append(key)
+        self.explicit: Dict[tuple, float] = {}
+        self.fefo: Dict[str, float] = {}
+
+    def _fefo_room(self, pid: str, explicit: Dict[tuple, float]) -> float:
+        return sum(max(0, self.batches[key]["qty"] - explicit.get(key, 0))
+                   for key in self.by_product[pid] if self.batches[key]["sellable"])
+
+    def reserve(self, cart) -> Optional[str]:
+        """Add the cart's quantities to the plan; returns why it cannot, if it cannot"""
+        need: Dict[str, int] = {}
+        need_batch: Dict[tuple, int] = {}
+        need_fefo: Dict[str, int] = {}
+        for line in cart.items:
+            pid = str(line.product_id)
+            need[pid] = need.get(pid, 0) + line.quantity
+            if line.batch_no:
+                need_batch[(pid, line.batch_no)] = need_batch.get((pid, line.batch_no), 0) + line.quantity
+            else:
+                need_fefo[pid] = need_fefo.get(pid, 0) + line.quantity
+        missing = [pid for pid in need if pid not in self.products]
+        if missing:
+            return f"Product not found: {', '.join(missing)}"
+        short = [self.products[pid]["name"] for pid, qty in need.items() if self.stock[pid] < qty]
+        if short:
+            return f"Insufficient stock: {', '.join(short)}"
+        explicit = dict(self.explicit)
+        for key, qty in need_batch.items():
+            explicit[key] = explicit.get(key, 0) + qty
+            if key not in self.batches or self.batches[key]["qty"] < explicit[key]:
+                return "Batch not found or batch stock insufficient"
+        fefo = dict(self.fefo)
+        for pid, qty in need_fefo.items():
+            fefo[pid] = fefo.get(pid, 0) + qty
+        # An explicit draw from a sellable batch shrinks what FEFO can take, so
+        # recheck FEFO for every batch-tracked product this cart touches
+        for pid in {key[0] for key in need_batch} | set(need_fefo):
+            if pid in fefo and pid in self.by_product and self._fefo_room(pid, explicit) < fefo[pid]:
+                return "Insufficient unexpired batch stock"
+        for pid, qty in need.items():
+            self.stock[pid] -= qty
+        self.explicit, self.fefo = explicit, fefo
+        return None
+
+
+def _take(parts: List[dict], quantity) -> List[dict]:
+    """Pop `quantity` off the front of a product's FEFO allocation"""
+    taken = []
+    while quantity > 0:
+        part = parts[0]
+        qty = min(part["quantity"], quantity)
+        taken.append({**part, "quantity": qty})
+        part["quantity"] -= qty
+        quantity -= qty
+        if part["quantity"] <= 0:
+            parts.pop(0)
+    return taken
+
+
+def _ingest_bulk(db, entries, user_id: Optional[str], results: List[dict]):
+    if not entries:
+        return
+    now = datetime.utcnow()
+    product_ids = _lookup_ids(db, [line.product_id for _, cart in entries for line in cart.items])
+    products, batches = _load_stock(db, product_ids) if product_ids else ({}, {})
+    plan = _StockPlan(products, batches)
+    customers = _load_customers(db, [cart for _, cart in entries])
+
+    accepted = []
+    for index, cart in entries:
+        customer_id = None
+        if cart.customer_id:
+            customer_id = customers.get(str(cart.customer_id))
+            if customer_id is None:
+                results[index].update(status="rejected", error="Customer not found")
+                continue
+        elif cart.customer_phone:
+            customer_id = customers.get(cart.customer_phone)
+        error = plan.reserve(cart)
+        if error:
+            results[index].update(status="rejected", error=error)
+            continue
+        accepted.append((index, cart, customer_id, str(uuid.uuid4())))
+    if not accepted:
+        return
+
+    try:
+        with db.begin_nested():
+            _write_bulk(db, accepted, products, user_id, now, results)
+    except HTTPException:
+        # Stock moved under the plan: replay the accepted sales one at a time
+        # so only the ones that no longer fit are rejected
+        for index, cart, _, _ in accepted:
+            _checkout_one(db, cart, user_id, results[index])
+
+
+def _checkout_one(db, cart, user_id: Optional[str], result: dict):
+    """checkout's path for one sale in its own savepoint; a failure rejects just this sale"""
+    try:
+        with db.begin_nested():
+            sale = _checkout(db, cart, user_id)["sale"]
+        result.update(status="created", sale_id=sale["id"], error=None)
+    except HTTPException as e:
+        result.update(status="rejected", sale_id=None, error=e.detail)
+
+
+def _write_bulk(db, accepted, products, user_id: Optional[str], now, results: List[dict]):
+    sales, payments, items, events = {}, [], [], []
+    quantities: Dict[str, int] = {}
+    batch_qty: Dict[tuple, int] = {}
+    fefo_qty: Dict[str, int] = {}
+    for _, cart, _, sale_id in accepted:
+        sale, payment_rows = _sale_rows(cart, sale_id, user_id, now)
+        sales[sale_id] = sale
+        payments.extend(payment_rows)
+        for line in cart.items:
+            pid = str(line.product_id)
+            quantities[pid] = quantities.get(pid, 0) + line.quantity
+            if line.batch_no:
+                batch_qty[(pid, line.batch_no)] = batch_qty.get((pid, line.batch_no), 0) + line.quantity
+            else:
+                fefo_qty[pid] = fefo_qty.get(pid, 0) + line.quantity
+
+    # Sales first (items and payments reference them), then stock for the whole batch at once
+    _insert_chunks(db, _sales, list(sales.values()))
+    _insert_chunks(db, _sale_payments, payments)
+    apply_stock_changes(db, {pid: -qty for pid, qty in quantities.items()})
+    _decrement_batches(db, batch_qty)
+    # One FEFO draw per product, handed out to the lines in replay order (None = not batch-tracked)
+    fefo = {pid: allocate_fefo(db, pid, qty, update_product=False) for pid, qty in fefo_qty.items()}
+
+    earned: Dict[str, List[tuple]] = {}
+    for index, cart, customer_id, sale_id in accepted:
+        for line in cart.items:
+            parts = None
+            if not line.batch_no and fefo.get(str(line.product_id)):
+                parts = _take(fefo[str(line.product_id)], line.quantity)
+            items.extend(_item_rows(sale_id, line, parts, now))
+        points = _earned_points(sales[sale_id]["net_amount"]) if customer_id and cart.earn_loyalty else 0
+        if points > 0:
+            earned.setdefault(customer_id, []).append((sale_id, points))
+        medication = _medication_lines(cart.items, products) if customer_id else []
+        if medication:
+            events.append(("sale.medication_dispensed",
+                           {"sale_id": sale_id, "customer_id": customer_id, "at": now.isoformat(), "lines": medication},
+                           sale_id))
+        results[index].update(status="created", sale_id=sale_id)
+    _insert_chunks(db, _sales_items, items)
+
+    loyalty_rows = []
+    for customer_id, sale_points in earned.items():
+        balance = _apply_loyalty(db, customer_id, sum(p for _, p in sale_points), 0)
+        # Balance after each sale, walking back from the final one
+        for sale_id, points in reversed(sale_points):
+            loyalty_rows.append({"id": str(uuid.uuid4()), "customer_id": customer_id, "sale_id": sale_id,
+                                 "transaction_type": "earn", "points": points, "balance_after": balance,
+                                 "notes": "POS earn (offline)"})
+            balance -= points
+    _insert_chunks(db, _loyalty_transactions, loyalty_rows)
+
+    events.append(("stock.decreased", {"product_ids": list(quantities)}, None))
+    emit_many(db, events)
+
+
+def ingest_sales(db, carts: List, user_id: Optional[str], rejected: Optional[Dict[int, str]] = None) -> dict:
+    """
+    Record a queue of offline sales (CheckoutRequest-shaped carts, each with
+    an idempotency_key) and commit. `rejected` maps positions the caller
+    already found invalid to the reason. Returns a result per position:
+    {index, idempotency_key, status: created|duplicate|rejected, sale_id, error}.
+    """
+    rejected = rejected or {}
+    results = [{"index": i, "idempotency_key": getattr(cart, "idempotency_key", None),
+                "status": None, "sale_id": None, "error": None} for i, cart in enumerate(carts)]
+    first_seen: Dict[str, int] = {}
+    pending = []
+    for i, cart in enumerate(carts):
+        if i in rejected:
+            results[i].update(status="rejected", error=rejected[i])
+        elif not results[i]["idempotency_key"]:
+            results[i].update(status="rejected", error="idempotency_key is required")
+        elif results[i]["idempotency_key"] in first_seen:
+            results[i]["status"] = "duplicate"
+        else:
+            first_seen[results[i]["idempotency_key"]] = i
+            pending.append((i, cart))
+
+    try:
+        existing = find_sales_by_key(db, [cart.idempotency_key for _, cart in pending])
+        for i, cart in pending:
+            if cart.idempotency_key in existing:
+                results[i].update(status="duplicate", sale_id=existing[cart.idempotency_key])
+        pending = [(i, cart) for i, cart in pending if results[i]["status"] is None]
+
+        _ingest_bulk(db, [(i, c) for i, c in pending if not (c.coupon_code or c.loyalty_redeem)], user_id, results)
+        for i, cart in pending:
+            if cart.coupon_code or cart.loyalty_redeem:
+                _checkout_one(db, cart, user_id, results[i])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    # Repeats within the request point at whatever the first copy became
+    for result in results:
+        if result["status"] == "duplicate" and result["sale_id"] is None and result["idempotency_key"] in first_seen:
+            result["sale_id"] = results[first_seen[result["idempotency_key"]]]["sale_id"]
+    summary = {status: sum(1 for r in results if r["status"] == status) for status in ("created", "duplicate", "rejected")}
+    return {**summary, "results": results}
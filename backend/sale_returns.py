@@ -0,0 +1,217 @@
+"""
+Sales Returns
+Whole or partial customer returns in a fixed number of statements
+
+A return names the original sale and, optionally, per-line quantities
+(sales_items id -> quantity); without lines everything not yet returned
+comes back. Whatever the line count, a return is:
+- one locking read of the sale and one read of its lines with the quantity
+  already returned, so a line can never be returned twice
+- one multi-row INSERT of sales_return_items
+- one conditional UPDATE for product stock (stock_service.py) and one for
+  the batches the lines were sold from; lines marked not restockable
+  (damaged, opened) are refunded without going back on the shelf
+- one multi-row INSERT of stock_transactions
+- one UPDATE that totals the return in SQL: subtotal from the returned lines,
+  the sale's discount and tax pro rata, refund = subtotal - discount + tax
+Callers commit.
+"""
+
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import column, insert, table, text
+
+from document_numbers import sales_return_number
+from stock_service import apply_stock_changes
+
+SALE_RETURNS_FILE = Path(__file__).parent / "migrations" / "021_sales_return_lookup.sql"
+
+_sales_return_items = table(
+    "sales_return_items",
+    column("id"), column("return_id"), column("original_sale_item_id"), column("product_id"),
+    column("batch_number"), column("quantity"), column("unit_price"), column("total_price"),
+    column("return_reason"), column("restockable"),
+)
+_stock_transactions = table(
+    "stock_transactions",
+    column("id"), column("product_id"), column("transaction_type"), column("quantity"), column("unit_price"),
+    column("reference_id"), column("notes"), column("reason"), column("created_by"), column("created_at"),
+)
+
+_LINES_SQL = text("""
+    SELECT CAST(si.id AS TEXT) AS id, CAST(si.product_id AS TEXT) AS product_id, si.quantity,
+           si.unit_price, si.total_price, si.batch_number,
+           COALESCE((SELECT SUM(ri.quantity) FROM sales_return_items ri
+                     WHERE ri.original_sale_item_id = si.id), 0) AS returned
+    FROM sales_items si
+    WHERE si.sale_id = :sid
+""")
+
+_TOTALS_SQL = text("""
+    UPDATE sales_returns
+    SET subtotal = t.subtotal,
+        discount_amount = t.discount_amount,
+        vat_amount = t.vat_amount,
+        total_amount = t.subtotal - t.discount_amount + t.vat_amount,
+        refund_amount = t.subtotal - t.discount_amount + t.vat_amount
+    FROM (
+        SELECT x.subtotal,
+               CASE WHEN s.total_amount > 0
+                    THEN ROUND(CAST(x.subtotal * COALESCE(s.discount, 0) / s.total_amount AS NUMERIC), 2)
+                    ELSE 0 END AS discount_amount,
+               CASE WHEN s.total_amount > 0
+                    THEN ROUND(CAST(x.subtotal * COALESCE(s.tax, 0) / s.total_amount AS NUMERIC), 2)
+                    ELSE 0 END AS vat_amount
+        FROM (SELECT COALESCE(SUM(total_price), 0) AS subtotal
+              FROM sales_return_items WHERE return_id = :rid) x, sales s
+        WHERE s.id = :sid
+    ) t
+    WHERE sales_returns.id = :rid
+    RETURNING sales_returns.subtotal, sales_returns.discount_amount, sales_returns.vat_amount,
+              sales_returns.total_amount
+""")
+
+
+def ensure_sale_returns(engine):
+    """Apply migration 021 (Postgres only): index for the already-returned lookup"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql(SALE_RETURNS_FILE.read_text(encoding="utf-8"))
+
+
+def _requested(lines, sold: Dict[str, dict]) -> Dict[str, dict]:
+    """{sales_items id: {quantity, restockable}} validated against what is left to return"""
+    if not lines:
+        wanted = {sid: {"quantity": r["left"], "restockable": True} for sid, r in sold.items() if r["left"] > 0}
+        if not wanted:
+            raise HTTPException(status_code=400, detail="Sale has already been fully returned")
+        return wanted
+    wanted: Dict[str, dict] = {}
+    for line in lines:
+        entry = wanted.setdefault(str(line.sale_item_id), {"quantity": 0, "restockable": line.restockable})
+        entry["quantity"] += line.quantity
+        entry["restockable"] = entry["restockable"] and line.restockable
+    unknown = [sid for sid in wanted if sid not in sold]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Not a line of this sale: {', '.join(unknown)}")
+    over = [f"{sid} (returnable {sold[sid]['left']}, requested {w['quantity']})"
+            for sid, w in wanted.items() if w["quantity"] > sold[sid]["left"]]
+    if over:
+        raise HTTPException(status_code=400, detail=f"Return exceeds quantity sold: {'; '.join(over)}")
+    return wanted
+
+
+def _restore_batches(db, batches: Dict[tuple, int]):
+    """One UPDATE putting returned units back on the (product, batch) they were sold from"""
+    if not batches:
+        return
+    params, whens, keys = {}, [], []
+    for i, ((pid, batch_no), qty) in enumerate(batches.items()):
+        params[f"bp{i}"], params[f"bb{i}"], params[f"bq{i}"] = pid, batch_no, qty
+        match = f"(product_id = :bp{i} AND batch_number = :bb{i})"
+        whens.append(f"WHEN {match} THEN :bq{i}")
+        keys.append(match)
+    delta = f"CASE {' '.join(whens)} END"
+    # A batch deleted since the sale is skipped; the product total is still restored
+    db.execute(text(f"""
+        UPDATE medicine_batches
+        SET quantity_remaining = quantity_remaining + {delta},
+            quantity_sold = CASE WHEN COALESCE(quantity_sold, 0) > {delta}
+                                 THEN quantity_sold - {delta} ELSE 0 END,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE {' OR '.join(keys)}
+    """), params)
+
+
+def process_return(db, req, user_id: Optional[str]) -> dict:
+    """Record the return described by `req` (a SaleReturnRequest) and restock it"""
+    lock = " FOR UPDATE" if db.get_bind().dialect.name == "postgresql" else ""
+    # Locking the sale serialises concurrent returns against it
+    sale = db.execute(text(
+        f"SELECT CAST(id AS TEXT) AS id, customer_name, customer_phone FROM sales WHERE id = :sid{lock}"
+    ), {"sid": req.original_sale_id}).mappings().first()
+    if not sale:
+        raise HTTPException(status_code=404, detail="Original sale not found")
+
+    sold = {}
+    for r in db.execute(_LINES_SQL, {"sid": sale["id"]}).mappings():
+        sold[r["id"]] = {**r, "left": int(r["quantity"] or 0) - int(r["returned"] or 0)}
+    wanted = _requested(req.lines, sold)
+
+    now = datetime.utcnow()
+    return_id = str(uuid.uuid4())
+    return_number = sales_return_number(db)
+    db.execute(text("""
+        INSERT INTO sales_returns (id, return_number, original_sale_id, customer_name, customer_phone,
+                                   return_date, return_type, total_amount, refund_method, status, reason,
+                                   created_by, created_at)
+        VALUES (:rid, :number, :sid, :name, :phone, :day, :type, 0, :method, :status, :reason, :by, :at)
+    """), {
+        "rid": return_id, "number": return_number, "sid": sale["id"],
+        "name": sale["customer_name"], "phone": sale["customer_phone"], "day": now.date(),
+        "type": req.return_type, "method": req.refund_method, "status": req.status,
+        "reason": req.return_reason, "by": user_id, "at": now,
+    })
+
+    items, stock, batches, movements = [], {}, {}, []
+    for sid, w in wanted.items():
+        line, qty = sold[sid], w["quantity"]
+        unit_price = float(line["unit_price"] or 0)
+        sold_qty = int(line["quantity"] or 0)
+        # The line's own total carries any line discount; refund that share of it
+        line_total = float(line["total_price"] or 0) * qty / sold_qty if sold_qty else unit_price * qty
+        items.append({
+            "id": str(uuid.uuid4()),
+            "return_id": return_id,
+            "original_sale_item_id": sid,
+            "product_id": line["product_id"],
+            "batch_number": line["batch_number"],
+            "quantity": qty,
+            "unit_price": unit_price,
+            "total_price": round(line_total, 2),
+            "return_reason": req.return_reason,
+            "restockable": w["restockable"],
+        })
+        if not w["restockable"]:
+            continue
+        stock[line["product_id"]] = stock.get(line["product_id"], 0) + qty
+        if line["batch_number"]:
+            key = (line["product_id"], line["batch_number"])
+            batches[key] = batches.get(key, 0) + qty
+        movements.append({
+            "id": str(uuid.uuid4()),
+            "product_id": line["product_id"],
+            "transaction_type": "sales_return",
+            "quantity": qty,
+            "unit_price": unit_price,
+            "reference_id": return_id,
+            "notes": f"Sale return {return_number}",
+            "reason": req.return_reason,
+            "created_by": user_id,
+            "created_at": now,
+        })
+
+    db.execute(insert(_sales_return_items).values(items))
+    apply_stock_changes(db, stock)
+    _restore_batches(db, batches)
+    if movements:
+        db.execute(insert(_stock_transactions).values(movements))
+    totals = db.execute(_TOTALS_SQL, {"rid": return_id, "sid": sale["id"]}).mappings().first()
+
+    return {
+        "id": return_id,
+        "return_number": return_number,
+        "original_sale_id": sale["id"],
+        "status": req.status,
+        "subtotal": float(totals["subtotal"] or 0),
+        "discount_amount": float(totals["discount_amount"] or 0),
+        "vat_amount": float(totals["vat_amount"] or 0),
+        "total_refund": float(totals["total_amount"] or 0),
+        "items": [{k: v for k, v in item.items() if k != "return_id"} for item in items],
+        "restocked_products": sorted(stock),
+    }
@@ -0,0 +1,249 @@
+"""
+Scan Index
+Process-local barcode/SKU -> product + FEFO batch index for POS scan-to-cart
+
+The whole index is rebuilt in a background thread at startup and every
+SCAN_INDEX_REFRESH_SECONDS. Endpoints that change a product or its batches
+call `scan_index.invalidate(product_id)` after committing; the next scan of
+that product reloads just its row and batches. Codes not in the index (e.g.
+products created by another process) are looked up once and added.
+"""
+
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from batch_allocation import sellable_cutoff
+
+SCAN_INDEX_REFRESH_SECONDS = int(os.getenv("SCAN_INDEX_REFRESH_SECONDS", "300"))
+
+_PRODUCT_SELECT = """
+    SELECT CAST(id AS TEXT) AS id, name, sku, barcode,
+           COALESCE(selling_price, unit_price) AS price, mrp_unit,
+           vat_percentage, cgst_percentage, sgst_percentage, igst_percentage,
+           max_discount_percentage, is_prescription_required, stock_quantity
+    FROM products
+"""
+
+_BATCH_SELECT = """
+    SELECT CAST(id AS TEXT) AS id, CAST(product_id AS TEXT) AS product_id, batch_number,
+           expiry_date, quantity_remaining, selling_price, mrp, discount_percentage
+    FROM medicine_batches
+    WHERE is_active AND quantity_remaining > 0
+"""
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+def _num(value) -> float:
+    return float(value) if value is not None else 0.0
+
+
+def _product_entry(row) -> Dict:
+    gst = _num(row["igst_percentage"]) or _num(row["cgst_percentage"]) + _num(row["sgst_percentage"])
+    return {
+        "product_id": row["id"],
+        "name": row["name"],
+        "sku": row["sku"],
+        "barcode": row["barcode"],
+        "price": _num(row["price"]),
+        "mrp": _num(row["mrp_unit"]) if row["mrp_unit"] is not None else None,
+        "vat_percentage": _num(row["vat_percentage"]),
+        "gst_percentage": gst,
+        "max_discount_percentage": _num(row["max_discount_percentage"]),
+        "prescription_required": bool(row["is_prescription_required"]),
+        "stock_quantity": _num(row["stock_quantity"]),
+        "batches": [],
+    }
+
+
+def _batch_entry(row) -> Dict:
+    return {
+        "batch_id": row["id"],
+        "batch_number": row["batch_number"],
+        "expiry_date": _as_date(row["expiry_date"]),
+        "quantity_remaining": _num(row["quantity_remaining"]),
+        "selling_price": _num(row["selling_price"]) if row["selling_price"] is not None else None,
+        "mrp": _num(row["mrp"]) if row["mrp"] is not None else None,
+        "discount_percentage": _num(row["discount_percentage"]),
+    }
+
+
+def _fefo_key(batch: Dict):
+    return (batch["expiry_date"] or date.max, batch["batch_number"] or "")
+
+
+def _codes_for(entry: Dict) -> List[str]:
+    return [c.strip().lower() for c in (entry["barcode"], entry["sku"]) if c and c.strip()]
+
+
+class ScanIndex:
+    """Barcode/SKU lookups answered from memory, refreshed per product on write"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes: Dict[str, str] = {}
+        self._entries: Dict[str, Dict] = {}
+        # product_id -> invalidation generation; entries listed here are reloaded on next scan
+        self._stale: Dict[str, int] = {}
+        self._generation = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.built_at: Optional[float] = None
+        self.last_build_ms = 0.0
+        self.hits = 0
+        self.reloads = 0
+        self.misses = 0
+
+    # ---- building ----
+
+    def rebuild(self, db) -> int:
+        """Load every product and its sellable batches (two queries); returns product count"""
+        start = time.perf_counter()
+        with self._lock:
+            stale_before = dict(self._stale)
+        entries: Dict[str, Dict] = {}
+        codes: Dict[str, str] = {}
+        for row in db.execute(text(_PRODUCT_SELECT)).mappings():
+            entry = _product_entry(row)
+            entries[entry["product_id"]] = entry
+            for code in _codes_for(entry):
+                codes.setdefault(code, entry["product_id"])
+        for row in db.execute(text(_BATCH_SELECT)).mappings():
+            entry = entries.get(row["product_id"])
+            if entry is not None:
+                entry["batches"].append(_batch_entry(row))
+        for entry in entries.values():
+            entry["batches"].sort(key=_fefo_key)
+
+        with self._lock:
+            self._entries = entries
+            self._codes = codes
+            # Keep only invalidations that arrived while we were reading
+            self._stale = {pid: gen for pid, gen in self._stale.items() if stale_before.get(pid) != gen}
+            self.built_at = time.time()
+            self.last_build_ms = (time.perf_counter() - start) * 1000
+        return len(entries)
+
+    def _load_product(self, db, product_id: str) -> Optional[Dict]:
+        with self._lock:
+            generation = self._stale.get(product_id)
+        # Compare the raw column (no ::text cast) so the primary key / product_id indexes are used;
+        # psycopg2 sends the id as an untyped literal that Postgres coerces to uuid
+        row = db.execute(text(f"{_PRODUCT_SELECT} WHERE id = :pid"), {"pid": product_id}).mappings().first()
+        entry = None
+        if row is not None:
+            entry = _product_entry(row)
+            batch_rows = db.execute(text(f"{_BATCH_SELECT} AND product_id = :pid"), {"pid": product_id}).mappings()
+            entry["batches"] = sorted((_batch_entry(b) for b in batch_rows), key=_fefo_key)
+
+        with self._lock:
+            old = self._entries.pop(product_id, None)
+            if old is not None:
+                for code in _codes_for(old):
+                    if self._codes.get(code) == product_id:
+                        del self._codes[code]
+            if entry is not None:
+                self._entries[product_id] = entry
+                for code in _codes_for(entry):
+                    self._codes.setdefault(code, product_id)
+            if self._stale.get(product_id) == generation:
+                self._stale.pop(product_id, None)
+            self.reloads += 1
+        return entry
+
+    def _load_by_code(self, db, code: str) -> Optional[str]:
+        row = db.execute(
+            text("SELECT CAST(id AS TEXT) AS id FROM products WHERE barcode = :code OR lower(sku) = :key LIMIT 1"),
+            {"code": code, "key": code.lower()},
+        ).first()
+        if row is None:
+            return None
+        self._load_product(db, row[0])
+        return row[0]
+
+    # ---- lookups and invalidation ----
+
+    def lookup(self, db, code: str) -> Optional[Dict]:
+        """Product, price, tax and FEFO-ordered unexpired batches for a scanned code"""
+        code = (code or "").strip()
+        key = code.lower()
+        if not key:
+            return None
+        product_id = self._codes.get(key)
+        if product_id is None:
+            self.misses += 1
+            product_id = self._load_by_code(db, code)
+            if product_id is None:
+                return None
+        elif product_id in self._stale:
+            self._load_product(db, product_id)
+        else:
+            self.hits += 1
+        entry = self._entries.get(product_id)
+        if entry is None:
+            return None
+        cutoff = sellable_cutoff()
+        result = {k: v for k, v in entry.items() if k != "batches"}
+        result["batches"] = [b for b in entry["batches"] if b["expiry_date"] is None or b["expiry_date"] >= cutoff]
+        return result
+
+    def invalidate(self, *product_ids):
+        """Mark products for reload; call after the writing transaction commits"""
+        with self._lock:
+            for product_id in product_ids:
+                if product_id:
+                    self._generation += 1
+                    self._stale[str(product_id)] = self._generation
+
+    # ---- background refresh ----
+
+    def start(self, session_factory: Callable):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(session_factory,), name="scan-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, session_factory: Callable):
+        while not self._stop.is_set():
+            db = session_factory()
+            try:
+                count = self.rebuild(db)
+                print(f"[INFO] Scan index built: {count} products in {self.last_build_ms:.0f} ms")
+            except Exception as e:
+                print(f"[WARN] Scan index rebuild failed: {e}")
+            finally:
+                db.close()
+            if SCAN_INDEX_REFRESH_SECONDS <= 0:
+                return
+            self._stop.wait(SCAN_INDEX_REFRESH_SECONDS)
+
+    def stats(self) -> Dict:
+        return {
+            "products": len(self._entries),
+            "codes": len(self._codes),
+            "stale": len(self._stale),
+            "hits": self.hits,
+            "reloads": self.reloads,
+            "misses": self.misses,
+            "last_build_ms": round(self.last_build_ms, 1),
+            "built_at": self.built_at,
+            "refresh_seconds": SCAN_INDEX_REFRESH_SECONDS,
+        }
+
+
+scan_index = ScanIndex()
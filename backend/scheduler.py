@@ -30,6 +30,19 @@ def run_scheduled_tasks():
     # Auto-reorder check - Monday at 9 AM
     schedule.every().monday.at("09:00").do(check_auto_reorder)
     
+    # Sync change log retention - daily at 3 AM
+    schedule.every().day.at("03:00").do(prune_sync_change_log)
+    
+    # Dispatched outbox events retention - daily at 3:30 AM
+    schedule.every().day.at("03:30").do(prune_outbox_events)
+    
+    # Stock ledger snapshot of balances at UTC midnight - hourly at :15, so the
+    # snapshot lands within the hour whatever the host's time zone (no-op once taken)
+    schedule.every().hour.at(":15").do(snapshot_stock_ledger)
+    
+    # Stock reconciliation of products touched since the last run - hourly
+    schedule.every().hour.do(reconcile_stock_levels)
+    
     print(f"[OK] Scheduler started at {datetime.now()}")
     print("[OK] Scheduled tasks:")
     print("  - Daily backup: 2:00 AM")
@@ -38,6 +51,10 @@ def run_scheduled_tasks():
     print("  - Daily summary: 6:00 PM")
     print("  - Refill reminders: 10:00 AM")
     print("  - Auto-reorder check: Monday 9:00 AM")
+    print("  - Sync change log pruning: 3:00 AM")
+    print("  - Outbox event pruning: 3:30 AM")
+    print("  - Stock ledger snapshot (UTC midnight): hourly at :15")
+    print("  - Stock reconciliation: hourly")
     print()
     
     while True:
@@ -115,6 +132,63 @@ def check_auto_reorder():
         print(f"[ERROR] Auto-reorder check failed: {e}")
 
 
+def prune_sync_change_log():
+    """Drop delta-sync change log entries past retention"""
+    print(f"\n[TASK] Pruning sync change log at {datetime.now()}")
+    try:
+        from sync_feed import prune_change_log
+        db = SessionLocal()
+        deleted = prune_change_log(db)
+        db.close()
+        print(f"[OK] Removed {deleted} change log entries")
+    except Exception as e:
+        print(f"[ERROR] Sync change log pruning failed: {e}")
+
+
+def prune_outbox_events():
+    """Drop dispatched domain events past retention"""
+    print(f"\n[TASK] Pruning outbox events at {datetime.now()}")
+    try:
+        from outbox import prune_domain_events
+        db = SessionLocal()
+        deleted = prune_domain_events(db)
+        db.close()
+        print(f"[OK] Removed {deleted} dispatched events")
+    except Exception as e:
+        print(f"[ERROR] Outbox event pruning failed: {e}")
+
+
+
+def snapshot_stock_ledger():
+    """Store every stock balance as of the last UTC midnight, if not stored yet"""
+    print(f"\n[TASK] Taking stock ledger snapshot at {datetime.now()}")
+    try:
+        from stock_ledger import take_stock_snapshot
+        db = SessionLocal()
+        written = take_stock_snapshot(db)
+        db.close()
+        if written:
+            print(f"[OK] Snapshot holds {written} balances")
+    except Exception as e:
+        print(f"[ERROR] Stock ledger snapshot failed: {e}")
+
+
+
+def reconcile_stock_levels():
+    """Report (and with STOCK_RECONCILE_AUTO_REPAIR, fix) stock drift since the last run"""
+    print(f"\n[TASK] Reconciling stock at {datetime.now()}")
+    try:
+        from stock_reconcile import STOCK_RECONCILE_AUTO_REPAIR, reconcile_stock
+        report = reconcile_stock(SessionLocal, "incremental", STOCK_RECONCILE_AUTO_REPAIR)
+        if report.get("skipped"):
+            print(f"[INFO] {report['reason']}")
+            return
+        print(f"[OK] {report['mode']}: {report['scanned']} products checked, "
+              f"{report['drift_count']} drifted, {report['repaired_count']} repaired")
+    except Exception as e:
+        print(f"[ERROR] Stock reconciliation failed: {e}")
+
+
 if __name__ == "__main__":
     run_scheduled_tasks()
 
@@ -3,6 +3,8 @@ Service Management API Routes
 """
 
 from fastapi import APIRouter, HTTPException, Depends, status
+from offload import OffloadRoute
+from document_numbers import service_invoice_number
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from typing import List, Optional
@@ -20,7 +22,7 @@ from service_models import (
     ServiceReviewCreate, ServiceReviewResponse
 )
 
-router = APIRouter(prefix="/api/services", tags=["Services"])
+router = APIRouter(prefix="/api/services", tags=["Services"], route_class=OffloadRoute)
 
 # Placeholder dependencies
 def get_db():
@@ -368,9 +370,8 @@ def create_service_invoice(
     current_user: dict = Depends(get_current_user)
 ):
     """Create a new service invoice"""
-    # Generate invoice number
-    count = db.query(func.count(ServiceInvoice.id)).scalar()
-    invoice_number = f"SI{datetime.now().strftime('%Y%m%d')}{str(count + 1).zfill(4)}"
+    # Generate invoice number (per-day counter; unique under concurrent requests)
+    invoice_number = service_invoice_number(db)
     
     db_invoice = ServiceInvoice(
         id=uuid.uuid4(),
@@ -0,0 +1,85 @@
+"""
+Short Codes
+Sale / purchase lookup by the short code on the receipt, or any id prefix
+
+Receipts print the first 8 characters of the sale id ("Invoice #1A2B3C4D").
+migrations/020_short_codes.sql stores that code in sales.short_code and
+purchases.short_code (unique per month, filled by a BEFORE INSERT trigger)
+under a text_pattern_ops index. A typed prefix becomes
+
+    WHERE short_code LIKE '1A2B%'
+
+an index range scan (a prefix longer than the code seeks on its first 8
+characters and is checked against the id), where the old `id = :x OR CAST(id AS TEXT) LIKE :x%`
+read the whole table. A full id is still matched exactly on the primary key.
+
+Without the migration (SQLite, or if it failed at startup) lookups fall back
+to the id prefix match.
+"""
+
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+
+SHORT_CODES_FILE = Path(__file__).parent / "migrations" / "020_short_codes.sql"
+SHORT_CODE_TABLES = ("sales", "purchases")
+
+_state = {"enabled": False}
+
+
+def ensure_short_codes(engine):
+    """Apply migration 020 (Postgres only); lookups use the id fallback until it succeeds"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql(SHORT_CODES_FILE.read_text(encoding="utf-8"))
+    _state["enabled"] = True
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def find_id(db, table: str, value: str) -> Optional[str]:
+    """Id of the row in `table` (sales or purchases) whose id or short code starts with `value`"""
+    if table not in SHORT_CODE_TABLES:
+        raise ValueError(f"No short codes on {table}")
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        full_id = str(uuid.UUID(value))
+    except ValueError:
+        full_id = None
+    if full_id:
+        row = db.execute(text(f"SELECT CAST(id AS TEXT) FROM {table} WHERE id = :id"), {"id": full_id}).first()
+        if row:
+            return row[0]
+
+    code = value.replace("-", "").upper()
+    params = {"prefix": _escape_like(code) + "%"}
+    # Matches the typed prefix against the whole id, whatever part of it the short code holds
+    id_prefix = "UPPER(REPLACE(CAST(id AS TEXT), '-', '')) LIKE :prefix ESCAPE '\\'"
+    if _state["enabled"]:
+        # Short codes are 8 characters (longer only on a clash), so a longer prefix
+        # seeks on its first 8 and is checked against the id
+        where = "short_code LIKE :prefix ESCAPE '\\'"
+        if len(code) > 8:
+            where = f"short_code LIKE :code_prefix ESCAPE '\\' AND {id_prefix}"
+            params["code_prefix"] = _escape_like(code[:8]) + "%"
+        # Most recent month first: the same 8-character code can recur across months
+        row = db.execute(text(f"""
+            SELECT CAST(id AS TEXT) FROM {table}
+            WHERE {where}
+            ORDER BY short_code_period DESC
+            LIMIT 1
+        """), params).first()
+    else:
+        row = db.execute(text(f"""
+            SELECT CAST(id AS TEXT) FROM {table}
+            WHERE {id_prefix}
+            LIMIT 1
+        """), params).first()
+    return row[0] if row else None
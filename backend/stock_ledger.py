@@ -0,0 +1,202 @@
+"""
+Stock Ledger
+Point-in-time stock and movement ranges from a running-balance ledger
+
+Triggers (migrations/022_stock_ledger.sql) append every change to
+products.stock_quantity, medicine_batches.quantity_remaining and
+product_stock.current_qty to stock_ledger with the balance after it, keyed by
+(level, product, batch, store). take_stock_snapshot() stores every balance
+once a day, at midnight UTC (scheduler.py).
+
+Stock as of T is the latest snapshot at or before T plus the last ledger row
+per key between that snapshot and T: an index seek for the snapshot and one
+index range scan bounded by a snapshot interval, instead of summing every
+stock transaction since the beginning. A movement range reads only the ledger
+rows inside the range (idx_stock_ledger_product), with the opening and
+closing balances from the same point-in-time lookup.
+
+Postgres only.
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+STOCK_LEDGER_FILE = Path(__file__).parent / "migrations" / "022_stock_ledger.sql"
+LEDGER_LEVELS = ("product", "batch", "store")
+
+_state = {"enabled": False}
+
+_SNAPSHOT_BEFORE_SQL = text("SELECT MAX(snapshot_at) FROM stock_ledger_snapshots WHERE snapshot_at <= :at")
+_FIRST_SNAPSHOT_SQL = text("SELECT MIN(snapshot_at) FROM stock_ledger_snapshots")
+
+
+def ensure_stock_ledger(engine):
+    """Apply migration 022 (idempotent) on Postgres"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql(STOCK_LEDGER_FILE.read_text(encoding="utf-8"))
+    _state["enabled"] = True
+
+
+def _require_ledger(db):
+    if not _state["enabled"] or db.get_bind().dialect.name != "postgresql":
+        raise HTTPException(status_code=503, detail="Stock ledger is not available on this database")
+
+
+def _balances_sql(level: Optional[str], product_id: Optional[str], store_id: Optional[str]) -> str:
+    """Last balance per key before :at, starting from the snapshot taken at :snap"""
+    filters = ""
+    if level:
+        filters += " AND level = :level"
+    if product_id:
+        filters += " AND product_id = :pid"
+    if store_id:
+        filters += " AND store_id = :sid"
+    return f"""
+        SELECT DISTINCT ON (level, product_id, batch_id, store_id)
+               level, product_id, batch_id, store_id, balance
+        FROM (
+            SELECT level, product_id, batch_id, store_id, balance, snapshot_at AS occurred_at, 0 AS id
+            FROM stock_ledger_snapshots
+            WHERE snapshot_at = :snap{filters}
+            UNION ALL
+            SELECT level, product_id, batch_id, store_id, balance, occurred_at, id
+            FROM stock_ledger
+            WHERE occurred_at >= :snap AND occurred_at < :at{filters}
+        ) u
+        ORDER BY level, product_id, batch_id, store_id, occurred_at DESC, id DESC
+    """
+
+
+def _balances(db, at: datetime, level: Optional[str] = None, product_id: Optional[str] = None,
+              store_id: Optional[str] = None) -> List[Dict]:
+    product_id = product_id.strip().lower() if product_id else None
+    store_id = store_id.strip().lower() if store_id else None
+    snap = db.execute(_SNAPSHOT_BEFORE_SQL, {"at": at}).scalar()
+    if snap is None:
+        first = db.execute(_FIRST_SNAPSHOT_SQL).scalar()
+        raise HTTPException(status_code=400, detail=f"Stock history starts at {first.isoformat() if first else 'the next snapshot'}")
+    rows = db.execute(text(_balances_sql(level, product_id, store_id)), {
+        "snap": snap, "at": at, "level": level, "pid": product_id, "sid": store_id,
+    }).mappings().all()
+    return [{
+        "level": r["level"],
+        "product_id": r["product_id"],
+        "batch_id": r["batch_id"],
+        "store_id": r["store_id"],
+        "quantity": float(r["balance"]),
+    } for r in rows if r["balance"]]
+
+
+def _check_level(level: str):
+    if level not in LEDGER_LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of: {', '.join(LEDGER_LEVELS)}")
+
+
+def stock_as_of(db, at: datetime, level: str = "product", product_id: Optional[str] = None,
+                store_id: Optional[str] = None) -> Dict:
+    """Non-zero balances at `level` just before `at`"""
+    _require_ledger(db)
+    _check_level(level)
+    items = _balances(db, at, level, product_id, store_id)
+    return {"as_of": at.isoformat(), "level": level, "count": len(items), "items": items}
+
+
+def stock_movements(db, product_id: str, start: datetime, end: datetime, level: str = "product",
+                    batch_id: Optional[str] = None, store_id: Optional[str] = None, limit: int = 1000) -> Dict:
+    """Opening and closing balances of a product and its ledger rows in [start, end)"""
+    _require_ledger(db)
+    _check_level(level)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    product_id = product_id.strip().lower()
+    batch_id = batch_id.strip().lower() if batch_id else None
+    store_id = store_id.strip().lower() if store_id else None
+
+    def keep(row):
+        return batch_id is None or row["batch_id"] == batch_id
+
+    opening = [b for b in _balances(db, start, level, product_id, store_id) if keep(b)]
+    closing = [b for b in _balances(db, end, level, product_id, store_id) if keep(b)]
+
+    filters = ""
+    if batch_id:
+        filters += " AND batch_id = :bid"
+    if store_id:
+        filters += " AND store_id = :sid"
+    params = {"pid": product_id, "level": level, "start": start, "end": end, "bid": batch_id, "sid": store_id}
+    totals = db.execute(text(f"""
+        SELECT COALESCE(SUM(quantity) FILTER (WHERE quantity > 0), 0) AS received,
+               COALESCE(-SUM(quantity) FILTER (WHERE quantity < 0), 0) AS issued,
+               COUNT(*) AS movements
+        FROM stock_ledger
+        WHERE product_id = :pid AND level = :level AND occurred_at >= :start AND occurred_at < :end{filters}
+    """), params).mappings().first()
+    rows = db.execute(text(f"""
+        SELECT id, batch_id, store_id, quantity, balance, txid, occurred_at
+        FROM stock_ledger
+        WHERE product_id = :pid AND level = :level AND occurred_at >= :start AND occurred_at < :end{filters}
+        ORDER BY occurred_at, id
+        LIMIT :limit
+    """), {**params, "limit": limit}).mappings().all()
+
+    return {
+        "product_id": product_id,
+        "level": level,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "opening": sum(b["quantity"] for b in opening),
+        "closing": sum(b["quantity"] for b in closing),
+        "received": float(totals["received"]),
+        "issued": float(totals["issued"]),
+        "movement_count": int(totals["movements"]),
+        "opening_balances": opening,
+        "closing_balances": closing,
+        "movements": [{
+            "id": r["id"],
+            "batch_id": r["batch_id"],
+            "store_id": r["store_id"],
+            "quantity": float(r["quantity"]),
+            "balance": float(r["balance"]),
+            "txid": r["txid"],
+            "occurred_at": r["occurred_at"].isoformat(),
+        } for r in rows],
+        "truncated": int(totals["movements"]) > len(rows),
+    }
+
+
+def take_stock_snapshot(db, at: Optional[datetime] = None) -> int:
+    """
+    Store every balance as of `at` from the previous snapshot plus the ledger
+    since; returns the rows written, 0 if a snapshot at `at` exists already.
+    `at` defaults to the most recent UTC midnight that has passed, whatever
+    the host's time zone, so calling this hourly (scheduler.py) is cheap and
+    the snapshot lands within an hour of midnight UTC.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return 0
+    at = at or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    exists = db.execute(text("SELECT 1 FROM stock_ledger_snapshots WHERE snapshot_at = :at LIMIT 1"), {"at": at}).first()
+    if exists:
+        return 0
+    snap = db.execute(_SNAPSHOT_BEFORE_SQL, {"at": at}).scalar()
+    if snap is None:
+        return 0
+    result = db.execute(text(f"""
+        INSERT INTO stock_ledger_snapshots (snapshot_at, level, product_id, batch_id, store_id, balance)
+        SELECT :at, level, product_id, batch_id, store_id, balance
+        FROM ({_balances_sql(None, None, None)}) b
+        WHERE balance <> 0
+    """), {"snap": snap, "at": at})
+    db.commit()
+    return result.rowcount
+
+
+def end_of_day(day) -> datetime:
+    """Midnight (UTC) after `day`: stock "on" a date is stock at the end of it"""
+    return datetime(day.year, day.month, day.day) + timedelta(days=1)
@@ -0,0 +1,256 @@
+"""
+Stock Reconciliation
+Find (and optionally repair) drift between the three places stock is kept
+
+products.stock_quantity, SUM(medicine_batches.quantity_remaining) and
+SUM(product_stock.current_qty) should agree for every product that has
+batches / store rows. Each check is one set-based query per product-id range
+(per-product batch and store totals joined to products), and the ranges run
+in parallel, each worker on its own session.
+
+Incremental runs only look at products whose stock changed since the last
+run: the stock ledger (migrations/022_stock_ledger.sql) records the
+transaction id of every change, and the watermark is the oldest transaction
+still in flight when the run started, so a change that commits late is
+picked up next time rather than skipped. The first run, and every run on a
+database without the ledger, is a full scan.
+
+Repair treats batches as the truth for batch-tracked products: the product
+total is set to the batch total, and a single product_stock row is set to
+the product total. Drift across several store rows is reported only; which
+store is wrong cannot be told from the totals. Repairs are conditional on
+the quantity still being the one that was checked, so a sale that lands
+mid-run is never overwritten.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, text
+
+STOCK_RECONCILE_WORKERS = int(os.getenv("STOCK_RECONCILE_WORKERS", "4"))
+STOCK_RECONCILE_AUTO_REPAIR = os.getenv("STOCK_RECONCILE_AUTO_REPAIR", "false").strip().lower() in ("1", "true", "yes")
+STOCK_RECONCILE_REPORT_LIMIT = 500
+
+STOCK_RECONCILE_FILE = Path(__file__).parent / "migrations" / "023_stock_reconciliation.sql"
+
+_state = {"incremental": False}
+
+_TOLERANCE = 0.0001
+
+
+def ensure_stock_reconciliation(engine):
+    """Apply migration 023 on Postgres (needs the stock ledger); other databases reconcile in full"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql(STOCK_RECONCILE_FILE.read_text(encoding="utf-8"))
+    _state["incremental"] = True
+
+
+def _where(column: str, unit: Dict) -> str:
+    if "ids" in unit:
+        return f"{column} IN :ids"
+    clauses = []
+    if unit.get("lo") is not None:
+        clauses.append(f"{column} >= :lo")
+    if unit.get("hi") is not None:
+        clauses.append(f"{column} < :hi")
+    return " AND ".join(clauses) or "1 = 1"
+
+
+def _compare_sql(unit: Dict):
+    sql = text(f"""
+        WITH b AS (
+            SELECT product_id, SUM(quantity_remaining) AS qty
+            FROM medicine_batches
+            WHERE {_where('product_id', unit)}
+            GROUP BY product_id
+        ), s AS (
+            SELECT product_id, SUM(current_qty) AS qty, COUNT(*) AS store_rows
+            FROM product_stock
+            WHERE {_where('product_id', unit)}
+            GROUP BY product_id
+        )
+        SELECT CAST(p.id AS TEXT) AS product_id, p.name, p.stock_quantity,
+               b.qty AS batch_total, s.qty AS store_total, s.store_rows
+        FROM products p
+        LEFT JOIN b ON b.product_id = p.id
+        LEFT JOIN s ON s.product_id = p.id
+        WHERE {_where('p.id', unit)}
+          AND ((b.qty IS NOT NULL AND ABS(b.qty - COALESCE(p.stock_quantity, 0)) > {_TOLERANCE})
+            OR (s.qty IS NOT NULL AND ABS(s.qty - COALESCE(p.stock_quantity, 0)) > {_TOLERANCE}))
+    """)
+    if "ids" in unit:
+        sql = sql.bindparams(bindparam("ids", expanding=True))
+    return sql
+
+
+def _ranges(workers: int) -> List[Dict]:
+    """Split the uuid key space into `workers` contiguous product-id ranges"""
+    bounds = [f"{(i << 32) // workers:08x}-0000-0000-0000-000000000000" for i in range(1, workers)]
+    los = [None] + bounds
+    his = bounds + [None]
+    return [{"lo": lo, "hi": hi} for lo, hi in zip(los, his)]
+
+
+def _id_chunks(ids: List[str], workers: int) -> List[Dict]:
+    """Contiguous slices of the sorted touched ids, one per worker"""
+    ids = sorted(ids)
+    size = max(1, -(-len(ids) // workers))
+    return [{"ids": ids[i:i + size]} for i in range(0, len(ids), size)]
+
+
+def _drift_entry(r) -> Dict:
+    stock = float(r["stock_quantity"] or 0)
+    return {
+        "product_id": r["product_id"],
+        "name": r["name"],
+        "stock_quantity": stock,
+        "batch_total": None if r["batch_total"] is None else float(r["batch_total"]),
+        "store_total": None if r["store_total"] is None else float(r["store_total"]),
+        "store_rows": int(r["store_rows"] or 0),
+        "repaired": False,
+    }
+
+
+def _case_update(db, table: str, key: str, column: str, changes: Dict[str, tuple]) -> set:
+    """Set `column` per key where it still holds the checked value; returns the keys changed"""
+    if not changes:
+        return set()
+    params, new_cases, old_cases, keys = {}, [], [], []
+    for i, (k, (old, new)) in enumerate(changes.items()):
+        params[f"k{i}"], params[f"o{i}"], params[f"n{i}"] = k, old, new
+        new_cases.append(f"WHEN :k{i} THEN :n{i}")
+        old_cases.append(f"WHEN :k{i} THEN :o{i}")
+        keys.append(f":k{i}")
+    rows = db.execute(text(f"""
+        UPDATE {table}
+        SET {column} = CASE {key} {' '.join(new_cases)} END, updated_at = CURRENT_TIMESTAMP
+        WHERE {key} IN ({', '.join(keys)})
+          AND COALESCE({column}, 0) = CASE {key} {' '.join(old_cases)} END
+        RETURNING CAST({key} AS TEXT)
+    """), params).all()
+    return {r[0] for r in rows}
+
+
+def _repair(db, rows: List, drift: List[Dict]):
+    """Conditional fixes for the drifted rows (compared against the raw values that were read)"""
+    products, stores = {}, {}
+    for r, d in zip(rows, drift):
+        target = d["stock_quantity"]
+        if d["batch_total"] is not None and abs(d["batch_total"] - target) > _TOLERANCE:
+            target = round(d["batch_total"])
+            products[d["product_id"]] = (r["stock_quantity"] or 0, target)
+        if d["store_total"] is not None and d["store_rows"] == 1 and abs(d["store_total"] - target) > _TOLERANCE:
+            stores[d["product_id"]] = (r["store_total"], target)
+    fixed_products = _case_update(db, "products", "id", "stock_quantity", products)
+    fixed_stores = _case_update(db, "product_stock", "product_id", "current_qty", stores)
+    for d in drift:
+        pid = d["product_id"]
+        wanted = (pid in products) + (pid in stores)
+        done = (pid in fixed_products) + (pid in fixed_stores)
+        d["repaired"] = wanted > 0 and done == wanted
+
+
+def _check_unit(session_factory, unit: Dict, repair: bool) -> Dict:
+    db = session_factory()
+    try:
+        params = dict(unit)
+        rows = db.execute(_compare_sql(unit), params).mappings().all()
+        drift = [_drift_entry(r) for r in rows]
+        if "ids" in unit:
+            scanned = len(unit["ids"])
+        else:
+            scanned = db.execute(text(f"SELECT COUNT(*) FROM products p WHERE {_where('p.id', unit)}"), params).scalar()
+        if repair and drift:
+            _repair(db, rows, drift)
+        db.commit()
+        return {"scanned": int(scanned or 0), "drift": drift}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _run_units(session_factory, units: List[Dict], repair: bool, workers: int) -> List[Dict]:
+    if len(units) <= 1:
+        return [_check_unit(session_factory, u, repair) for u in units]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reconcile") as pool:
+        return list(pool.map(lambda u: _check_unit(session_factory, u, repair), units))
+
+
+def reconcile_stock(session_factory, mode: str = "incremental", repair: bool = False,
+                    workers: int = STOCK_RECONCILE_WORKERS) -> Dict:
+    """
+    Check products against their batch and store totals. `mode` is
+    'incremental' (products whose stock changed since the last run) or 'full'.
+    Returns the report; a run already in progress yields {"skipped": True}.
+    """
+    started = time.perf_counter()
+    workers = max(1, workers)
+    db = session_factory()
+    try:
+        incremental_ok = _state["incremental"] and db.get_bind().dialect.name == "postgresql"
+        watermark = upto = None
+        if incremental_ok:
+            # Holding the state row for the whole run keeps two runs from overlapping
+            state = db.execute(text(
+                "SELECT watermark FROM stock_reconciliation_state WHERE id = 1 FOR UPDATE SKIP LOCKED"
+            )).first()
+            if state is None:
+                db.rollback()
+                return {"skipped": True, "reason": "A reconciliation is already running"}
+            watermark = state[0]
+            upto = db.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar()
+
+        if mode == "incremental" and incremental_ok and watermark is not None:
+            touched = [r[0] for r in db.execute(text("""
+                SELECT DISTINCT product_id FROM stock_ledger WHERE txid >= :wm AND txid < :upto
+            """), {"wm": watermark, "upto": upto})]
+            units = _id_chunks(touched, workers) if touched else []
+            mode_run = "incremental"
+        else:
+            units = _ranges(workers)
+            mode_run = "full"
+
+        results = _run_units(session_factory, units, repair, workers)
+        drift = [d for r in results for d in r["drift"]]
+        report = {
+            "mode": mode_run,
+            "repair": repair,
+            "scanned": sum(r["scanned"] for r in results),
+            "drift_count": len(drift),
+            "repaired_count": sum(1 for d in drift if d["repaired"]),
+            "watermark": upto,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "finished_at": datetime.utcnow().isoformat(),
+            "drift": drift[:STOCK_RECONCILE_REPORT_LIMIT],
+        }
+        if incremental_ok:
+            db.execute(text("""
+                UPDATE stock_reconciliation_state
+                SET watermark = :upto, last_run_at = CURRENT_TIMESTAMP, last_report = CAST(:report AS JSONB)
+                WHERE id = 1
+            """), {"upto": upto, "report": json.dumps(report, default=str)})
+        db.commit()
+        return report
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def last_reconciliation(db) -> Optional[Dict]:
+    """Report of the last run (Postgres only)"""
+    if not _state["incremental"]:
+        return None
+    row = db.execute(text("SELECT last_report FROM stock_reconciliation_state WHERE id = 1")).first()
+    return row[0] if row else None
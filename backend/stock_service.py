@@ -0,0 +1,77 @@
+"""
+Stock Service
+Race-free changes to products.stock_quantity
+
+Every change is a single UPDATE that does the arithmetic in the database and,
+for removals, only matches while enough stock is left:
+
+    UPDATE products SET stock_quantity = stock_quantity - :q
+    WHERE id = :id AND stock_quantity >= :q
+    RETURNING stock_quantity
+
+Two tills selling the last unit can no longer both read 1 and both write 0,
+and the row is locked from the UPDATE to the commit rather than from a read
+in Python onwards. Callers commit.
+"""
+
+from typing import Dict
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+
+def _not_applied(db, product_id: str):
+    exists = db.execute(text("SELECT 1 FROM products WHERE id = :pid"), {"pid": product_id}).first()
+    if exists is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    raise HTTPException(status_code=400, detail="Insufficient stock quantity")
+
+
+def adjust_stock(db, product_id: str, delta: int) -> int:
+    """Add `delta` units (negative to remove) to one product; returns the new quantity"""
+    product_id = str(product_id)
+    if delta >= 0:
+        sql = """
+            UPDATE products SET stock_quantity = COALESCE(stock_quantity, 0) + :delta, updated_at = CURRENT_TIMESTAMP
+            WHERE id = :pid
+            RETURNING stock_quantity
+        """
+    else:
+        sql = """
+            UPDATE products SET stock_quantity = stock_quantity + :delta, updated_at = CURRENT_TIMESTAMP
+            WHERE id = :pid AND stock_quantity >= :needed
+            RETURNING stock_quantity
+        """
+    row = db.execute(text(sql), {"pid": product_id, "delta": int(delta), "needed": -int(delta)}).first()
+    if row is None:
+        _not_applied(db, product_id)
+    return int(row[0])
+
+
+def apply_stock_changes(db, deltas: Dict[str, int], require_all: bool = True) -> Dict[str, int]:
+    """
+    Apply several per-product deltas in one conditional UPDATE; returns
+    {product_id: new quantity} for the rows changed. With `require_all`, a
+    product that is missing or would go negative raises 409 (roll back).
+    """
+    deltas = {str(pid): int(d) for pid, d in deltas.items() if d}
+    if not deltas:
+        return {}
+    params, cases, ids = {}, [], []
+    for i, (pid, delta) in enumerate(deltas.items()):
+        params[f"p{i}"], params[f"d{i}"] = pid, delta
+        cases.append(f"WHEN :p{i} THEN :d{i}")
+        ids.append(f":p{i}")
+    delta_expr = f"CASE id {' '.join(cases)} END"
+    rows = db.execute(text(f"""
+        UPDATE products
+        SET stock_quantity = COALESCE(stock_quantity, 0) + {delta_expr},
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id IN ({', '.join(ids)}) AND COALESCE(stock_quantity, 0) + {delta_expr} >= 0
+        RETURNING CAST(id AS TEXT), stock_quantity
+    """), params).all()
+    applied = {str(r[0]): int(r[1]) for r in rows}
+    if require_all and len(applied) != len(deltas):
+        raise HTTPException(status_code=409, detail="Stock changed concurrently; please retry")
+    return applied
+
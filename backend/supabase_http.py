@@ -0,0 +1,149 @@
+"""
+Supabase HTTP Client
+Shared keep-alive session with bounded concurrency and a circuit breaker
+for Supabase REST (PostgREST) and Auth (GoTrue) calls
+"""
+
+import os
+import threading
+import time
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+SUPABASE_HTTP_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_HTTP_CONNECT_TIMEOUT", "3"))
+SUPABASE_HTTP_READ_TIMEOUT = float(os.getenv("SUPABASE_HTTP_READ_TIMEOUT", "6"))
+SUPABASE_HTTP_POOL_SIZE = int(os.getenv("SUPABASE_HTTP_POOL_SIZE", "20"))
+SUPABASE_HTTP_MAX_CONCURRENCY = int(os.getenv("SUPABASE_HTTP_MAX_CONCURRENCY", "16"))
+SUPABASE_HTTP_QUEUE_TIMEOUT = float(os.getenv("SUPABASE_HTTP_QUEUE_TIMEOUT", "2"))
+SUPABASE_BREAKER_FAILURES = int(os.getenv("SUPABASE_BREAKER_FAILURES", "5"))
+SUPABASE_BREAKER_RESET_SECONDS = float(os.getenv("SUPABASE_BREAKER_RESET_SECONDS", "30"))
+
+
+class SupabaseUnavailable(RequestException):
+    """Raised without touching the network when the breaker is open or the client is saturated"""
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half_open after reset timeout"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.short_circuited = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                # Let exactly one probe through; everyone else keeps failing fast
+                self._trial_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def abandon_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[WARN] Supabase circuit opened after {self.consecutive_failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class SupabaseHTTPClient:
+    """requests.Session wrapper used for every outbound Supabase call"""
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SUPABASE_HTTP_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (SUPABASE_HTTP_CONNECT_TIMEOUT, SUPABASE_HTTP_READ_TIMEOUT)
+        self.breaker = CircuitBreaker(SUPABASE_BREAKER_FAILURES, SUPABASE_BREAKER_RESET_SECONDS)
+        self._slots = threading.BoundedSemaphore(max(1, SUPABASE_HTTP_MAX_CONCURRENCY))
+        self._stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if not self.breaker.allow():
+            raise SupabaseUnavailable("Supabase circuit is open")
+        if not self._slots.acquire(timeout=SUPABASE_HTTP_QUEUE_TIMEOUT):
+            with self._stats_lock:
+                self.rejected += 1
+            self.breaker.abandon_trial()
+            raise SupabaseUnavailable("Too many concurrent Supabase requests")
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            with self._stats_lock:
+                self.requests_sent += 1
+            resp = self.session.request(method, url, **kwargs)
+        except RequestException:
+            self._failed()
+            raise
+        finally:
+            self._slots.release()
+        if resp.status_code >= 500:
+            self._failed()
+        else:
+            self.breaker.record_success()
+        return resp
+
+    def _failed(self):
+        with self._stats_lock:
+            self.failures += 1
+        self.breaker.record_failure()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", url, **kwargs)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "breaker_state": self.breaker.state,
+                "consecutive_failures": self.breaker.consecutive_failures,
+                "short_circuited": self.breaker.short_circuited,
+                "requests_sent": self.requests_sent,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "max_concurrency": SUPABASE_HTTP_MAX_CONCURRENCY,
+                "timeout_seconds": list(self.timeout),
+            }
+
+
+supabase_http = SupabaseHTTPClient()
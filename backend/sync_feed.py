@@ -0,0 +1,161 @@
+"""
+Delta Sync Feed
+Incremental catalogue/stock/price/customer changes for POS terminals
+
+Triggers (migrations/016_sync_change_log.sql) append every change to
+products, medicine_batches, discount_configs and customers to change_log,
+with the row as it stands after the change. The sync token is the oldest
+transaction id still in flight when the feed was read: every change from a
+transaction below the token has committed (or rolled back) and been served,
+so polling with the returned token never skips a late commit.
+
+txid order is not commit order for one row (a transaction that started
+earlier can update it later), so the log only says which rows changed:
+within a page the highest seq per row decides upsert or delete (seq is taken
+under the row lock), and upserts carry the row as it is now, read from its
+table, so an older entry on a later page can never roll a terminal back.
+
+Postgres only; other databases get `full_resync: true` on every call.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, text
+
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "2000"))
+SYNC_CHANGE_LOG_RETENTION_DAYS = int(os.getenv("SYNC_CHANGE_LOG_RETENTION_DAYS", "7"))
+
+SYNC_ENTITIES = ("products", "batches", "discount_configs", "customers")
+
+SYNC_SCHEMA_FILE = Path(__file__).parent / "migrations" / "016_sync_change_log.sql"
+
+# Feed entity -> the table its live rows are read from
+_ENTITY_TABLES = {
+    "products": "products",
+    "batches": "medicine_batches",
+    "discount_configs": "discount_configs",
+    "customers": "customers",
+}
+
+# One round trip: the safe upper bound, the prune watermark and the next slice of changes
+_FEED_SQL = """
+    WITH bounds AS (
+        SELECT txid_snapshot_xmin(txid_current_snapshot()) AS upto,
+               COALESCE((SELECT pruned_before FROM sync_state WHERE id = 1), 0) AS pruned_before
+    )
+    SELECT b.upto, b.pruned_before, c.seq, c.txid, c.entity, c.entity_id, c.op, c.payload
+    FROM bounds b
+    LEFT JOIN LATERAL (
+        SELECT seq, txid, entity, entity_id, op, payload
+        FROM change_log
+        WHERE txid >= :since AND txid < b.upto
+        ORDER BY txid, seq
+        LIMIT :limit
+    ) c ON TRUE
+"""
+
+_TX_SQL = """
+    SELECT seq, txid, entity, entity_id, op, payload
+    FROM change_log
+    WHERE txid = :txid
+    ORDER BY seq
+"""
+
+
+def ensure_sync_schema(engine):
+    """Apply migration 016 (idempotent) on Postgres"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql(SYNC_SCHEMA_FILE.read_text(encoding="utf-8"))
+
+
+def _empty_changes() -> Dict:
+    return {entity: {"upserts": [], "deletes": []} for entity in SYNC_ENTITIES}
+
+
+def _resync(token: int) -> Dict:
+    return {"token": token, "full_resync": True, "has_more": False, "changes": _empty_changes()}
+
+
+def get_changes(db, since: Optional[int], limit: int = SYNC_MAX_CHANGES) -> Dict:
+    """
+    Changes committed since `since`, coalesced to the current state per row.
+    Without a token (or with one older than the retained log) the caller is
+    told to reload in full and given the token to continue from.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return _resync(0)
+    limit = max(1, min(limit, SYNC_MAX_CHANGES))
+    rows = db.execute(text(_FEED_SQL), {"since": since or 0, "limit": limit + 1}).mappings().all()
+    upto, pruned_before = rows[0]["upto"], rows[0]["pruned_before"]
+    if since is None or since < pruned_before:
+        return _resync(upto)
+
+    entries = [r for r in rows if r["seq"] is not None]
+    has_more = len(entries) > limit
+    token = upto
+    if has_more:
+        # Never split a transaction across pages: stop before the last one seen
+        boundary = entries[limit]["txid"]
+        entries = [r for r in entries[:limit] if r["txid"] < boundary]
+        if not entries:
+            # A single transaction larger than the page; send it whole
+            entries = db.execute(text(_TX_SQL), {"txid": boundary}).mappings().all()
+            boundary += 1
+        token = boundary
+
+    latest: Dict[tuple, dict] = {}
+    for entry in entries:
+        key = (entry["entity"], entry["entity_id"])
+        if key not in latest or entry["seq"] > latest[key]["seq"]:
+            latest[key] = entry
+    changes = _empty_changes()
+    upsert_ids: Dict[str, list] = {}
+    for (entity, entity_id), entry in latest.items():
+        if entity not in changes:
+            continue
+        if entry["op"] == "delete":
+            changes[entity]["deletes"].append(entity_id)
+        else:
+            upsert_ids.setdefault(entity, []).append(entity_id)
+    for entity, ids in upsert_ids.items():
+        live = _live_rows(db, entity, ids)
+        changes[entity]["upserts"].extend(live[i] for i in ids if i in live)
+        # Deleted since the logged change; its delete entry may be on a later page
+        changes[entity]["deletes"].extend(i for i in ids if i not in live)
+    return {"token": token, "full_resync": False, "has_more": has_more, "changes": changes}
+
+
+def _live_rows(db, entity: str, ids: list) -> Dict[str, dict]:
+    """{id: current row as JSON} for the rows of `entity` that still exist"""
+    sql = text(f"""
+        SELECT CAST(t.id AS TEXT) AS id, to_jsonb(t) AS row
+        FROM {_ENTITY_TABLES[entity]} t
+        WHERE t.id IN :ids
+    """).bindparams(bindparam("ids", expanding=True))
+    return {r["id"]: r["row"] for r in db.execute(sql, {"ids": ids}).mappings()}
+
+
+def prune_change_log(db, retention_days: int = SYNC_CHANGE_LOG_RETENTION_DAYS) -> int:
+    """Delete change_log rows past retention and raise the resync watermark; returns rows deleted"""
+    if db.get_bind().dialect.name != "postgresql":
+        return 0
+    result = db.execute(text("""
+        WITH deleted AS (
+            DELETE FROM change_log
+            WHERE changed_at < now() - make_interval(days => :days)
+            RETURNING txid
+        ), counted AS (
+            SELECT COUNT(*) AS n, MAX(txid) AS max_txid FROM deleted
+        ), bumped AS (
+            UPDATE sync_state SET pruned_before = GREATEST(pruned_before, counted.max_txid + 1)
+            FROM counted
+            WHERE sync_state.id = 1 AND counted.max_txid IS NOT NULL
+        )
+        SELECT n FROM counted
+    """), {"days": retention_days}).scalar()
+    db.commit()
+    return int(result or 0)